@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+'''
+  Local stand-in for gvmd: listens on a Unix socket and speaks enough GMP for
+  the client and the entrypoint orchestration (authenticate, targets, configs,
+  tasks, start_task, reports, overrides, NVT families and feeds, modify and
+  delete of targets, tasks and overrides).
+
+  python3 benchmarks/fake_gvmd.py --socket /tmp/gvmd.sock --tasks 100 --latency 0.005
+'''
+
+import os
+import re
+import uuid
+import argparse
+import logging
+import socket
+import threading
+import socketserver
+import datetime
+import lxml.etree as ET
+from time import sleep, time
+
+default_config_id = 'daba56c8-73ec-11df-a475-002264764cea'
+default_scanner_id = '08b69003-5fc2-4037-a479-93b440211c73'
+
+def new_id():
+  return str(uuid.uuid4())
+
+def timestamp(seconds=None):
+  return datetime.datetime.utcfromtimestamp(seconds or time()).strftime(r'%Y-%m-%dT%H:%M:%SZ')
+
+def sub(parent, tag, text=None, **attrib):
+  element = ET.SubElement(parent, tag, **attrib)
+  if text != None:
+    element.text = str(text)
+  return element
+
+def parse_filter(term):
+  '''
+    Returns (first, rows, uuids, keywords) of a GMP filter term
+  '''
+  keywords = dict(re.findall(r'(\w+)=(\S+)', term or ''))
+  uuids = set(re.findall(r'uuid=(\S+)', term or ''))
+  first = max(1, int(keywords.get('first', 1)))
+  rows = int(keywords.get('rows', -1))
+  return first, rows, uuids, keywords
+
+class Fake_task:
+  def __init__(self, name, target_id, config_id, comment=None, container=False):
+    self.id = new_id()
+    self.name = name
+    self.comment = comment
+    self.target_id = '' if container else target_id
+    self.config_id = '' if container else config_id
+    self.status = 'Done' if container else 'New'
+    self.started = None
+    self.current_report_id = None
+    self.last_report_id = None
+    self.hosts_ordering = None
+    self.preferences = {'max_checks': '4', 'max_hosts': '20'}
+
+class Fake_report:
+  def __init__(self, task, result_count, name=None):
+    self.id = new_id()
+    self.task_id = task.id
+    self.task_name = task.name
+    self.name = name or timestamp()
+    self.result_count = result_count
+    # shifts severities, so that consecutive reports of a task can differ
+    self.revision = 0
+
+class Fake_gvmd:
+  '''
+    In-memory gvmd state.
+    latency: seconds added before every response
+    scan_secs: how long a started task takes to reach Done
+    results_per_report: results in reports produced by scans
+    sync_secs: NVTs are loaded gradually during this time after start,
+      the feed is syncing in the first half and the scanner answers once all are loaded
+  '''
+  def __init__(self, latency=0.0, scan_secs=2.0, results_per_report=100, sync_secs=0.0, nvts=60000):
+    self.latency = latency
+    self.scan_secs = scan_secs
+    self.results_per_report = results_per_report
+    self.lock = threading.RLock()
+    self.targets = {}
+    self.configs = {default_config_id: 'Full and fast'}
+    self.tasks = {}
+    self.trash_tasks = {}
+    self.reports = {}
+    self.overrides = {}
+    self.stats = {}
+    self.nvt_families = 60
+    self.nvts = nvts
+    self.sync_secs = sync_secs
+    self.started = time()
+
+  def seed(self, tasks=0, reports_per_task=0, results_per_report=None):
+    for n in range(tasks):
+      target_id = new_id()
+      self.targets[target_id] = {'name': 'task-{}'.format(n), 'hosts': '10.0.{}.0/24'.format(n % 256), 'comment': None}
+      task = Fake_task('task-{}'.format(n), target_id, default_config_id)
+      self.tasks[task.id] = task
+      for _ in range(reports_per_task):
+        report = Fake_report(task, results_per_report or self.results_per_report)
+        self.reports[report.id] = report
+        task.last_report_id = report.id
+        task.status = 'Done'
+    return self
+
+  def count(self, name):
+    with self.lock:
+      self.stats[name] = self.stats.get(name, 0) + 1
+
+  def advance(self, task):
+    if task.status in ['Requested', 'Running']:
+      progress = (time() - task.started) / self.scan_secs if self.scan_secs > 0 else 1
+      if progress >= 1:
+        report = self.reports[task.current_report_id]
+        report.result_count = self.results_per_report
+        task.last_report_id = report.id
+        task.current_report_id = None
+        task.status = 'Done'
+      else:
+        task.status = 'Running'
+    return task
+
+  def progress(self, task):
+    if task.status == 'Running':
+      return int(min(99, (time() - task.started) / self.scan_secs * 100))
+    return -1 if task.status != 'Done' else 100
+
+  # responses
+
+  def response(self, command, status='200', status_text='OK', **attrib):
+    return ET.Element('{}_response'.format(command), status=status, status_text=status_text, **attrib)
+
+  def handle(self, command, authenticated):
+    '''
+      Returns (authenticated, iterable of response bytes)
+    '''
+    self.count(command.tag)
+    if self.latency > 0:
+      sleep(self.latency)
+    if command.tag == 'authenticate':
+      if command.findtext('credentials/username') and command.findtext('credentials/password'):
+        return True, [ET.tostring(self.response('authenticate'))]
+      return False, [ET.tostring(self.response('authenticate', '400', 'Authentication failed'))]
+    if command.tag == 'get_version':
+      response = self.response('get_version')
+      sub(response, 'version', '8.0')
+      return authenticated, [ET.tostring(response)]
+    if not authenticated:
+      return False, [ET.tostring(self.response(command.tag[:], '400', 'Authenticate first'))]
+    handler = getattr(self, 'gmp_{}'.format(command.tag), None)
+    if handler == None:
+      return True, [ET.tostring(self.response(command.tag, '400', 'Bogus command name'))]
+    with self.lock:
+      response = handler(command)
+    if isinstance(response, ET._Element):
+      response = [ET.tostring(response)]
+    return True, response
+
+  target_fields = ('hosts', 'exclude_hosts', 'comment', 'alive_tests', 'reverse_lookup_only', 'reverse_lookup_unify')
+
+  def gmp_get_targets(self, command):
+    _, rows, uuids, _ = parse_filter(command.get('filter'))
+    response = self.response('get_targets')
+    for target_id, target in self.targets.items():
+      if uuids and target_id not in uuids:
+        continue
+      element = sub(response, 'target', id=target_id)
+      sub(element, 'name', target['name'])
+      for field in self.target_fields:
+        sub(element, field, target.get(field))
+      sub(element, 'port_list', id=target.get('port_list_id') or '')
+      sub(element, 'in_use', '1' if self.target_in_use(target_id) else '0')
+    return response
+
+  def target_in_use(self, target_id):
+    return any(task.target_id == target_id for task in self.tasks.values())
+
+  def gmp_create_target(self, command):
+    name = command.findtext('name')
+    if name in [target['name'] for target in self.targets.values()]:
+      if command.find('name/make_unique') == None or command.findtext('name/make_unique') == '0':
+        return self.response('create_target', '400', 'Target exists already')
+      name = '{} {}'.format(name, len(self.targets))
+    target_id = new_id()
+    self.targets[target_id] = {'name': name, 'reverse_lookup_only': '0', 'reverse_lookup_unify': '0'}
+    self.set_target_fields(self.targets[target_id], command)
+    return self.response('create_target', '201', 'OK, resource created', id=target_id)
+
+  def set_target_fields(self, target, command):
+    for field in self.target_fields:
+      if command.find(field) != None:
+        target[field] = command.findtext(field)
+    if command.find('port_list') != None:
+      target['port_list_id'] = command.find('port_list').get('id')
+
+  def gmp_modify_target(self, command):
+    target = self.targets.get(command.get('target_id'))
+    if target == None:
+      return self.response('modify_target', '404', 'Failed to find target')
+    # like gvmd, only name and comment of a target in use can change
+    if self.target_in_use(command.get('target_id')) and \
+      any(child.tag not in ('name', 'comment') for child in command):
+      return self.response('modify_target', '400', 'Target is in use')
+    if command.findtext('name'):
+      target['name'] = command.findtext('name')
+    self.set_target_fields(target, command)
+    return self.response('modify_target', '200', 'OK')
+
+  def gmp_delete_target(self, command):
+    if command.get('target_id') not in self.targets:
+      return self.response('delete_target', '404', 'Failed to find target')
+    # tasks in the trashcan keep their target too
+    if self.target_in_use(command.get('target_id')) or \
+      any(task.target_id == command.get('target_id') for task in self.trash_tasks.values()):
+      return self.response('delete_target', '400', 'Target is in use')
+    del self.targets[command.get('target_id')]
+    return self.response('delete_target', '200', 'OK')
+
+  def gmp_get_configs(self, command):
+    response = self.response('get_configs')
+    for config_id, name in self.configs.items():
+      sub(sub(response, 'config', id=config_id), 'name', name)
+    return response
+
+  def gmp_create_config(self, command):
+    config_id = new_id()
+    self.configs[config_id] = command.findtext('.//config/name') or command.findtext('name')
+    return self.response('create_config', '201', 'OK, resource created', id=config_id)
+
+  def task_element(self, parent, task, details=True):
+    self.advance(task)
+    element = sub(parent, 'task', id=task.id)
+    sub(element, 'name', task.name)
+    sub(element, 'comment', task.comment)
+    config = sub(element, 'config', id=task.config_id)
+    sub(config, 'name', self.configs.get(task.config_id, ''))
+    target = sub(element, 'target', id=task.target_id)
+    sub(target, 'name', self.targets.get(task.target_id, {}).get('name', ''))
+    sub(sub(element, 'scanner', id='' if task.target_id == '' else default_scanner_id), 'name', 'OpenVAS Default')
+    sub(element, 'alterable', '0')
+    sub(element, 'status', task.status)
+    sub(element, 'progress', self.progress(task))
+    if task.current_report_id != None:
+      sub(sub(sub(element, 'current_report'), 'report', id=task.current_report_id), 'timestamp', timestamp(task.started))
+    if task.last_report_id != None:
+      report = self.reports[task.last_report_id]
+      sub(sub(sub(element, 'last_report'), 'report', id=report.id), 'timestamp', report.name)
+    sub(element, 'hosts_ordering', task.hosts_ordering)
+    sub(element, 'report_count', sum(1 for report in self.reports.values() if report.task_id == task.id))
+    if details:
+      preferences = sub(element, 'preferences')
+      for name, value in sorted(task.preferences.items()):
+        preference = sub(preferences, 'preference')
+        sub(preference, 'scanner_name', name)
+        sub(preference, 'value', value)
+    return element
+
+  def gmp_get_tasks(self, command):
+    _, rows, uuids, _ = parse_filter(command.get('filter'))
+    if command.get('task_id'):
+      uuids = set([command.get('task_id')])
+      if command.get('task_id') not in self.tasks:
+        return self.response('get_tasks', '404', 'Failed to find task')
+    details = command.get('details', '1') != '0'
+    response = self.response('get_tasks')
+    for task in list(self.tasks.values()):
+      if uuids and task.id not in uuids:
+        continue
+      self.task_element(response, task, details)
+    return response
+
+  def gmp_create_task(self, command):
+    container = command.find('target') != None and command.find('target').get('id') == '0'
+    task = Fake_task(command.findtext('name'),
+      command.find('target').get('id') if command.find('target') != None else None,
+      command.find('config').get('id') if command.find('config') != None else None,
+      command.findtext('comment'), container=container)
+    if not container and task.target_id not in self.targets:
+      return self.response('create_task', '404', 'Failed to find target')
+    task.hosts_ordering = command.findtext('hosts_ordering')
+    for preference in command.iterfind('preferences/preference'):
+      task.preferences[preference.findtext('scanner_name')] = preference.findtext('value')
+    self.tasks[task.id] = task
+    return self.response('create_task', '201', 'OK, resource created', id=task.id)
+
+  def gmp_modify_task(self, command):
+    task = self.tasks.get(command.get('task_id'))
+    if task == None:
+      return self.response('modify_task', '404', 'Failed to find task')
+    if task.status in ['Requested', 'Running']:
+      return self.response('modify_task', '400', 'Task is active')
+    for field in ['name', 'comment', 'hosts_ordering']:
+      if command.find(field) != None:
+        setattr(task, field, command.findtext(field))
+    if command.find('target') != None:
+      task.target_id = command.find('target').get('id')
+    if command.find('config') != None:
+      task.config_id = command.find('config').get('id')
+    for preference in command.iterfind('preferences/preference'):
+      task.preferences[preference.findtext('scanner_name')] = preference.findtext('value')
+    return self.response('modify_task', '200', 'OK')
+
+  def gmp_delete_task(self, command):
+    task = self.tasks.pop(command.get('task_id'), None)
+    if task == None:
+      return self.response('delete_task', '404', 'Failed to find task')
+    if command.get('ultimate') != '1':
+      self.trash_tasks[task.id] = task
+    return self.response('delete_task', '200', 'OK')
+
+  def gmp_start_task(self, command):
+    task = self.tasks.get(command.get('task_id'))
+    if task == None:
+      return self.response('start_task', '404', 'Failed to find task')
+    if task.status in ['Requested', 'Running']:
+      return self.response('start_task', '400', 'Task is active already')
+    report = Fake_report(task, 0)
+    self.reports[report.id] = report
+    task.current_report_id = report.id
+    task.started = time()
+    task.status = 'Requested'
+    response = self.response('start_task', '202', 'OK, request submitted')
+    sub(response, 'report_id', report.id)
+    return response
+
+  def result_values(self, report, n):
+    '''
+      Returns (severity, threat, qod) of result n of a report
+    '''
+    level = (n + report.revision) % 5
+    return [0.0, 2.6, 5.0, 7.5, 10.0][level], ['Log', 'Low', 'Medium', 'High', 'High'][level], [30, 70, 80, 95][n % 4]
+
+  def report_numbers(self, report, term):
+    '''
+      Returns the numbers of the report results matching the min_qod and severity> keywords of a filter
+    '''
+    _, _, _, keywords = parse_filter(term)
+    min_qod = int(keywords.get('min_qod', 0))
+    above = re.search(r'severity>(-?[\d.]+)', term or '')
+    above = float(above.group(1)) if above else None
+    if not min_qod and above == None:
+      return range(1, report.result_count + 1)
+    numbers = []
+    for n in range(1, report.result_count + 1):
+      severity, _, qod = self.result_values(report, n)
+      if qod >= min_qod and (above == None or severity > above):
+        numbers.append(n)
+    return numbers
+
+  def level_counts(self, report, numbers):
+    '''
+      Returns the <hole>, <warning>, <info> and <log> counts of result_count
+    '''
+    counts = {}
+    for key, results in [('full', range(1, report.result_count + 1)), ('filtered', numbers)]:
+      for n in results:
+        threat = self.result_values(report, n)[1]
+        counts[threat, key] = counts.get((threat, key), 0) + 1
+    return ''.join('<{tag}><full>{full}</full><filtered>{filtered}</filtered></{tag}>'.format(tag=tag,
+      full=counts.get((threat, 'full'), 0), filtered=counts.get((threat, 'filtered'), 0))
+      for threat, tag in [('High', 'hole'), ('Medium', 'warning'), ('Low', 'info'), ('Log', 'log')])
+
+  def report_chunks(self, report, first, rows, numbers=None):
+    '''
+      Generates the report piece by piece, so large reports are never built whole
+    '''
+    numbers = numbers if numbers != None else range(1, report.result_count + 1)
+    page = numbers[first - 1:] if rows < 0 else numbers[first - 1:first - 1 + max(0, rows)]
+    yield ('<get_reports_response status="200" status_text="OK">'
+      '<report id="{id}" format_id="a994b278-1f62-11e1-96ac-406186ea4fc5" extension="xml" content_type="text/xml">'
+      '<owner><name>admin</name></owner><name>{name}</name><task id="{task_id}"><name>{task_name}</name></task>'
+      '<report id="{id}"><scan_run_status>Done</scan_run_status>'
+      '<result_count>{total}<full>{total}</full><filtered>{filtered}</filtered>{levels}</result_count>'
+      '<results start="{first}" max="{rows}">').format(id=report.id, name=report.name, task_id=report.task_id,
+        task_name=report.task_name, total=report.result_count, filtered=len(numbers),
+        levels=self.level_counts(report, numbers), first=first, rows=rows).encode('utf-8')
+    batch = []
+    for n in page:
+      severity, threat, qod = self.result_values(report, n)
+      batch.append(('<result id="{report}-{n}"><name>Result {n}</name><host>10.0.{a}.{b}<hostname>host-{n}</hostname></host>'
+        '<port>{port}/tcp</port><nvt oid="1.3.6.1.4.1.25623.1.0.{oid}"><type>nvt</type><name>Check {oid}</name>'
+        '<family>Family {family}</family><cvss_base>{severity}</cvss_base></nvt><threat>{threat}</threat>'
+        '<severity>{severity}</severity><qod><value>{qod}</value><type>remote_banner</type></qod>'
+        '<description>Finding {n} on host-{n}</description></result>').format(
+          report=report.id[:8], n=n, a=(n // 256) % 256, b=n % 256, port=[22, 80, 443, 8080][n % 4],
+          oid=100000 + n % 5000, family=n % 60, severity=severity, threat=threat, qod=qod))
+      if len(batch) >= 200:
+        yield ''.join(batch).encode('utf-8')
+        batch = []
+    # the first hosts of the results stand for the scanned ones
+    hosts = ['10.0.{}.{}'.format((n // 256) % 256, n % 256) for n in range(1, min(report.result_count, 10) + 1)]
+    ports = [22, 80, 443, 8080][:min(report.result_count, 4)]
+    batch.append('</results>{}<hosts><count>{}</count></hosts><ports start="1" max="-1"><count>{}</count>{}</ports>'
+      '</report></report></get_reports_response>'.format(
+        ''.join('<host><ip>{}</ip><start>{}</start></host>'.format(host, report.name) for host in hosts), len(hosts),
+        len(ports), ''.join('<port>{}/tcp<host>{}</host></port>'.format(port, hosts[0]) for port in ports)))
+    yield ''.join(batch).encode('utf-8')
+
+  def gmp_get_reports(self, command):
+    report_id = command.get('report_id')
+    if report_id == None:
+      _, _, uuids, _ = parse_filter(command.get('filter'))
+      response = self.response('get_reports')
+      for report in self.reports.values():
+        if uuids and report.id not in uuids:
+          continue
+        element = sub(response, 'report', id=report.id)
+        sub(element, 'name', report.name)
+        sub(sub(element, 'task', id=report.task_id), 'name', report.task_name)
+      return response
+    report = self.reports.get(report_id)
+    if report == None:
+      return self.response('get_reports', '404', 'Failed to find report')
+    first, rows, _, _ = parse_filter(command.get('filter'))
+    return self.report_chunks(report, first, rows, self.report_numbers(report, command.get('filter')))
+
+  def gmp_create_report(self, command):
+    task_element = command.find('task')
+    task = self.tasks.get(task_element.get('id')) if task_element.get('id') else None
+    if task == None:
+      name = task_element.findtext('name')
+      task = next((task for task in self.tasks.values() if task.name == name and task.target_id == ''), None)
+      if task == None:
+        task = Fake_task(name, None, None, task_element.findtext('comment'), container=True)
+        self.tasks[task.id] = task
+    report_root = command.find('report')
+    report = Fake_report(task, len(report_root.findall('.//results/result')), report_root.findtext('name'))
+    self.reports[report.id] = report
+    task.last_report_id = report.id
+    return self.response('create_report', '201', 'OK, resource created', id=report.id)
+
+  override_fields = ('text', 'hosts', 'port', 'severity', 'new_severity', 'new_threat', 'comment')
+
+  def gmp_get_overrides(self, command):
+    _, _, uuids, _ = parse_filter(command.get('filter'))
+    response = self.response('get_overrides')
+    for override_id, override in self.overrides.items():
+      if uuids and override_id not in uuids:
+        continue
+      element = sub(response, 'override', id=override_id)
+      sub(element, 'nvt', oid=override['nvt_oid'])
+      for field in self.override_fields:
+        sub(element, field, override.get(field))
+      sub(element, 'task', id=override.get('task_id') or '')
+    return response
+
+  def set_override_fields(self, override, command):
+    for field in self.override_fields:
+      if command.find(field) != None:
+        override[field] = command.findtext(field)
+    if command.find('task') != None:
+      override['task_id'] = command.find('task').get('id')
+
+  def gmp_create_override(self, command):
+    override_id = new_id()
+    self.overrides[override_id] = {'nvt_oid': command.find('nvt').get('oid')}
+    self.set_override_fields(self.overrides[override_id], command)
+    return self.response('create_override', '201', 'OK, resource created', id=override_id)
+
+  def gmp_modify_override(self, command):
+    override = self.overrides.get(command.get('override_id'))
+    if override == None:
+      return self.response('modify_override', '404', 'Failed to find override')
+    self.set_override_fields(override, command)
+    return self.response('modify_override', '200', 'OK')
+
+  def gmp_delete_override(self, command):
+    if self.overrides.pop(command.get('override_id'), None) == None:
+      return self.response('delete_override', '404', 'Failed to find override')
+    return self.response('delete_override', '200', 'OK')
+
+  def sync_progress(self):
+    if self.sync_secs <= 0:
+      return 1.0
+    return min(1.0, (time() - self.started) / self.sync_secs)
+
+  def gmp_get_nvt_families(self, command):
+    response = self.response('get_nvt_families')
+    families = sub(response, 'families')
+    loaded = int(self.nvts * self.sync_progress())
+    for n in range(self.nvt_families):
+      family = sub(families, 'family')
+      sub(family, 'name', 'Family {}'.format(n))
+      sub(family, 'max_nvt_count', loaded // self.nvt_families + (1 if n < loaded % self.nvt_families else 0))
+    return response
+
+  def gmp_get_feeds(self, command):
+    response = self.response('get_feeds')
+    feed = sub(response, 'feed')
+    sub(feed, 'type', 'NVT')
+    sub(feed, 'version', '201901010000')
+    if self.sync_progress() < 0.5:
+      sub(feed, 'currently_syncing')
+    return response
+
+  def gmp_verify_scanner(self, command):
+    if self.sync_progress() < 1:
+      return self.response('verify_scanner', '503', 'Service unavailable')
+    response = self.response('verify_scanner')
+    sub(response, 'version', 'OTP/2.0')
+    return response
+
+class Fake_gvmd_handler(socketserver.BaseRequestHandler):
+  def setup(self):
+    self.server.connections.add(self.request)
+
+  def finish(self):
+    self.server.connections.discard(self.request)
+
+  def handle(self):
+    gvmd = self.server.gvmd
+    authenticated = False
+    parser = ET.XMLPullParser(events=('start', 'end'), huge_tree=True)
+    depth = 0
+    while True:
+      try:
+        data = self.request.recv(65536)
+      except OSError:
+        return
+      if not data:
+        return
+      parser.feed(data)
+      for event, element in parser.read_events():
+        depth += 1 if event == 'start' else -1
+        if depth == 0:
+          authenticated, response = gvmd.handle(element, authenticated)
+          try:
+            for chunk in response:
+              self.request.sendall(chunk)
+          except OSError:
+            return
+          parser = ET.XMLPullParser(events=('start', 'end'), huge_tree=True)
+          break
+
+class Fake_gvmd_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, socket_path:str, gvmd:Fake_gvmd):
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+    self.socket_path = socket_path
+    self.gvmd = gvmd
+    self.connections = set()
+    super().__init__(socket_path, Fake_gvmd_handler)
+
+  def start(self):
+    thread = threading.Thread(target=self.serve_forever, daemon=True)
+    thread.start()
+    return self
+
+  def stop(self):
+    '''
+      Stops listening and drops open connections, like a gvmd that went away
+    '''
+    self.shutdown()
+    self.server_close()
+    for connection in list(self.connections):
+      try:
+        connection.shutdown(socket.SHUT_RDWR)
+      except OSError:
+        pass
+    if os.path.exists(self.socket_path):
+      os.remove(self.socket_path)
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO)
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--socket', default='/tmp/gvmd.sock')
+  parser.add_argument('--latency', type=float, default=0.0)
+  parser.add_argument('--scan-secs', type=float, default=30.0)
+  parser.add_argument('--tasks', type=int, default=10)
+  parser.add_argument('--reports-per-task', type=int, default=0)
+  parser.add_argument('--results-per-report', type=int, default=100)
+  parser.add_argument('--sync-secs', type=float, default=0.0)
+  args = parser.parse_args()
+
+  gvmd = Fake_gvmd(latency=args.latency, scan_secs=args.scan_secs, results_per_report=args.results_per_report,
+    sync_secs=args.sync_secs)
+  gvmd.seed(tasks=args.tasks, reports_per_task=args.reports_per_task)
+  server = Fake_gvmd_server(args.socket, gvmd)
+  logging.info('Fake gvmd listening on {}'.format(args.socket))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server.stop()
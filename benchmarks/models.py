@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+'''
+  Micro-benchmark of Task parsing: field-list models against the objectify path.
+
+  python3 benchmarks/models.py --count 1000
+'''
+
+import os
+import sys
+import json
+import argparse
+import gc
+import multiprocessing
+import timeit
+import tracemalloc
+import lxml.etree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gvm_client import Task, objectify, get_root
+
+task_template = '''<task id="{id}">
+  <owner><name>admin</name></owner>
+  <name>task-{n}</name>
+  <comment>benchmark task {n}</comment>
+  <creation_time>2019-01-01T00:00:00Z</creation_time>
+  <modification_time>2019-01-01T00:00:00Z</modification_time>
+  <writable>1</writable>
+  <in_use>0</in_use>
+  <permissions><permission><name>Everything</name></permission></permissions>
+  <alterable>0</alterable>
+  <config id="daba56c8-73ec-11df-a475-002264764cea"><name>Full and fast</name><trash>0</trash></config>
+  <target id="target-{n}"><name>task-{n}</name><trash>0</trash></target>
+  <hosts_ordering>sequential</hosts_ordering>
+  <scanner id="08b69003-5fc2-4037-a479-93b440211c73"><name>OpenVAS Default</name><type>2</type></scanner>
+  <alert id="alert-{n}"><name>mail</name></alert>
+  <status>Running</status>
+  <progress>{progress}</progress>
+  <report_count>3<finished>2</finished></report_count>
+  <trend/>
+  <schedule id=""><name/><trash>0</trash></schedule>
+  <schedule_periods>0</schedule_periods>
+  <observers/>
+  <current_report><report id="current-{n}"><timestamp>2019-01-02T00:00:00Z</timestamp></report></current_report>
+  <last_report><report id="last-{n}"><timestamp>2019-01-01T00:00:00Z</timestamp>
+    <scan_start>2019-01-01T00:00:00Z</scan_start><scan_end>2019-01-01T01:00:00Z</scan_end>
+    <result_count><debug>0</debug><hole>1</hole><info>2</info><log>30</log><warning>4</warning><false_positive>0</false_positive></result_count>
+    <severity>7.5</severity></report></last_report>
+  <preferences>
+    <preference><name>Maximum concurrently executed NVTs per host</name><scanner_name>max_checks</scanner_name><value>4</value></preference>
+    <preference><name>Maximum concurrently scanned hosts</name><scanner_name>max_hosts</scanner_name><value>20</value></preference>
+  </preferences>
+</task>'''
+
+class Legacy_report:
+  def __init__(self, report_root=None):
+    if report_root != None:
+      root = get_root(report_root, 'report')
+      if root != None:
+        self.id = root.attrib['id']
+        self.name = root.findtext('name', None)
+        self.task_name = root.findtext('task/name', None)
+        self.task_comment = root.findtext('task/comment', None)
+        self.raw = ET.tostring(root)
+
+class Legacy_task:
+  '''
+    Task parsing as it was done before the field-list models
+  '''
+  schedule_periods = None
+
+  def __init__(self, task_root):
+    root = get_root(task_root, 'task')
+    self.raw = ET.tostring(root)
+    for key, val in objectify(root).items():
+      setattr(self, key, val)
+    for field, attr in [('config','id'), ('target','id'), ('scanner','id'), ('schedule','id')]:
+      try:
+        attr_val = getattr(self, field, '')[attr]
+        if attr_val != '':
+          setattr(self, '{}_{}'.format(field, attr), attr_val)
+      except:
+        pass
+    if self.schedule_periods != None:
+      try:
+        self.schedule_periods = int(self.schedule_periods)
+      except:
+        self.schedule_periods = None
+    result = [el.attrib['id'] for el in root.findall('alert') if el.attrib.get('id')]
+    if len(result) > 0:
+      self.alert_ids = result
+    observers = getattr(self, 'observers', None)
+    if isinstance(observers, str):
+      self.observers = observers.split(', ') if observers != '' else None
+    self.current_report = Legacy_report(root.find('current_report/report'))
+    self.last_report = Legacy_report(root.find('last_report/report'))
+
+def task_xml(n:int):
+  return task_template.format(id='task-id-{}'.format(n), n=n, progress=n % 100)
+
+def make_response(count:int):
+  tasks = ''.join(task_xml(n) for n in range(count))
+  return ET.fromstring('<get_tasks_response status="200">{}</get_tasks_response>'.format(tasks))
+
+def rss_bytes():
+  with open('/proc/self/statm') as file:
+    return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def retained_child(parse, count:int, results):
+  '''
+    Parses every task from its own document and drops the document, so the RSS
+    growth is what the objects keep, lxml trees they hold alive included
+  '''
+  sources = [task_xml(n).encode('utf-8') for n in range(count)]
+  gc.collect()
+  before = rss_bytes()
+  objects = []
+  for source in sources:
+    objects.append(parse(ET.fromstring(source)))
+  gc.collect()
+  results.put(rss_bytes() - before)
+
+def measure_retained(parse, count:int):
+  context = multiprocessing.get_context('fork')
+  results = context.Queue()
+  process = context.Process(target=retained_child, args=(parse, count, results))
+  process.start()
+  retained = results.get()
+  process.join()
+  return retained
+
+def measure(parse, elements, repeat:int, retained:int):
+  '''
+    tracemalloc only sees Python allocations, rss_bytes_per_object (retained) also counts lxml memory
+  '''
+  seconds = min(timeit.repeat(lambda: [parse(el) for el in elements], number=1, repeat=repeat))
+  gc.collect()
+  tracemalloc.start()
+  objects = [parse(el) for el in elements]
+  size, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  del objects
+  return {
+    'us_per_object': round(seconds / len(elements) * 1e6, 2),
+    'bytes_per_object': size // len(elements),
+    'peak_bytes_per_object': peak // len(elements),
+    'rss_bytes_per_object': retained // len(elements),
+  }
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--count', type=int, default=1000)
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  parsers = {
+    'objectify': Legacy_task,
+    'objectify_only': objectify,
+    'model': Task,
+    'model_last_report': lambda el: Task(el).last_report,
+  }
+  # forked before the timing runs leave freed memory behind for the children to reuse
+  retained = {name: measure_retained(parse, args.count) for name, parse in parsers.items()}
+  elements = make_response(args.count).xpath('task')
+  results = {'count': args.count}
+  results.update((name, measure(parse, elements, args.repeat, retained[name])) for name, parse in parsers.items())
+  print(json.dumps(results, indent=2))
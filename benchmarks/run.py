@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+'''
+  End-to-end benchmarks of the GVM clients against the local gvmd stand-in
+  (benchmarks/fake_gvmd.py): import throughput, task polling overhead and
+  report save time and memory at several object counts.
+
+  python3 benchmarks/run.py --scales 10 100 1000 --output results.json
+  python3 benchmarks/run.py --scales 100 --compare results.json
+'''
+
+import os
+import sys
+import json
+import shutil
+import asyncio
+import argparse
+import logging
+import platform
+import resource
+import subprocess
+import tempfile
+import multiprocessing
+from time import time, perf_counter
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..'))
+sys.path.insert(0, benchmarks_path)
+
+from fake_gvmd import Fake_gvmd, Fake_gvmd_server, Fake_report
+from gvm_client import GVM_client, Import_pipeline, Task_poller
+from gvm_async_client import Async_GVM_client
+
+password = 'benchmark'
+
+def peak_rss_kb():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def write_import_files(directory:str, scale:int, results_per_report:int):
+  '''
+    Writes scale targets, tasks and overrides and scale/10 reports in export format
+  '''
+  paths = {}
+  for kind in ['configs', 'targets', 'tasks', 'reports', 'overrides']:
+    paths[kind] = os.path.join(directory, kind)
+    os.makedirs(paths[kind])
+
+  with open(os.path.join(paths['configs'], 'config.xml'), 'w') as file:
+    file.write('<get_configs_response status="200" status_text="OK"><config id="bench-config"><name>Benchmark config</name>'
+      '<comment/><preferences/><nvt_selectors/></config></get_configs_response>')
+
+  for n in range(scale):
+    with open(os.path.join(paths['targets'], 'target-{:05}.xml'.format(n)), 'w') as file:
+      file.write(('<get_targets_response status="200" status_text="OK"><target id="t-{n}"><name>import-{n}</name>'
+        '<hosts>10.1.{a}.0/24</hosts><exclude_hosts/><comment>benchmark</comment>'
+        '<port_list id="33d0cd82-57c6-11e1-8ed1-406186ea4fc5"><name>All IANA assigned TCP</name></port_list>'
+        '<alive_tests>Scan Config Default</alive_tests><reverse_lookup_only>0</reverse_lookup_only>'
+        '<reverse_lookup_unify>0</reverse_lookup_unify></target></get_targets_response>').format(n=n, a=n % 256))
+    with open(os.path.join(paths['tasks'], 'task-{:05}.xml'.format(n)), 'w') as file:
+      file.write(('<get_tasks_response status="200" status_text="OK"><task id="task-{n}"><name>import-{n}</name>'
+        '<comment>benchmark</comment><config id="bench-config"><name>Benchmark config</name></config>'
+        '<target id="t-{n}"><name>import-{n}</name></target>'
+        '<scanner id="08b69003-5fc2-4037-a479-93b440211c73"><name>OpenVAS Default</name></scanner><hosts_ordering>sequential</hosts_ordering>'
+        '<alterable>0</alterable><preferences><preference><scanner_name>max_checks</scanner_name><value>4</value>'
+        '</preference></preferences></task></get_tasks_response>').format(n=n))
+    with open(os.path.join(paths['overrides'], 'override-{:05}.xml'.format(n)), 'w') as file:
+      file.write(('<get_overrides_response status="200" status_text="OK"><override id="o-{n}">'
+        '<nvt oid="1.3.6.1.4.1.25623.1.0.{oid}"><name>Check</name></nvt><text>benchmark override {n}</text>'
+        '<hosts>10.1.0.{b}</hosts><port>80/tcp</port><new_threat>False Positive</new_threat>'
+        '<new_severity>-1</new_severity><active>1</active></override></get_overrides_response>').format(
+          n=n, oid=100000 + n, b=n % 256))
+
+  generator = Fake_gvmd()
+  for n in range(max(1, scale // 10)):
+    report = Fake_report(type('task', (), {'id': 'task-{}'.format(n), 'name': 'imported-{}'.format(n)}), results_per_report)
+    response = b''.join(generator.report_chunks(report, 1, -1))
+    # saved reports keep the report element only
+    with open(os.path.join(paths['reports'], 'report-{:05}.xml'.format(n)), 'wb') as file:
+      file.write(response[response.index(b'<report '):response.rindex(b'</get_reports_response>')])
+  return paths
+
+def bench_import(socket_path:str, gvmd:Fake_gvmd, scale:int, parallelism:int, results_per_report:int):
+  directory = tempfile.mkdtemp(prefix='gvm-bench-')
+  try:
+    paths = write_import_files(directory, scale, results_per_report)
+    files = sum(len(os.listdir(path)) for path in paths.values())
+    commands = sum(gvmd.stats.values())
+    started = perf_counter()
+    pipeline = Import_pipeline(lambda: GVM_client(password=password, socket_path=socket_path), parallelism=parallelism)
+    levels = pipeline.run(configs_path=paths['configs'], targets_path=paths['targets'],
+      tasks_path=paths['tasks'], reports_path=paths['reports'], overrides_path=paths['overrides'])
+    seconds = perf_counter() - started
+    pipeline.close()
+    imported = sum(phase.imported for phases in levels for phase in phases)
+    return {
+      'files': files,
+      'imported': imported,
+      'seconds': round(seconds, 4),
+      'files_per_sec': round(files / seconds, 1),
+      'gmp_commands': sum(gvmd.stats.values()) - commands,
+    }
+  finally:
+    shutil.rmtree(directory)
+
+def bench_async_import(socket_path:str, gvmd:Fake_gvmd, scale:int, parallelism:int, results_per_report:int):
+  directory = tempfile.mkdtemp(prefix='gvm-bench-')
+  try:
+    paths = write_import_files(directory, scale, results_per_report)
+    files = sum(len(os.listdir(path)) for path in paths.values())
+
+    async def run():
+      async with Async_GVM_client(password, socket_path=socket_path, connections=parallelism) as client:
+        return await client.import_all(configs_path=paths['configs'], targets_path=paths['targets'],
+          tasks_path=paths['tasks'], reports_path=paths['reports'], overrides_path=paths['overrides'])
+
+    started = perf_counter()
+    levels = asyncio.run(run())
+    seconds = perf_counter() - started
+    return {
+      'files': files,
+      'imported': sum(phase.imported for phases in levels for phase in phases),
+      'seconds': round(seconds, 4),
+      'files_per_sec': round(files / seconds, 1),
+    }
+  finally:
+    shutil.rmtree(directory)
+
+def bench_polling(socket_path:str, gvmd:Fake_gvmd, scale:int, rounds:int):
+  '''
+    Compares one batched get_tasks per poll with one get_task per watched task
+  '''
+  client = GVM_client(password=password, socket_path=socket_path)
+  task_ids = [task.id for task in client.get_tasks()][:scale]
+  for task_id in task_ids:
+    client.run_task(task_id)
+
+  poller = Task_poller(client)
+  for task_id in task_ids:
+    poller.watch(task_id, lambda status, previous: None)
+  commands = gvmd.stats.get('get_tasks', 0)
+  started = perf_counter()
+  for _ in range(rounds):
+    poller.poll(force=True)
+  batched = (perf_counter() - started) / rounds
+  batched_commands = (gvmd.stats.get('get_tasks', 0) - commands) / rounds
+
+  commands = gvmd.stats.get('get_tasks', 0)
+  started = perf_counter()
+  for _ in range(rounds):
+    for task_id in task_ids:
+      client.get_task_status(task_id)
+  per_task = (perf_counter() - started) / rounds
+  per_task_commands = (gvmd.stats.get('get_tasks', 0) - commands) / rounds
+  client.gmp.disconnect()
+  return {
+    'tasks': len(task_ids),
+    'batched_poll_secs': round(batched, 5),
+    'batched_commands_per_poll': batched_commands,
+    'per_task_poll_secs': round(per_task, 5),
+    'per_task_commands_per_poll': per_task_commands,
+  }
+
+def save_report_child(socket_path:str, report_id:str, directory:str, page_size, output:str, results):
+  rss_before = peak_rss_kb()
+  client = GVM_client(password=password, socket_path=socket_path)
+  started = perf_counter()
+  client.save_report(report_id, directory, page_size=page_size, output=output)
+  seconds = perf_counter() - started
+  results.put({
+    'seconds': round(seconds, 4),
+    'peak_rss_growth_kb': peak_rss_kb() - rss_before,
+    'bytes': sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)),
+  })
+
+def bench_report(socket_path:str, gvmd:Fake_gvmd, results_count:int, page_size, output:str):
+  '''
+    Saves one report in a forked process so its peak RSS is not mixed with the server's
+  '''
+  with gvmd.lock:
+    task = next(iter(gvmd.tasks.values()))
+    report = Fake_report(task, results_count)
+    gvmd.reports[report.id] = report
+  directory = tempfile.mkdtemp(prefix='gvm-bench-')
+  try:
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=save_report_child,
+      args=(socket_path, report.id, directory, page_size, output, results))
+    process.start()
+    result = results.get()
+    process.join()
+    result.update({'results': results_count, 'page_size': page_size, 'output': output})
+    return result
+  finally:
+    shutil.rmtree(directory)
+    with gvmd.lock:
+      gvmd.reports.pop(report.id, None)
+
+def run_scale(args, scale:int):
+  socket_path = os.path.join(tempfile.gettempdir(), 'fake-gvmd-{}.sock'.format(os.getpid()))
+  gvmd = Fake_gvmd(latency=args.latency, scan_secs=3600, results_per_report=args.results_per_report)
+  gvmd.seed(tasks=scale)
+  server = Fake_gvmd_server(socket_path, gvmd).start()
+  try:
+    logging.info('Scale {}: import'.format(scale))
+    result = {'scale': scale}
+    result['import'] = bench_import(socket_path, gvmd, scale, args.parallelism, args.results_per_report)
+    result['async_import'] = bench_async_import(socket_path, gvmd, scale, args.parallelism, args.results_per_report)
+    logging.info('Scale {}: polling'.format(scale))
+    result['polling'] = bench_polling(socket_path, gvmd, scale, args.rounds)
+    logging.info('Scale {}: report save'.format(scale))
+    result['report'] = [bench_report(socket_path, gvmd, scale * args.results_per_report, page_size, output)
+      for page_size in [None, args.page_size] for output in ['xml', 'jsonl']]
+    result['gmp_commands'] = dict(gvmd.stats)
+    return result
+  finally:
+    server.stop()
+
+def git_revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=benchmarks_path,
+      stderr=subprocess.DEVNULL).decode().strip()
+  except Exception:
+    return None
+
+def flatten(value, prefix=''):
+  '''
+    Flattens nested results to {'scale=10/import/seconds': 1.0}
+  '''
+  if isinstance(value, dict):
+    items = {}
+    for key, item in value.items():
+      items.update(flatten(item, '{}/{}'.format(prefix, key) if prefix else str(key)))
+    return items
+  if isinstance(value, list):
+    items = {}
+    for n, item in enumerate(value):
+      items.update(flatten(item, '{}[{}]'.format(prefix, n)))
+    return items
+  return {prefix: value}
+
+def compare(baseline:dict, results:dict):
+  '''
+    Prints time and memory metrics that changed against a previous run
+  '''
+  def metrics(run):
+    values = {}
+    for scale in run['scales']:
+      for key, value in flatten(scale, 'scale={}'.format(scale['scale'])).items():
+        if key.endswith(('secs', 'seconds', '_kb')) and isinstance(value, (int, float)):
+          values[key] = value
+    return values
+
+  old, new = metrics(baseline), metrics(results)
+  for key in sorted(set(old) & set(new)):
+    if old[key]:
+      change = (new[key] - old[key]) / old[key] * 100
+      print('{:<60} {:>12} {:>12} {:>+8.1f}%'.format(key, old[key], new[key], change))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000])
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every gvmd response')
+  parser.add_argument('--parallelism', type=int, default=4)
+  parser.add_argument('--rounds', type=int, default=5, help='polling rounds')
+  parser.add_argument('--results-per-report', type=int, default=100)
+  parser.add_argument('--page-size', type=int, default=1000)
+  parser.add_argument('--output', default=None, help='write JSON results to this file')
+  parser.add_argument('--compare', default=None, help='JSON results of a previous run')
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+  results = {
+    'started': time(),
+    'revision': git_revision(),
+    'python': platform.python_version(),
+    'args': vars(args),
+    'scales': [run_scale(args, scale) for scale in args.scales],
+  }
+  logging.getLogger().setLevel(logging.INFO)
+  print(json.dumps(results, indent=2))
+  if args.output:
+    with open(args.output, 'w') as file:
+      json.dump(results, file, indent=2)
+  if args.compare:
+    with open(args.compare) as file:
+      compare(json.load(file), results)
@@ -4,15 +4,72 @@ import os
 import logging
 import subprocess
 import argparse
-from time import sleep
+import gzip
+import json
+import datetime
+import math
+import resource
+import shutil
+import tarfile
+import signal
+import socket
+import struct
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import sleep, time
 from shlex import quote
-from gvm_client import GVM_client, Task
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+from gvm_client import (GVM_client, Import_manifest, Import_pipeline, Report_filter, Task, Task_poller, Task_status,
+  Traffic_capture, load_report_filters, metrics, parse_shard_name, poll_max_secs, poll_min_secs)
+from gvm_reconcile import Reconciler
+from gvm_scheduler import Fanout_scheduler, create_endpoints, load_jobs
 
 env_ov_passwd = 'OV_PASSWD'
 env_ov_run_tasks = 'OV_AUTORUN_TASKS'
 env_ov_save_reports = 'OV_AUTOSAVE_REPORTS'
+env_ov_max_concurrent_tasks = 'OV_MAX_CONCURRENT_TASKS'
+env_ov_report_compression = 'OV_REPORT_COMPRESSION'
+env_ov_report_page_size = 'OV_REPORT_PAGE_SIZE'
+env_ov_report_format = 'OV_REPORT_FORMAT'
+env_ov_report_delta = 'OV_REPORT_DELTA'
+env_ov_report_export = 'OV_REPORT_EXPORT'
+env_ov_report_min_severity = 'OV_REPORT_MIN_SEVERITY'
+env_ov_report_min_qod = 'OV_REPORT_MIN_QOD'
+env_ov_report_apply_overrides = 'OV_REPORT_APPLY_OVERRIDES'
+env_ov_report_exclude_families = 'OV_REPORT_EXCLUDE_FAMILIES'
+env_ov_import_parallelism = 'OV_IMPORT_PARALLELISM'
+env_ov_import_manifest = 'OV_IMPORT_MANIFEST'
+env_ov_metrics_port = 'OV_METRICS_PORT'
+env_ov_metrics_textfile = 'OV_METRICS_TEXTFILE'
+env_ov_gmp_capture = 'OV_GMP_CAPTURE'
+env_ov_gmp_capture_size = 'OV_GMP_CAPTURE_SIZE'
+env_ov_gmp_capture_max_bytes = 'OV_GMP_CAPTURE_MAX_BYTES'
+env_ov_gmp_capture_dir = 'OV_GMP_CAPTURE_DIR'
+env_ov_sync_timeout = 'OV_SYNC_TIMEOUT'
+env_ov_snapshot_dir = 'OV_SNAPSHOT_DIR'
+env_ov_autotune = 'OV_AUTOTUNE'
+env_ov_max_hosts = 'OV_MAX_HOSTS'
+env_ov_max_checks = 'OV_MAX_CHECKS'
+env_ov_hosts_ordering = 'OV_HOSTS_ORDERING'
+env_ov_redis_maxmemory_mb = 'OV_REDIS_MAXMEMORY_MB'
+env_ov_redis_maxclients = 'OV_REDIS_MAXCLIENTS'
+env_ov_target_shards = 'OV_TARGET_SHARDS'
+env_ov_gvmd_endpoints = 'OV_GVMD_ENDPOINTS'
+env_ov_poll_min_secs = 'OV_POLL_MIN_SECS'
+env_ov_poll_max_secs = 'OV_POLL_MAX_SECS'
+env_ov_reconcile = 'OV_RECONCILE'
+env_ov_reconcile_prune = 'OV_RECONCILE_PRUNE'
 redis_conf = '/etc/openvas-redis.conf'
+tuned_redis_conf = '/etc/openvas-redis-tuned.conf'
+openvassd_conf = '/etc/openvas/openvassd.conf'
 redis_socket = '/tmp/redis.sock'
+postgres_host = 'localhost'
+postgres_port = 5432
+postgres_user = 'root'
+postgres_db = 'gvmd'
 gvm_socket = '/var/run/gvmd.sock'
 ov_user = 'admin'
 
@@ -21,10 +78,27 @@ reports_path = '/reports'
 configs_path = '/configs'
 targets_path = '/targets'
 tasks_path = '/tasks'
-openvassd_wait_secs = 60
+import_manifest_path = '/var/lib/openvas/import-manifest.json'
+nvt_count_path = '/var/lib/openvas/nvt-count'
+postgres_version = '10'
+postgres_data_path = '/var/lib/postgresql/{}/main'.format(postgres_version)
+openvas_state_path = '/var/lib/openvas'
+snapshot_paths = [postgres_data_path, openvas_state_path]
+# written on boot: the state is in use and which snapshot it was restored from
+state_marker_path = '/var/lib/openvas/state.json'
+snapshot_dir = '/snapshots'
+snapshot_name = 'openvas-snapshot'
+sync_timeout_secs = 1800
+cache_sync_timeout_secs = 4 * 3600
 gvmd_wait_secs = 6
 gvmd_connect_tries = 10
-task_wait_secs = 15
+task_retry_secs = 5
+task_run_tries = 3
+service_start_secs = 120
+# scan concurrency estimates: checks are mostly waiting on the network,
+# each check process with its Redis connection takes some tens of MB
+check_slots_per_cpu = 16
+check_memory_mb = 40
 
 loglevel = logging.INFO
 
@@ -38,44 +112,73 @@ def delete_user(username):
   command = 'gvmd --delete-user {}'.format(quote(username))
   os.system(command)
 
-def ping_postgres():
+def wait_ready(probe, timeout=120, interval=0.05, max_interval=2, factor=1.5):
+  '''
+    Polls probe() with an interval growing from interval to max_interval,
+    returns False if it did not succeed within timeout seconds
+  '''
+  deadline = time() + timeout
+  while True:
+    if probe():
+      return True
+    if time() >= deadline:
+      return False
+    sleep(min(interval, max(0, deadline - time())))
+    interval = min(interval * factor, max_interval)
+
+def postgres_startup_message(user, database):
+  # protocol 3.0 StartupMessage
+  params = 'user\0{}\0database\0{}\0\0'.format(user, database).encode('utf-8')
+  return struct.pack('!ii', len(params) + 8, 196608) + params
+
+def probe_postgres(host=postgres_host, port=postgres_port, timeout=1):
+  '''
+    Same answer as pg_isready without a subprocess: the server is ready when it
+    answers a startup message with anything but "the database system is starting up"
+  '''
   try:
-    subprocess.check_call(['pg_isready', '-h', 'localhost', '-p', '5432'])
-    logging.info('Postgres is running')
-    return True
-  except:
-    logging.error('Unable to reach Postgres')
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+      sock.sendall(postgres_startup_message(postgres_user, postgres_db))
+      response = sock.recv(1024)
+      if response[:1] == b'R':
+        sock.sendall(b'X\0\0\0\4')
+        return True
+      if response[:1] == b'E':
+        fields = dict((field[:1], field[1:]) for field in response[5:].split(b'\0') if field)
+        return fields.get(b'C') != b'57P03'
+      return False
+  except OSError:
+    return False
+
+def probe_redis(socket_path=redis_socket, timeout=1):
+  '''
+    PING over the Redis socket, a loading server answers with an error
+  '''
+  try:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+      sock.settimeout(timeout)
+      sock.connect(socket_path)
+      sock.sendall(b'*1\r\n$4\r\nPING\r\n')
+      return sock.recv(64).startswith(b'+PONG')
+  except OSError:
     return False
 
 def run_postgres():
-  if not ping_postgres():
+  if not probe_postgres():
     subprocess.Popen(['/etc/init.d/postgresql', 'start']).wait()
-    while not ping_postgres():
-      logging.info('Waiting for postgres to start...')
-      sleep(1)
+    if not wait_ready(probe_postgres, timeout=service_start_secs):
+      raise Exception('Postgres did not start in {} sec'.format(service_start_secs))
 
 def stop_postgres():
-  if ping_postgres():
+  if probe_postgres():
     subprocess.Popen(['/etc/init.d/postgresql', 'stop']).wait()
-    while ping_postgres():
-      logging.info('Waiting for Postgres to stop...')
-      sleep(1)
-
-def ping_redis():
-  try:
-    response = subprocess.check_output(['redis-cli','-s', redis_socket, 'ping']).decode('utf-8')
-    logging.info('Ping redis: {}'.format(response))
-    return response == 'PONG\n'
-  except:
-    logging.error('Unable to reach Redis')
-    return False
+    wait_ready(lambda: not probe_postgres(), timeout=service_start_secs)
 
 def run_redis():
-  if not ping_redis():
+  if not probe_redis():
     subprocess.Popen(['redis-server', redis_conf])
-    while not ping_redis():
-      logging.info('Waiting for redis...')
-      sleep(1)
+    if not wait_ready(probe_redis, timeout=service_start_secs):
+      raise Exception('Redis did not start in {} sec'.format(service_start_secs))
 
 def stop_redis():
   try:
@@ -83,6 +186,89 @@ def stop_redis():
   except Exception as ex:
     logging.error('Shutdown Redis error: {}'.format(ex))
 
+def run_supervisor():
+  return subprocess.Popen(['supervisord','-n', '-c', '/etc/openvas-supervisor.conf'])
+
+class Service:
+  '''
+    Boot step: start() is called once all required services are ready,
+    then the service is ready as soon as probe() succeeds.
+    A service whose probe succeeds before start is considered already running.
+  '''
+  def __init__(self, name, start=None, probe=None, requires=(), timeout=service_start_secs):
+    self.name = name
+    self.start = start
+    self.probe = probe
+    self.requires = tuple(requires)
+    self.timeout = timeout
+    self.result = None
+    self.started = None
+    self.ready = None
+    self.state = 'pending'
+
+  def run(self, boot_started):
+    self.started = time() - boot_started
+    if self.probe != None and self.probe():
+      self.state = 'already running'
+    else:
+      if self.start != None:
+        self.result = self.start()
+      if self.probe != None and not wait_ready(self.probe, timeout=self.timeout):
+        self.state = 'timeout'
+        raise Exception('{} is not ready after {} sec'.format(self.name, self.timeout))
+      self.state = 'ready'
+    self.ready = time() - boot_started
+    return self
+
+class Boot_orchestrator:
+  '''
+    Starts services in dependency order, independent services in parallel,
+    and logs the boot timeline
+  '''
+  def __init__(self, services:list):
+    self.services = OrderedDict((service.name, service) for service in services)
+    for service in services:
+      for name in service.requires:
+        if name not in self.services:
+          raise Exception('Unknown service {} required by {}'.format(name, service.name))
+
+  def run(self):
+    started = time()
+    done, failed = set(), None
+    running = {}
+    with ThreadPoolExecutor(max_workers=len(self.services)) as executor:
+      while failed == None and len(done) < len(self.services):
+        for service in self.services.values():
+          if service.name not in done and service.name not in running.values() \
+            and all(name in done for name in service.requires):
+            running[executor.submit(service.run, started)] = service.name
+        if not running:
+          failed = 'dependency cycle'
+          break
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+          name = running.pop(future)
+          try:
+            future.result()
+            done.add(name)
+          except Exception as ex:
+            self.services[name].state = 'failed' if self.services[name].state == 'pending' else self.services[name].state
+            failed = '{}: {}'.format(name, ex)
+    self.log_timeline(time() - started)
+    if failed != None:
+      raise Exception('Boot failed, {}'.format(failed))
+    return self.services
+
+  def log_timeline(self, seconds):
+    logging.info('Boot timeline ({:.2f} sec):'.format(seconds))
+    for service in self.services.values():
+      if service.ready != None:
+        logging.info('  {}: {}, started +{:.2f} sec, ready +{:.2f} sec ({:.2f} sec)'.format(
+          service.name, service.state, service.started, service.ready, service.ready - service.started))
+        metrics.set('openvas_boot_ready_seconds', round(service.ready, 3), service=service.name)
+      else:
+        logging.info('  {}: {}'.format(service.name, service.state))
+
 def stop_process(process:subprocess.Popen):
   try:
     process.send_signal(subprocess.signal.SIGINT)
@@ -96,104 +282,645 @@ def task_can_be_runned(task: Task):
 def task_runned(task: Task):
   return task != None and task.status in ['Running', 'Requested']
 
-if __name__ == '__main__':
-  logging.basicConfig(level=loglevel)
+def get_env_int(name, default, minimum=1):
+  try:
+    return max(minimum, int(os.environ.get(name, default)))
+  except ValueError:
+    logging.error('Wrong value of {} env variable, using {}'.format(name, default))
+    return default
+
+def export_metrics():
+  '''
+    Rewrites the metrics textfile when OV_METRICS_TEXTFILE is set
+  '''
+  path = os.environ.get(env_ov_metrics_textfile)
+  if path:
+    try:
+      metrics.write_textfile(path)
+    except Exception as ex:
+      logging.error('Writing metrics error: {}'.format(ex))
 
-  parser = argparse.ArgumentParser()
-  parser.add_argument('--create-cache', dest='create_cache', default=False, action='store_true')
-  parser.add_argument('--only-run-tasks', dest='only_run_tasks', default=False, action='store_true')
-  args = parser.parse_args()
+def serve_metrics():
+  port = get_env_int(env_ov_metrics_port, 0, minimum=0)
+  if port:
+    try:
+      metrics.serve(port)
+      logging.info('Serving metrics on port {}'.format(port))
+    except Exception as ex:
+      logging.error('Serving metrics error: {}'.format(ex))
 
-  if args.create_cache:
-    run_postgres()
-    run_redis()
+def create_capture():
+  '''
+    Returns a Traffic_capture when OV_GMP_CAPTURE sets a sample rate (0 < rate <= 1).
+    The capture is dumped on GMP errors and on SIGUSR1.
+  '''
+  try:
+    sample_rate = float(os.environ.get(env_ov_gmp_capture) or 0)
+  except ValueError:
+    logging.error('Wrong value of {} env variable, capture is disabled'.format(env_ov_gmp_capture))
+    return None
+  if sample_rate <= 0:
+    return None
+  capture = Traffic_capture(
+    size=get_env_int(env_ov_gmp_capture_size, 200),
+    sample_rate=min(1.0, sample_rate),
+    max_bytes=get_env_int(env_ov_gmp_capture_max_bytes, 4096, minimum=0),
+    directory=os.environ.get(env_ov_gmp_capture_dir) or None)
+  signal.signal(signal.SIGUSR1, lambda signum, frame: capture.dump('signal', force=True))
+  logging.info('Capturing GMP traffic, sample rate {}'.format(capture.sample_rate))
+  return capture
+
+def read_nvt_count():
+  '''
+    NVT count stored by the last complete sync, used for the sync ETA
+  '''
+  try:
+    with open(nvt_count_path) as file:
+      return int(file.read().strip())
+  except (OSError, ValueError):
+    return None
 
-    admin_pass = 'cache'
-    create_user(ov_user, admin_pass)
+def write_nvt_count(count):
+  try:
+    with open(nvt_count_path, 'w') as file:
+      file.write(str(count))
+  except OSError as ex:
+    logging.error('Saving NVT count error: {}'.format(ex))
 
-    openvassd_proc = subprocess.Popen(['openvassd', '-f'])
-    sleep(openvassd_wait_secs)
-    gvmd_proc = subprocess.Popen(['gvmd', '-f'])
+def read_first_line(path):
+  try:
+    with open(path) as file:
+      return file.readline().strip()
+  except OSError:
+    return None
+
+def get_cpu_limit():
+  '''
+    CPUs the container may use: cgroup v2 cpu.max or v1 CFS quota, capped by the CPU affinity
+  '''
+  cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+  quota, period = None, None
+  value = read_first_line('/sys/fs/cgroup/cpu.max')
+  if value:
+    quota, period = (value.split() + ['100000'])[:2]
+  else:
+    quota = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    period = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+  try:
+    if quota not in [None, 'max', '-1'] and int(period) > 0:
+      cpus = min(cpus, int(quota) / int(period))
+  except (TypeError, ValueError):
+    pass
+  return max(1.0, cpus)
+
+def get_memory_limit_mb():
+  '''
+    Memory the container may use: cgroup v2 memory.max or v1 limit, capped by the physical memory
+  '''
+  memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2**20
+  for path in ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']:
+    value = read_first_line(path)
+    if value and value.isdigit():
+      memory = min(memory, int(value) // 2**20)
+  return memory
+
+def clamp(value, low, high):
+  return max(low, min(high, value))
+
+class Resource_profile:
+  '''
+    Scanner concurrency and Redis limits derived from the CPU and memory
+    available to the container, env variables override each value
+  '''
+  def __init__(self, cpus:float, memory_mb:int):
+    self.cpus = cpus
+    self.memory_mb = memory_mb
+    self.redis_maxmemory_mb = clamp(int(memory_mb * 0.4), 512, 8192)
+    # Postgres, gvmd and gsad
+    reserved_mb = 512 + memory_mb // 10
+    scan_memory_mb = max(0, memory_mb - self.redis_maxmemory_mb - reserved_mb)
+    slots = max(2, min(int(cpus * check_slots_per_cpu), scan_memory_mb // check_memory_mb))
+    # more hosts than checks per host, a host is only scanned by a few checks at a time anyway
+    self.max_checks = clamp(int(math.sqrt(slots / 2) + 0.5), 2, 10)
+    self.max_hosts = clamp(slots // self.max_checks, 1, 100)
+    # with many hosts at once random order spreads the load over the scanned networks
+    self.hosts_ordering = 'random' if self.max_hosts >= 20 else 'sequential'
+    # every check process keeps its own Redis connection
+    self.redis_maxclients = max(1024, self.max_hosts * (self.max_checks + 2) * 2)
+    open_files = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if open_files != resource.RLIM_INFINITY:
+      self.redis_maxclients = min(self.redis_maxclients, max(128, open_files - 32))
+    self.overrides = []
+
+  def apply_env(self):
+    for attr, name, convert in [
+      ('max_hosts', env_ov_max_hosts, int),
+      ('max_checks', env_ov_max_checks, int),
+      ('hosts_ordering', env_ov_hosts_ordering, str),
+      ('redis_maxmemory_mb', env_ov_redis_maxmemory_mb, int),
+      ('redis_maxclients', env_ov_redis_maxclients, int)]:
+      value = os.environ.get(name)
+      if value:
+        try:
+          setattr(self, attr, convert(value))
+          self.overrides.append(attr)
+        except ValueError:
+          logging.error('Wrong value of {} env variable, using {}'.format(name, getattr(self, attr)))
+    return self
+
+  def task_defaults(self):
+    return {'hosts_ordering': self.hosts_ordering, 'max_hosts': self.max_hosts, 'max_checks': self.max_checks}
+
+  def __str__(self):
+    return '{:.1f} CPUs, {} MB: max_hosts={}, max_checks={}, hosts_ordering={}, redis maxmemory={} MB, maxclients={}{}'.format(
+      self.cpus, self.memory_mb, self.max_hosts, self.max_checks, self.hosts_ordering,
+      self.redis_maxmemory_mb, self.redis_maxclients,
+      ' (set by env: {})'.format(', '.join(self.overrides)) if self.overrides else '')
+
+def write_config(path, values:dict, template=None, separator=' = '):
+  '''
+    Writes the template (or the current file) with the given keys replaced
+  '''
+  lines = []
+  source = template or path
+  if os.path.isfile(source):
+    with open(source) as file:
+      lines = [line.rstrip('\n') for line in file
+        if line.strip().replace('=', ' ').split(' ')[0] not in values]
+  lines += ['{}{}{}'.format(key, separator, value) for key, value in values.items()]
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, 'w') as file:
+    file.write('\n'.join(lines) + '\n')
+  return path
+
+def tune_resources():
+  '''
+    Returns the resource profile and the Redis config to start with.
+    Unless OV_AUTOTUNE is 0, openvassd.conf and the Redis config are generated from the profile,
+    otherwise there is no profile and imported tasks keep their own settings.
+  '''
+  if os.environ.get(env_ov_autotune, '1').lower() in ['0', 'false', 'no']:
+    logging.info('Resource autotuning is disabled')
+    return None, redis_conf
+  profile = Resource_profile(get_cpu_limit(), get_memory_limit_mb()).apply_env()
+  logging.info('Resource profile: {}'.format(profile))
+  try:
+    write_config(openvassd_conf, {'max_hosts': profile.max_hosts, 'max_checks': profile.max_checks})
+    return profile, write_config(tuned_redis_conf, {
+      'maxmemory': '{}mb'.format(profile.redis_maxmemory_mb),
+      'maxclients': profile.redis_maxclients,
+    }, template=redis_conf, separator=' ')
+  except OSError as ex:
+    logging.error('Writing tuned configs error: {}'.format(ex))
+    return profile, redis_conf
+
+def get_versions():
+  '''
+    Versions the snapshot state depends on
+  '''
+  versions = {'postgres': postgres_version}
+  for name, command in [('gvmd', ['gvmd', '--version']), ('openvassd', ['openvassd', '--version']),
+    ('redis', ['redis-server', '--version'])]:
+    try:
+      versions[name] = subprocess.check_output(command, stderr=subprocess.STDOUT).decode('utf-8').splitlines()[0].strip()
+    except Exception:
+      versions[name] = None
+  return versions
+
+def open_snapshot(path, mode):
+  if path.endswith('.zst'):
+    return zstandard.open(path, mode)
+  return gzip.open(path, mode, compresslevel=6) if 'w' in mode else gzip.open(path, mode)
+
+def snapshot_members(archive):
+  '''
+    Yields archive members, refusing paths outside of the snapshot paths
+  '''
+  roots = [path.lstrip('/') for path in snapshot_paths]
+  for member in archive:
+    name = os.path.normpath(member.name)
+    if name.startswith(('/', '..')) or not any(name == root or name.startswith(root + '/') for root in roots):
+      raise Exception('Unexpected path in snapshot: {}'.format(member.name))
+    if (member.issym() or member.islnk()) and (os.path.isabs(member.linkname) or '..' in member.linkname.split('/')):
+      raise Exception('Unexpected link in snapshot: {}'.format(member.name))
+    yield member
+
+def read_state_marker():
+  try:
+    with open(state_marker_path) as file:
+      return json.load(file)
+  except (OSError, ValueError):
+    return None
+
+def write_state_marker(**values):
+  marker = read_state_marker() or {}
+  marker.update(values)
+  os.makedirs(os.path.dirname(state_marker_path), exist_ok=True)
+  with open('{}.part'.format(state_marker_path), 'w') as file:
+    json.dump(marker, file, indent=2)
+  os.replace('{}.part'.format(state_marker_path), state_marker_path)
+
+def export_snapshot(directory):
+  '''
+    Archives the Postgres data directory and the OpenVAS state (NVTs, feeds and the
+    Redis dump) with a <snapshot>.json file holding the versions it was made with.
+    Postgres and Redis must be stopped.
+  '''
+  started = time()
+  file_name = '{}.tar{}'.format(snapshot_name, '.zst' if zstandard != None else '.gz')
+  file_path = os.path.join(directory, file_name)
+  temp_path = '{}.part'.format(file_path)
+  logging.info('Exporting snapshot to {}'.format(file_path))
+  excluded = os.path.abspath(directory)
+  with open_snapshot(temp_path, 'wb') as file:
+    with tarfile.open(fileobj=file, mode='w|') as archive:
+      for path in snapshot_paths:
+        archive.add(path, arcname=path.lstrip('/'),
+          filter=lambda info: None if '/' + info.name in [excluded, state_marker_path] else info)
+  os.replace(temp_path, file_path)
+
+  metadata = {
+    'file_name': file_name,
+    'file_bytes': os.path.getsize(file_path),
+    'created': time(),
+    'versions': get_versions(),
+    'nvt_count': read_nvt_count(),
+  }
+  metadata_path = os.path.join(directory, '{}.json'.format(snapshot_name))
+  with open('{}.part'.format(metadata_path), 'w') as file:
+    json.dump(metadata, file, indent=2)
+  os.replace('{}.part'.format(metadata_path), metadata_path)
+  logging.info('Snapshot exported in {:.0f} sec: {} bytes'.format(time() - started, metadata['file_bytes']))
+  return file_path
+
+def restore_snapshot(directory):
+  '''
+    Replaces the Postgres data directory and the OpenVAS state with the snapshot,
+    if there is one made with the same versions and the state has not been used
+    yet: a state that booted before keeps its scans and imports, and a snapshot
+    is restored once. Returns False when the state is left as it was.
+  '''
+  metadata_path = os.path.join(directory, '{}.json'.format(snapshot_name))
+  try:
+    with open(metadata_path) as file:
+      metadata = json.load(file)
+  except (OSError, ValueError):
+    logging.info('No snapshot in {}'.format(directory))
+    return False
+  if any(os.path.abspath(directory).startswith(path + '/') for path in snapshot_paths):
+    logging.error('Snapshot directory {} must be outside of {}'.format(directory, ', '.join(snapshot_paths)))
+    return False
 
-    processor = GVM_client(
-      socket_path=gvm_socket,
-      user=ov_user,
-      password=admin_pass,
-      loglevel=loglevel)
+  snapshot = {'file_name': metadata.get('file_name'), 'created': metadata.get('created')}
+  marker = read_state_marker()
+  if marker != None:
+    if marker.get('snapshot') == snapshot:
+      logging.info('Snapshot {} is already restored'.format(snapshot['file_name']))
+    else:
+      logging.warning('Not restoring snapshot {}: the current state is in use since {}, restoring would lose it. '
+        'Start with empty {} to restore it'.format(snapshot['file_name'],
+        datetime.datetime.utcfromtimestamp(marker.get('booted', 0)).isoformat(), ', '.join(snapshot_paths)))
+    return False
 
-    processor.wait_connection(connection_tries=gvmd_connect_tries, secs_before_attempt=gvmd_wait_secs)
-    processor.wait_sync(interval=20)
+  versions = get_versions()
+  mismatch = ['{} {} (snapshot {})'.format(name, versions.get(name), version)
+    for name, version in sorted(metadata.get('versions', {}).items()) if versions.get(name) != version]
+  if mismatch:
+    logging.warning('Snapshot does not match installed versions, syncing as usual: {}'.format(', '.join(mismatch)))
+    return False
 
-    delete_user(ov_user)
+  started = time()
+  file_path = os.path.join(directory, metadata['file_name'])
+  logging.info('Restoring snapshot {}'.format(file_path))
+  # the current state is kept until the snapshot is fully extracted
+  for path in snapshot_paths:
+    if os.path.exists(path):
+      os.rename(path, '{}.pre-snapshot'.format(path))
+  try:
+    with open_snapshot(file_path, 'rb') as file:
+      with tarfile.open(fileobj=file, mode='r|') as archive:
+        archive.extractall('/', members=snapshot_members(archive))
+  except Exception as ex:
+    logging.error('Restoring snapshot error, syncing as usual: {}'.format(ex))
+    for path in snapshot_paths:
+      shutil.rmtree(path, ignore_errors=True)
+      if os.path.exists('{}.pre-snapshot'.format(path)):
+        os.rename('{}.pre-snapshot'.format(path), path)
+    return False
 
-    stop_process(openvassd_proc)
-    stop_process(gvmd_proc)
-    stop_postgres()
-    stop_redis()
+  for path in snapshot_paths:
+    shutil.rmtree('{}.pre-snapshot'.format(path), ignore_errors=True)
+  write_state_marker(snapshot=snapshot)
+  logging.info('Snapshot restored in {:.1f} sec, {} NVTs'.format(time() - started, metadata.get('nvt_count')))
+  return True
+
+def boot_state(directory):
+  '''
+    Restores the snapshot when there is one to restore, then marks the state as in use
+  '''
+  restored = restore_snapshot(directory)
+  write_state_marker(booted=time())
+  return restored
+
+def create_cache():
+  '''
+    Syncs NVTs and feeds into Postgres and Redis with a temporary user, then stops all services
+  '''
+  admin_pass = 'cache'
+  Boot_orchestrator([
+    Service('postgres', run_postgres),
+    Service('redis', run_redis),
+    Service('user', lambda: create_user(ov_user, admin_pass), requires=['postgres']),
+  ]).run()
+
+  # gvmd waits for the scanner itself, wait_sync follows the NVT loading
+  openvassd_proc = subprocess.Popen(['openvassd', '-f'])
+  gvmd_proc = subprocess.Popen(['gvmd', '-f'])
+
+  processor = GVM_client(
+    socket_path=gvm_socket,
+    user=ov_user,
+    password=admin_pass,
+    loglevel=loglevel)
+
+  processor.wait_connection(connection_tries=gvmd_connect_tries, secs_before_attempt=gvmd_wait_secs)
+  write_nvt_count(processor.wait_sync(timeout=cache_sync_timeout_secs, expected_nvts=read_nvt_count()))
+
+  delete_user(ov_user)
+
+  stop_process(openvassd_proc)
+  stop_process(gvmd_proc)
+  stop_postgres()
+  stop_redis()
+
+class TaskRun:
+  def __init__(self, task: Task):
+    self.task = task
+    self.tries = 0
+    self.not_before = 0
+    self.started = None
+    self.finished = None
+    self.result = None
+    self.report_id = None
+    self.shard = parse_shard_name(task.name)
+    self.merged = False
+
+  def duration(self):
+    if self.started == None:
+      return None
+    return (self.finished or time()) - self.started
+
+def create_poller(processor: GVM_client):
+  '''
+    Task poller polling each task between OV_POLL_MIN_SECS and OV_POLL_MAX_SECS apart
+  '''
+  min_secs = get_env_int(env_ov_poll_min_secs, poll_min_secs)
+  max_secs = get_env_int(env_ov_poll_max_secs, max(min_secs, poll_max_secs), minimum=min_secs)
+  return Task_poller(processor, min_secs=min_secs, max_secs=max_secs)
+
+def start_task_run(processor: GVM_client, run: TaskRun):
+  run.tries += 1
+  _task = processor.get_task(run.task.id)
+  if task_can_be_runned(_task):
+    logging.info('#{} try to run task: {}'.format(run.tries, run.task.name))
+    if task_runned(_task) or processor.run_task(run.task.id):
+      logging.info('Waiting for task: {}'.format(run.task.name))
+      run.started = time()
+      return True
+    else:
+      logging.error('Error running task: {}'.format(run.task.name))
   else:
+    logging.error('Wrong task status: {}'.format(run.task.name))
+  return False
+
+def get_report_filter(task_name=None):
+  '''
+    Report filter from the OV_REPORT_* env variables, replaced per task by
+    a <task file>.filter.json sidecar next to the task file
+  '''
+  defaults = Report_filter(
+    min_severity=os.environ.get(env_ov_report_min_severity) or None,
+    min_qod=os.environ.get(env_ov_report_min_qod) or None,
+    apply_overrides=os.environ.get(env_ov_report_apply_overrides, '').lower() in ['1', 'true', 'yes']
+      if os.environ.get(env_ov_report_apply_overrides) else None,
+    exclude_families=[family.strip() for family in os.environ.get(env_ov_report_exclude_families, '').split(',')
+      if family.strip()])
+  if task_name == None:
+    return defaults
+  return load_report_filters(tasks_path, defaults).get(task_name, defaults)
+
+def save_task_report(processor: GVM_client, report_id, merge_report_ids=(), task_name=None):
+  try:
+    processor.save_report(report_id, reports_path,
+      compression=os.environ.get(env_ov_report_compression) or None,
+      page_size=get_env_int(env_ov_report_page_size, 0, minimum=0) or None,
+      output=os.environ.get(env_ov_report_format) or 'xml',
+      merge_report_ids=merge_report_ids,
+      task_name=task_name,
+      delta=bool(os.environ.get(env_ov_report_delta, '')),
+      exports=[output.strip() for output in os.environ.get(env_ov_report_export, '').split(',') if output.strip()],
+      result_filter=get_report_filter(task_name))
+  except Exception as ex:
+    logging.error('Saving report error: {}'.format(ex))
+
+def on_task_status(processor: GVM_client, run: TaskRun, status: Task_status, save_reports):
+  '''
+    Finishes the task run when it is over (done, stopped or crashed).
+    Reports of shard tasks are saved by save_shard_reports once the whole group is over.
+  '''
+  if status.status == 'Done':
+    run.report_id = status.last_report_id
+    if save_reports and run.report_id != None and run.shard == None:
+      save_task_report(processor, run.report_id, task_name=run.task.name)
+    run.result = 'Done'
+    run.finished = time()
+  elif not task_runned(status):
+    logging.error('Ignoring stopped/crashed task: {}'.format(run.task.name))
+    run.result = status.status
+    run.finished = time()
+
+def save_shard_reports(processor: GVM_client, runs, run: TaskRun):
+  '''
+    Saves the reports of a shard group as one report named after the original task
+    when the last of its shards is over
+  '''
+  name = run.shard[0]
+  group = sorted((_run for _run in runs if _run.shard != None and _run.shard[0] == name), key=lambda _run: _run.shard[1])
+  if any(_run.result == None or _run.merged for _run in group):
+    return
+  for _run in group:
+    _run.merged = True
+  report_ids = [_run.report_id for _run in group if _run.report_id != None]
+  if len(report_ids) < len(group):
+    logging.warning('{} of {} shards of task {} have no report'.format(len(group) - len(report_ids), len(group), name))
+  if report_ids:
+    save_task_report(processor, report_ids[0], merge_report_ids=report_ids[1:], task_name=name)
+
+def autorun_tasks(processor: GVM_client, tasks, max_concurrent=1, save_reports=False):
+  '''
+    Keeps up to max_concurrent tasks running and starts the next one
+    as soon as a slot frees up
+  '''
+  started = time()
+  runs = [TaskRun(task) for task in tasks]
+  pending = deque(runs)
+  running = []
+  poller = create_poller(processor)
+
+  while len(pending) > 0 or len(running) > 0:
+    for _ in range(len(pending)):
+      if len(running) >= max_concurrent:
+        break
+      run = pending.popleft()
+      if run.not_before > time():
+        pending.append(run)
+      elif start_task_run(processor, run):
+        running.append(run)
+        poller.watch(run.task.id, lambda status, previous, _run=run:
+          on_task_status(processor, _run, status, save_reports))
+      elif run.tries < task_run_tries:
+        run.not_before = time() + task_retry_secs
+        pending.append(run)
+      else:
+        run.result = 'Not started'
+        metrics.inc('openvas_tasks_finished_total', result=run.result)
+        if save_reports and run.shard != None:
+          save_shard_reports(processor, runs, run)
+
+    waits = []
+    if len(running) > 0:
+      waits.append(poller.next_poll())
+    if len(pending) > 0 and len(running) < max_concurrent:
+      waits.append(max(0, min(run.not_before for run in pending) - time()))
+    if len(waits) > 0:
+      sleep(min(waits))
+
+    poller.poll()
+    for run in list(running):
+      if run.finished != None:
+        poller.unwatch(run.task.id)
+        running.remove(run)
+        logging.info('Task {} finished in {:.0f} sec: {}'.format(run.task.name, run.duration(), run.result))
+        metrics.inc('openvas_tasks_finished_total', result=run.result)
+        metrics.observe('openvas_task_scan_seconds', run.duration())
+        metrics.set('openvas_task_last_scan_seconds', round(run.duration(), 1), task=run.task.name)
+        if save_reports and run.shard != None:
+          save_shard_reports(processor, runs, run)
+
+    metrics.set('openvas_tasks_running', len(running))
+    metrics.set('openvas_tasks_queued', len(pending))
+    export_metrics()
+
+  logging.info('Autorun of {} tasks finished in {:.0f} sec'.format(len(runs), time() - started))
+  for run in runs:
+    duration = run.duration()
+    logging.info('  {}: {}, {}'.format(run.task.name, run.result,
+      'not started' if duration == None else '{:.0f} sec'.format(duration)))
+  return runs
+
+def schedule_tasks(admin_pass, capture=None):
+  '''
+    Runs the tasks of /tasks on the gvmd instances listed in OV_GVMD_ENDPOINTS
+    and saves all their reports to /reports
+  '''
+  socket_paths = [path.strip() for path in os.environ.get(env_ov_gvmd_endpoints, '').split(',') if path.strip()]
+  if not socket_paths:
+    print('No gvmd endpoints specified')
+    print('Please pass comma separated gvmd socket paths via {} env variable'.format(env_ov_gvmd_endpoints))
+    exit(1)
+  endpoints = create_endpoints(socket_paths, admin_pass, user=ov_user,
+    max_concurrent=get_env_int(env_ov_max_concurrent_tasks, 1),
+    client_options={'loglevel': loglevel, 'capture': capture}, poller_factory=create_poller)
+  scheduler = Fanout_scheduler(endpoints, load_jobs(targets_path, tasks_path),
+    save_report=save_task_report, configs_path=configs_path, task_tries=task_run_tries, retry_secs=task_retry_secs)
+  scheduler.run(poll_secs=get_env_int(env_ov_poll_min_secs, poll_min_secs), on_step=export_metrics)
+  export_metrics()
+
+if __name__ == '__main__':
+  logging.basicConfig(level=loglevel)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--create-cache', dest='create_cache', default=False, action='store_true')
+  parser.add_argument('--only-run-tasks', dest='only_run_tasks', default=False, action='store_true')
+  parser.add_argument('--export-snapshot', dest='export_snapshot', default=False, action='store_true')
+  parser.add_argument('--schedule', dest='schedule', default=False, action='store_true')
+  args = parser.parse_args()
+
+  if args.create_cache or args.export_snapshot:
+    create_cache()
+    if args.export_snapshot:
+      export_snapshot(os.environ.get(env_ov_snapshot_dir) or snapshot_dir)
+  elif args.schedule:
+    serve_metrics()
+    schedule_tasks(os.environ.get(env_ov_passwd), create_capture())
+  else:
+    serve_metrics()
+    capture = create_capture()
     admin_pass = os.environ.get(env_ov_passwd)
     if not args.only_run_tasks:
-      run_postgres()
-      run_redis()
-
-      if admin_pass != None:
-        create_user(ov_user, admin_pass)
-      else:
+      if admin_pass == None:
         print('Admin password hasn\'t specified')
         print('Please pass admin password via {} env variable'.format(env_ov_passwd))
         exit(1)
-
-      supervisor_proc = subprocess.Popen(['supervisord','-n', '-c', '/etc/openvas-supervisor.conf'])
+      profile, redis_config = tune_resources()
+
+      services = Boot_orchestrator([
+        Service('snapshot', lambda: boot_state(os.environ.get(env_ov_snapshot_dir) or snapshot_dir)),
+        Service('postgres', lambda: subprocess.Popen(['/etc/init.d/postgresql', 'start']).wait(), probe_postgres,
+          requires=['snapshot']),
+        Service('redis', lambda: subprocess.Popen(['redis-server', redis_config]), probe_redis, requires=['snapshot']),
+        Service('user', lambda: create_user(ov_user, admin_pass), requires=['postgres']),
+        Service('supervisor', run_supervisor, requires=['postgres', 'redis', 'user']),
+      ]).run()
+      supervisor_proc = services['supervisor'].result
 
     try:
       processor = GVM_client(
         socket_path=gvm_socket,
         user=ov_user,
         password=admin_pass,
-        loglevel=loglevel)
+        loglevel=loglevel,
+        capture=capture)
 
       processor.wait_connection(connection_tries=gvmd_connect_tries, secs_before_attempt=gvmd_wait_secs)
-      processor.wait_sync()
+      processor.wait_sync(timeout=get_env_int(env_ov_sync_timeout, sync_timeout_secs), expected_nvts=read_nvt_count())
 
       if not args.only_run_tasks:
-        processor.import_configs(configs_path)
-        processor.import_targets(targets_path)
-        processor.import_tasks(tasks_path)
-        processor.import_reports(reports_path)
-        processor.import_overrides(overrides_path)
+        client_factory = lambda: GVM_client(socket_path=gvm_socket, user=ov_user, password=admin_pass,
+          loglevel=loglevel, capture=capture, task_defaults=profile.task_defaults() if profile != None else None,
+          target_shards=get_env_int(env_ov_target_shards, 1))
+        reconcile = os.environ.get(env_ov_reconcile, '')
+        if reconcile != 'dry-run':
+          pipeline = Import_pipeline(client_factory,
+            parallelism=get_env_int(env_ov_import_parallelism, 4),
+            manifest=Import_manifest(os.environ.get(env_ov_import_manifest) or import_manifest_path))
+          # in reconcile mode targets, tasks and overrides are left to the reconciler
+          pipeline.run(
+            configs_path=configs_path,
+            targets_path=None if reconcile else targets_path,
+            tasks_path=None if reconcile else tasks_path,
+            reports_path=reports_path,
+            overrides_path=None if reconcile else overrides_path)
+          pipeline.close()
+        if reconcile:
+          Reconciler(client_factory(), prune=bool(os.environ.get(env_ov_reconcile_prune, ''))).run(
+            targets_path=targets_path,
+            tasks_path=tasks_path,
+            overrides_path=overrides_path,
+            dry_run=reconcile == 'dry-run')
+        export_metrics()
 
       if os.environ.get(env_ov_run_tasks, ''):
-        tasks = processor.get_tasks()
-        for task in tasks:
-          for run_try in range(1, 4):
-            _task = processor.get_task(task.id)
-            if task_can_be_runned(_task):
-              logging.info('#{} try to run task: {}'.format(run_try, task.name))
-              if task_runned(_task) or processor.run_task(task.id):
-                logging.info('Waiting for task: {}'.format(task.name))
-                while True:
-                  sleep(task_wait_secs)
-                  _task = processor.get_task(task.id)
-                  if _task != None and _task.status == 'Done':
-                    if os.environ.get(env_ov_save_reports, '') and _task.last_report != None:
-                      try:
-                        processor.save_report(_task.last_report.id, reports_path)
-                      except Exception as ex:
-                        logging.error('Saving report error: {}'.format(ex))
-                    break
-                  elif _task != None and not task_runned(_task):
-                    logging.error('Ignoring stopped/crashed task: {}'.format(task.name))
-                    break
-                break
-              else:
-                logging.error('Error running task: {}'.format(task.name))
-                sleep(5)
-            else:
-              logging.error('Wrong task status: {}'.format(task.name))
-              sleep(5)
+        autorun_tasks(processor, processor.get_tasks() or [],
+          max_concurrent=get_env_int(env_ov_max_concurrent_tasks, 1),
+          save_reports=bool(os.environ.get(env_ov_save_reports, '')))
+        processor.log_stats()
+        export_metrics()
 
     except Exception as ex:
       logging.error('GVM_client error: {}'.format(ex))
+      if capture != None:
+        capture.dump('GVM_client error: {}'.format(ex), force=True)
 
     if not args.only_run_tasks:
       supervisor_proc.wait()
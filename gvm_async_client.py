@@ -0,0 +1,451 @@
+'''
+  asyncio counterpart of GVM_client. Keeps a pool of gvmd connections open so
+  that one process can poll tasks, start scans and download reports at once.
+  Every operation accepts a timeout and can be cancelled; a connection whose
+  command was interrupted is closed and reconnected on next use. File reads and
+  parsing run in the default executor, so they do not hold up the event loop.
+'''
+
+import asyncio
+import logging
+import lxml.etree as ET
+from contextlib import contextmanager
+from time import time
+from gvm.errors import GvmError
+from gvm_client import (Command_builder, Name_index, Report, Task, Task_status,
+  Override, Target, Report_file, command_name, container_task_command, create_config_chunks, create_report_chunks,
+  file_digest, get_report_command, last_report_page, manifest_check_commands, metrics, parse_xml_file, plan_imports,
+  read_xml_fields, shard_tasks, split_target, stream_chunk_size, task_command)
+
+def authenticate_command(user:str, password:str):
+  command = ET.Element('authenticate')
+  credentials = ET.SubElement(command, 'credentials')
+  ET.SubElement(credentials, 'username').text = user
+  ET.SubElement(credentials, 'password').text = password
+  return ET.tostring(command)
+
+class Response_error(GvmError):
+  '''
+    Error status of a response that was read whole, the connection stays usable
+  '''
+
+def check_response(root):
+  status = root.get('status')
+  if status == None:
+    raise Response_error('No status in response.', root)
+  if status[0] != '2':
+    raise Response_error('Error in response. {}'.format(root.get('status_text')), root)
+  return root
+
+def in_thread(function, *args):
+  '''
+    Runs blocking file or XML work in the default executor
+  '''
+  return asyncio.get_event_loop().run_in_executor(None, function, *args)
+
+def consume_chunk(parser, writer, chunk:bytes):
+  for event, element, path in parser.feed(chunk):
+    writer.handle(event, element, path)
+
+class Async_connection:
+  '''
+    One authenticated GMP connection over the gvmd Unix socket
+  '''
+  def __init__(self, socket_path:str, user:str, password:str, chunk_size=stream_chunk_size):
+    self.socket_path = socket_path
+    self.user = user
+    self.password = password
+    self.chunk_size = chunk_size
+    self.reader = None
+    self.writer = None
+    self.sent = 0
+    self.received = 0
+
+  @property
+  def connected(self):
+    return self.writer != None
+
+  async def connect(self):
+    self.reader, self.writer = await asyncio.open_unix_connection(self.socket_path)
+    metrics.inc('gmp_authentications_total')
+    await self.command(authenticate_command(self.user, self.password))
+
+  def close(self):
+    if self.writer != None:
+      self.writer.close()
+    self.reader = None
+    self.writer = None
+
+  async def send(self, data):
+    if isinstance(data, str):
+      data = data.encode('utf-8')
+    self.writer.write(data)
+    self.sent += len(data)
+    await self.writer.drain()
+
+  async def send_chunks(self, chunks):
+    '''
+      Sends chunks of a generator that reads a file, reading in the executor
+    '''
+    while True:
+      chunk = await in_thread(next, chunks, None)
+      if chunk == None:
+        return
+      self.writer.write(chunk)
+      self.sent += len(chunk)
+      await self.writer.drain()
+
+  async def read_chunk(self):
+    data = await self.reader.read(self.chunk_size)
+    if not data:
+      raise GvmError('Remote closed the connection')
+    self.received += len(data)
+    return data
+
+  async def read_response(self):
+    parser = ET.XMLPullParser(events=('start', 'end'), huge_tree=True)
+    depth = 0
+    while True:
+      parser.feed(await self.read_chunk())
+      for event, element in parser.read_events():
+        depth += 1 if event == 'start' else -1
+        if depth == 0:
+          return check_response(element)
+
+  @contextmanager
+  def measure(self, name:str):
+    started, sent, received = time(), self.sent, self.received
+    error = True
+    try:
+      yield
+      error = False
+    finally:
+      metrics.record_command(name, time() - started, self.sent - sent, self.received - received, error)
+
+  async def command(self, command):
+    with self.measure(command_name(command)):
+      await self.send(command)
+      return await self.read_response()
+
+  async def send_command_chunks(self, chunks):
+    chunks = iter(chunks)
+    head = await in_thread(next, chunks, b'')
+    with self.measure(command_name(head)):
+      await self.send(head)
+      await self.send_chunks(chunks)
+      return await self.read_response()
+
+class Async_GVM_client:
+  def __init__(self, password, socket_path='/var/run/gvmd.sock', user='admin', connections=4, timeout=60):
+    self.socket_path = socket_path
+    self.user = user
+    self.password = password
+    self.connections = max(1, connections)
+    self.timeout = timeout
+    self.builder = Command_builder()
+    self.index = Name_index()
+    self.manifest = None
+    self.task_defaults = {}
+    self.target_shards = 1
+    self.pool = None
+    self.all_connections = []
+    self.stats = {'connects': 0, 'calls': 0, 'errors': 0, 'timeouts': 0}
+
+  async def open(self):
+    if self.pool == None:
+      self.pool = asyncio.Queue()
+      for _ in range(self.connections):
+        connection = Async_connection(self.socket_path, self.user, self.password)
+        self.all_connections.append(connection)
+        self.pool.put_nowait(connection)
+    return self
+
+  def close(self):
+    for connection in self.all_connections:
+      connection.close()
+
+  async def __aenter__(self):
+    return await self.open()
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  async def run(self, operation, timeout=-1):
+    '''
+      Runs operation(connection) on a pooled connection.
+      timeout: seconds, None for no limit, -1 for the client default
+    '''
+    await self.open()
+    if timeout == -1:
+      timeout = self.timeout
+    connection = await self.pool.get()
+    try:
+      self.stats['calls'] += 1
+      return await asyncio.wait_for(self._run(connection, operation), timeout)
+    except Response_error:
+      # an error status of a whole response, the connection is in sync
+      self.stats['errors'] += 1
+      raise
+    except BaseException as ex:
+      # the response may be half read, the connection can't be reused
+      self.stats['errors'] += 1
+      if isinstance(ex, asyncio.TimeoutError):
+        self.stats['timeouts'] += 1
+      connection.close()
+      raise
+    finally:
+      self.pool.put_nowait(connection)
+
+  async def _run(self, connection:Async_connection, operation):
+    if not connection.connected:
+      self.stats['connects'] += 1
+      await connection.connect()
+    return await operation(connection)
+
+  async def command(self, command, timeout=-1):
+    return await self.run(lambda connection: connection.command(command), timeout)
+
+  async def wait_connection(self, connection_tries=10, secs_before_attempt=5):
+    for attempt in range(connection_tries + 1):
+      try:
+        await self.command(self.builder.get_version())
+        return True
+      except (OSError, GvmError, asyncio.TimeoutError) as ex:
+        logging.error('Can\'t connect to service: {}'.format(ex))
+        await asyncio.sleep(secs_before_attempt)
+    raise Exception('Can\'t connect to gvmd in {} sec'.format(connection_tries*secs_before_attempt))
+
+  async def get_tasks(self, exclude_containers=True, timeout=-1):
+    try:
+      tasks = (await self.command(self.builder.get_tasks(filter='rows=-1'), timeout)).xpath('task')
+      logging.info('Tasks found in DB: {}'.format(', '.join([task.findtext('name') for task in tasks])))
+      return [Task(task) for task in tasks
+        if not exclude_containers or task.find('target').get('id') != '']
+    except asyncio.TimeoutError:
+      raise
+    except (OSError, GvmError) as ex:
+      logging.error('Getting tasks error: {}'.format(ex))
+      return False
+
+  async def get_task(self, task_id:str, timeout=-1):
+    try:
+      response = await self.command(self.builder.get_task(task_id), timeout)
+      task = Task(response.find('task'))
+      logging.debug('Getting task OK: {} [{}]'.format(task.name, task_id))
+      return task
+    except asyncio.TimeoutError:
+      raise
+    except (OSError, GvmError) as ex:
+      logging.error('Getting task error: {}'.format(ex))
+
+  async def get_task_statuses(self, task_ids:list, timeout=-1):
+    if len(task_ids) == 0:
+      return {}
+    try:
+      task_filter = 'rows=-1 {}'.format(' or '.join('uuid={}'.format(task_id) for task_id in task_ids))
+      response = await self.command(self.builder.get_tasks(filter=task_filter, details=False), timeout)
+      statuses = [Task_status(task) for task in response.xpath('task')]
+      return {status.id: status for status in statuses if status.id in task_ids}
+    except asyncio.TimeoutError:
+      raise
+    except (OSError, GvmError) as ex:
+      logging.error('Getting task statuses error: {}'.format(ex))
+      return {}
+
+  async def run_task(self, task_id:str, timeout=-1):
+    try:
+      response = await self.command(self.builder.start_task(task_id), timeout)
+      if response.get('status') == '202':
+        logging.info('Running task OK: {}'.format(task_id))
+        return True
+      return False
+    except asyncio.TimeoutError:
+      raise
+    except (OSError, GvmError) as ex:
+      logging.error('Running task error: {}'.format(ex))
+      return False
+
+  async def fetch_report(self, connection:Async_connection, writer, report_id:str, page_size=None):
+    writer.begin_report(report_id, page_size)
+    while True:
+      parser = writer.begin_page()
+      command = get_report_command(writer, report_id, page_size)
+      try:
+        with connection.measure(command_name(command)):
+          await connection.send(command)
+          while not parser.done:
+            await in_thread(consume_chunk, parser, writer, await connection.read_chunk())
+      finally:
+        count = writer.end_page()
+      if last_report_page(writer, count, page_size):
+        break
+
+  async def save_report(self, report_id:str, directory:str, compression=None, page_size=None, output='xml',
+    merge_report_ids=(), task_name=None, delta=False, exports=(), result_filter=None, timeout=None):
+    '''
+      Same as GVM_client.save_report, by default downloads have no timeout
+    '''
+    report_file = Report_file(directory, report_id, compression, output, task_name, delta, exports, result_filter,
+      merge=bool(merge_report_ids))
+
+    async def fetch(connection):
+      for _report_id in [report_id] + list(merge_report_ids):
+        await self.fetch_report(connection, writer, _report_id, page_size)
+      await in_thread(writer.finish)
+
+    try:
+      with report_file.open() as writer:
+        await self.run(fetch, timeout)
+      await in_thread(report_file.store)
+      return True
+    except asyncio.CancelledError:
+      report_file.discard()
+      raise
+    except Exception as ex:
+      logging.error('Saving report error: {}'.format(ex))
+      report_file.discard()
+      return False
+
+  async def build_index(self, timeout=-1):
+    try:
+      others = []
+      if self.manifest != None:
+        for command, tag in manifest_check_commands(self.manifest):
+          others += (await self.command(command, timeout)).xpath(tag)
+      targets, configs, tasks = await asyncio.gather(
+        self.command(self.builder.get_targets(filter='rows=-1'), timeout),
+        self.command(self.builder.get_configs(filter='rows=-1'), timeout),
+        self.command(self.builder.get_tasks(filter='rows=-1'), timeout))
+      self.index.build(targets.xpath('target'), configs.xpath('config'), tasks.xpath('task'), others)
+    except asyncio.TimeoutError:
+      raise
+    except (OSError, GvmError) as ex:
+      logging.error('Building name index error: {}'.format(ex))
+    return self.index.built
+
+  async def import_once(self, kind:str, file_path:str, import_file):
+    if self.manifest == None:
+      return await import_file(file_path)
+    digest = await in_thread(file_digest, file_path)
+    object_id = self.manifest.lookup(file_path, digest)
+    if object_id != None and object_id in self.index.ids:
+      logging.info('Skipping unchanged file {}'.format(file_path))
+      self.manifest.skip()
+      return object_id
+    object_id = await import_file(file_path)
+    if object_id != None:
+      self.manifest.record(kind, file_path, digest, object_id)
+    return object_id
+
+  async def _create(self, kind:str, name:str, command, timeout=-1):
+    response = await self.command(command, timeout)
+    if response.get('status') == '201':
+      self.index.add(kind, name, response.get('id'))
+      logging.info('Importing {} OK: {}'.format(kind[:-1], name))
+      return response.get('id')
+
+  async def import_config_file(self, file_path:str, timeout=-1):
+    async def import_file(file_path):
+      try:
+        config_name = (await in_thread(read_xml_fields, file_path, {'name': ('config', 'name')})).get('name')
+        response = await self.run(lambda connection: connection.send_command_chunks(create_config_chunks(file_path)), timeout)
+        self.index.add('configs', config_name, response.get('id'))
+        logging.info('Importing config OK: {}'.format(config_name))
+        return response.get('id')
+      except asyncio.TimeoutError:
+        raise
+      except (OSError, GvmError) as ex:
+        logging.error('Importing config error: {}'.format(ex))
+    return await self.import_once('configs', file_path, import_file)
+
+  async def import_target_file(self, file_path:str, timeout=-1):
+    async def import_file(file_path):
+      try:
+        target = Target(await in_thread(parse_xml_file, file_path))
+        ids = [await self._create('targets', shard.name, self.builder.create_target(**shard.create_args()), timeout)
+          for shard in split_target(target, self.target_shards)]
+        return ids[0] if all(ids) else None
+      except asyncio.TimeoutError:
+        raise
+      except (OSError, GvmError) as ex:
+        logging.error('Importing target error: {}'.format(ex))
+    return await self.import_once('targets', file_path, import_file)
+
+  async def import_task_file(self, file_path:str, timeout=-1):
+    async def import_file(file_path):
+      try:
+        root = await in_thread(parse_xml_file, file_path)
+        tasks = shard_tasks(root, self.index)
+        if not tasks:
+          logging.debug('Importing task - {}. No target_id found'.format(Task(root).name))
+          return None
+        ids = []
+        for task in tasks:
+          task.config_id = self.index.configs.get(task.config_name)
+          ids.append(await self._create('tasks', task.name, task_command(task.apply_defaults(self.task_defaults)), timeout))
+        return ids[0] if all(ids) else None
+      except asyncio.TimeoutError:
+        raise
+      except (OSError, GvmError) as ex:
+        logging.error('Importing task error: {}'.format(ex))
+    return await self.import_once('tasks', file_path, import_file)
+
+  async def import_override_file(self, file_path:str, timeout=-1):
+    async def import_file(file_path):
+      try:
+        override = Override(await in_thread(parse_xml_file, file_path))
+        response = await self.command(self.builder.create_override(**override.create_args()), timeout)
+        logging.info('Creating override OK: {}'.format(override.text))
+        return response.get('id')
+      except asyncio.TimeoutError:
+        raise
+      except (OSError, GvmError) as ex:
+        logging.error('Importing override error: {}'.format(ex))
+    return await self.import_once('overrides', file_path, import_file)
+
+  async def get_container_task(self, task_name:str, task_comment=None, timeout=-1):
+    if task_name not in self.index.container_tasks:
+      await self._create('container_tasks', task_name, container_task_command(task_name, task_comment), timeout)
+    return self.index.container_tasks.get(task_name)
+
+  async def import_report_file(self, file_path:str, timeout=None):
+    async def import_file(file_path):
+      try:
+        report = await in_thread(Report.from_file, file_path)
+        task_id = await self.get_container_task(report.task_name, report.task_comment)
+        response = await self.run(lambda connection:
+          connection.send_command_chunks(create_report_chunks(file_path, report, task_id)), timeout)
+        logging.info('Importing report OK: {}'.format(report.task_name))
+        return response.get('id')
+      except asyncio.TimeoutError:
+        raise
+      except (OSError, GvmError) as ex:
+        logging.error('Importing report error: {}'.format(ex))
+    return await self.import_once('reports', file_path, import_file)
+
+  async def import_all(self, **paths):
+    '''
+      Imports configs, targets, tasks, reports and overrides concurrently
+      with the same ordering constraints as Import_pipeline
+    '''
+    started = time()
+    await self.build_index()
+    levels = await in_thread(lambda: plan_imports(**paths))
+
+    async def run_job(phase, job):
+      for method, file_path in job:
+        phase.done(await getattr(self, method.__name__)(file_path) != None)
+
+    for phases in levels:
+      for phase in phases:
+        phase.started = phase.finished = time()
+      await asyncio.gather(*[run_job(phase, job) for phase in phases for job in phase.jobs])
+
+    if self.manifest != None:
+      await in_thread(self.manifest.save)
+    logging.info('Import finished in {:.1f} sec with {} connections'.format(time() - started, self.connections))
+    for phases in levels:
+      for phase in phases:
+        logging.info('  {}: {}/{} files imported in {:.1f} sec'.format(
+          phase.name, phase.imported, phase.files, phase.seconds()))
+    return levels
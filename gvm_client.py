@@ -1,16 +1,56 @@
+import csv
 import glob
+import gzip
+import hashlib
 import io
+import ipaddress
+import json
 import os
+import copy
 import datetime
 import decimal
 import logging
+import mmap
+import queue
+import random
+import re
+import socketserver
+import threading
+import resource
+from collections import deque
+import shutil
+import tempfile
 import lxml.etree as ET
-from time import sleep
-from gvm.connections import UnixSocketConnection, DebugConnection
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import sleep, time
+from xml.sax.saxutils import quoteattr
+from gvm.connections import UnixSocketConnection
 from gvm.protocols.latest import Gmp
 from gvm.transforms import EtreeCheckCommandTransform
 from gvm.errors import GvmError
 
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+stream_chunk_size = 64 * 1024
+xml_extensions = ('.xml', '.xml.gz', '.xml.zst')
+xml_head_size = 4096
+shard_min_hosts = 16
+poll_min_secs = 5
+poll_max_secs = 120
+default_scanner_id = '08b69003-5fc2-4037-a479-93b440211c73'
+metric_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600)
+
 def objectify(element):
   result = {}
   items = []
@@ -56,6 +96,80 @@ def get_root(tree, root_name):
   else:
     return None
 
+def iter_xml_files(directory:str):
+  for file_name in sorted(os.listdir(directory)):
+    if file_name.lower().endswith(xml_extensions):
+      yield os.path.join(directory, file_name)
+
+def open_xml_file(file_path:str):
+  if file_path.lower().endswith('.gz'):
+    return gzip.open(file_path, 'rb')
+  elif file_path.lower().endswith('.zst'):
+    if zstandard == None:
+      raise Exception('Reading {} requires zstandard package'.format(file_path))
+    return zstandard.open(file_path, 'rb')
+  return io.open(file_path, 'rb')
+
+def read_xml_fields(file_path:str, fields:dict, stop_path=None):
+  '''
+    Reads text of a few elements (paths relative to the root) and the root id
+    with iterparse, stopping as soon as all of them are found or stop_path starts
+  '''
+  result = {}
+  path = []
+  with open_xml_file(file_path) as file:
+    for event, element in ET.iterparse(file, events=('start', 'end'), huge_tree=True):
+      if event == 'start':
+        path.append(element.tag)
+        if len(path) == 1:
+          result['id'] = element.get('id')
+        elif tuple(path[1:]) == stop_path:
+          break
+      else:
+        _path = tuple(path[1:])
+        for key, field_path in fields.items():
+          if field_path == _path:
+            result[key] = element.text
+        path.pop()
+        if len(path) > 1 and all(key in result for key in fields):
+          break
+  return result
+
+def parse_xml_file(file_path:str):
+  logging.info('Reading file {}'.format(file_path))
+  with open_xml_file(file_path) as file:
+    return ET.parse(file).getroot()
+
+def iter_xml_body(file_path:str, chunk_size=stream_chunk_size):
+  '''
+    Yields file contents without the XML declaration, memory-mapping plain files
+  '''
+  with open_xml_file(file_path) as file:
+    if isinstance(file, io.BufferedReader) and os.fstat(file.fileno()).st_size > 0:
+      with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for offset in range(xml_body_start(data[:xml_head_size]), len(data), chunk_size):
+          yield data[offset:offset + chunk_size]
+    else:
+      head = file.read(max(chunk_size, xml_head_size))
+      yield head[xml_body_start(head):]
+      while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+          break
+        yield chunk
+
+def wrap_chunks(head:bytes, chunks, tail:bytes):
+  yield head
+  for chunk in chunks:
+    yield chunk
+  yield tail
+
+def xml_body_start(head:bytes):
+  start = 3 if head.startswith(b'\xef\xbb\xbf') else 0
+  if head.startswith(b'<?xml', start):
+    start = head.index(b'?>', start) + 2
+  return start
+
 class Filter:
   def __init__(self, filter_root=None):
     if filter_root != None:
@@ -75,46 +189,171 @@ class Filter:
     self.type = filter_type
     self.comment = comment
 
-class Override:
-  text = None
-  nvt_oid = None
-  port = None
-  hosts= None
-  comment = None
-  threat = None
-  new_threat = None
-  severity = None
-  new_severity = None
-  result_id = None
-  task_id = None
-  seconds_active = None
-
-  def __init__(self, override_root=None):
-    if override_root != None:
-      root = get_root(override_root, 'override')
-
-      for key, val in objectify(root).items():
-        setattr(self, key, val)
-
-      for field, attr in [('nvt','oid'), ('result','id'), ('task','id')]:
-        try:
-          attr_val = root.find(field).attrib[attr]
-          if attr_val != '':
-            setattr(self, '{}_{}'.format(field, attr), attr_val)
-        except:
-          pass
-      try:
-        self.hosts = root.findtext('hosts').split(', ')
-      except:
-        self.hosts = None
+class Field:
+  '''
+    Model attribute filled from a direct child element of the root
+  '''
+  __slots__ = ('attr', 'tag', 'convert', 'many')
+
+  def __init__(self, attr:str, tag=None, convert=None, many=False):
+    self.attr = attr
+    self.tag = tag or attr
+    self.convert = convert or element_text
+    self.many = many
+
+def element_text(element):
+  return element.text or None
+
+def element_attr(name:str):
+  def convert(element):
+    return element.get(name) or None
+  return convert
+
+def child_text(path:str):
+  def convert(element):
+    return element.findtext(path) or None
+  return convert
+
+def child_attr(path:str, name:str):
+  def convert(element):
+    child = element.find(path)
+    return child.get(name) or None if child is not None else None
+  return convert
+
+def element_int(element):
+  try:
+    return int(element.text)
+  except (TypeError, ValueError):
+    return None
 
-      try:
-        end_time = root.findtext('end_time', None)
-        span = datetime.datetime.strptime(end_time, r'%Y-%m-%dT%H:%M:%SZ') - datetime.datetime.now()
-        if span.total_seconds() > 0:
-          self.seconds_active = int(span.total_seconds())
-      except:
-        pass
+def element_bool(element):
+  try:
+    return bool(int(element.text))
+  except (TypeError, ValueError):
+    return None
+
+def element_split(element):
+  return element.text.split(', ') if element.text else []
+
+def element_seconds_left(element):
+  try:
+    span = datetime.datetime.strptime(element.text, r'%Y-%m-%dT%H:%M:%SZ') - datetime.datetime.now()
+    if span.total_seconds() > 0:
+      return int(span.total_seconds())
+  except (TypeError, ValueError):
+    pass
+  return None
+
+def element_bytes(element):
+  # a copy, so the model does not keep the whole response tree alive
+  return ET.tostring(element)
+
+def element_preferences(element):
+  return {preference.findtext('scanner_name'): preference.findtext('value') or ''
+    for preference in element.iterfind('preference') if preference.findtext('scanner_name')}
+
+def lazy_model(slot:str, model, path:str):
+  '''
+    Property parsing a rarely used sub-element, kept serialized, only when it is accessed
+  '''
+  def getter(self):
+    value = getattr(self, slot)
+    if isinstance(value, bytes):
+      element = ET.fromstring(value).find(path)
+      value = model(element) if element is not None else None
+      setattr(self, slot, value)
+    return value
+
+  def setter(self, value):
+    setattr(self, slot, value)
+
+  return property(getter, setter)
+
+class Model:
+  '''
+    Base of GMP object models. Subclasses list their fields, the parser
+    makes one pass over the direct children of the root and dispatches
+    them by tag, filling __slots__ attributes.
+  '''
+  __slots__ = ()
+  root_tag = None
+  fields = ()
+  defaults = {}
+
+  def __init_subclass__(cls, **kwargs):
+    super().__init_subclass__(**kwargs)
+    handlers = {}
+    for field in cls.fields:
+      handlers.setdefault(field.tag, []).append(field)
+    cls._handlers = {tag: tuple(fields) for tag, fields in handlers.items()}
+    cls._attrs = tuple(field.attr for field in cls.fields if field.attr in cls.__slots__)
+
+  def __init__(self, root=None):
+    for attr in self._attrs:
+      setattr(self, attr, None)
+    for attr, value in self.defaults.items():
+      setattr(self, attr, value() if callable(value) else value)
+    self.id = None
+    if root is not None:
+      root = get_root(root, self.root_tag)
+      if root is not None:
+        self.parse(root)
+
+  def parse(self, root):
+    self.id = root.get('id') or None
+    handlers = self._handlers
+    for child in root:
+      fields = handlers.get(child.tag)
+      if fields == None:
+        continue
+      for field in fields:
+        value = field.convert(child)
+        if field.many:
+          if value != None:
+            values = getattr(self, field.attr)
+            if values == None:
+              values = []
+              setattr(self, field.attr, values)
+            values.append(value)
+        else:
+          setattr(self, field.attr, value)
+
+def model_slots(fields, *extra):
+  return ('id',) + tuple(field.attr for field in fields) + extra
+
+class Override(Model):
+  root_tag = 'override'
+  fields = (
+    Field('text'),
+    Field('nvt_oid', 'nvt', element_attr('oid')),
+    Field('port'),
+    Field('hosts', convert=lambda element: element_split(element) or None),
+    Field('comment'),
+    Field('threat'),
+    Field('new_threat'),
+    Field('severity'),
+    Field('new_severity'),
+    Field('result_id', 'result', element_attr('id')),
+    Field('task_id', 'task', element_attr('id')),
+    Field('seconds_active', 'end_time', element_seconds_left),
+  )
+  __slots__ = model_slots(fields)
+
+  def create_args(self):
+    return {
+      'text': self.text,
+      'nvt_oid': self.nvt_oid,
+      'seconds_active': self.seconds_active,
+      'comment': self.comment,
+      'hosts': self.hosts,
+      'port': self.port,
+      'result_id': self.result_id,
+      'severity': self.severity,
+      'new_severity': self.new_severity,
+      'task_id': self.task_id,
+      'threat': self.threat,
+      'new_threat': self.new_threat,
+    }
 
   @classmethod
   def new(cls, text:str, nvt_oid:str, hosts=None, port=None, comment=None, threat=None, new_threat=None,
@@ -134,103 +373,60 @@ class Override:
     self.result_id=result_id
     self.task_id=task_id
     self.seconds_active=seconds_active
+    return self
 
-class Report:
-  def __init__(self, report_root=None):
-    if report_root != None:
-      root = get_root(report_root, 'report')
-      if root != None:
-        try:
-          self.id = root.attrib['id']
-        except:
-          return None
-        try:
-          self.name = root.findtext('name', None)
-        except:
-          pass
-        try:
-          self.task_name = root.findtext('task/name', None)
-        except:
-          pass
-        try:
-          self.task_comment = root.findtext('task/comment', None)
-        except:
-          pass
-        self.raw = ET.tostring(root)
-      else:
-        return None
-
-class Task:
-  name = None
-  config_id = None
-  target_id = None
-  scanner_id = None
-  hosts_ordering = None
-  schedule_id = None
-  schedule_periods = None
-  comment = None
-  alert_ids = None
-  observers = None
-  alterable = True
-  status = None
-  progress = None
-  last_report = None
-  config = None
-
-  def __init__(self, task_root=None):
-    if task_root != None:
-      root = get_root(task_root, 'task')
-
-      self.raw = ET.tostring(root)
-
-      for key, val in objectify(root).items():
-        setattr(self, key, val)
-
-      for field, attr in [('config','id'), ('target','id'), ('scanner','id'), ('schedule','id')]:
-        try:
-          attr_val = getattr(self, field, '')[attr]
-          if attr_val != '':
-            setattr(self, '{}_{}'.format(field, attr), attr_val)
-        except:
-          pass
+class Report(Model):
+  root_tag = 'report'
+  fields = (
+    Field('name'),
+    Field('task_name', 'task', child_text('name')),
+    Field('task_comment', 'task', child_text('comment')),
+  )
+  __slots__ = model_slots(fields)
 
-      if self.schedule_periods != None:
-        try:
-          self.schedule_periods = int(self.schedule_periods)
-        except:
-          self.schedule_periods = None
-
-      for field, attr in [('alert','id')]:
-        result = []
-        for field_el in root.findall(field):
-          try:
-            attr_val = field_el.attrib[attr]
-            if attr_val != None and attr_val != '':
-              result.append(attr_val)
-          except:
-            pass
-        if len(result) > 0:
-          setattr(self, '{}_{}s'.format(field, attr), result)
-
-      for field in ['observers']:
-        field_value = getattr(self, field, None)
-        if isinstance(field_value, str):
-          if field_value != '':
-            setattr(self, field, field_value.split(', '))
-          else:
-            setattr(self, field, None)
-
-      try:
-        current_report = root.find('current_report/report')
-        self.current_report = Report(current_report)
-      except:
-        pass
+  @classmethod
+  def from_file(cls, file_path:str):
+    '''
+      Reads only the report header, results are not parsed
+    '''
+    self = cls()
+    fields = read_xml_fields(file_path, {
+      'name': ('name',),
+      'task_name': ('task', 'name'),
+      'task_comment': ('task', 'comment'),
+    }, stop_path=('report',))
+    self.id = fields.pop('id', None)
+    for key in ['name', 'task_name', 'task_comment']:
+      setattr(self, key, fields.get(key))
+    return self
 
-      try:
-        last_report = root.find('last_report/report')
-        self.last_report = Report(last_report)
-      except:
-        pass
+class Task(Model):
+  root_tag = 'task'
+  fields = (
+    Field('name'),
+    Field('comment'),
+    Field('status'),
+    Field('progress', convert=element_int),
+    Field('config_id', 'config', element_attr('id')),
+    Field('config_name', 'config', child_text('name')),
+    Field('target_id', 'target', element_attr('id')),
+    Field('target_name', 'target', child_text('name')),
+    Field('scanner_id', 'scanner', element_attr('id')),
+    Field('schedule_id', 'schedule', element_attr('id')),
+    Field('schedule_periods', convert=element_int),
+    Field('hosts_ordering'),
+    Field('alert_ids', 'alert', element_attr('id'), many=True),
+    Field('observers', convert=lambda element: element_split(element) or None),
+    Field('alterable', convert=element_bool),
+    Field('preferences', convert=element_preferences),
+    Field('_current_report', 'current_report', element_bytes),
+    Field('_last_report', 'last_report', element_bytes),
+  )
+  __slots__ = model_slots(fields)
+  defaults = {'alterable': True, 'preferences': dict}
+
+  current_report = lazy_model('_current_report', Report, 'report')
+  last_report = lazy_model('_last_report', Report, 'report')
 
   def __str__(self):
     return 'Task stance: name={}, config={}, target={}, scanner={}'.format(
@@ -239,6 +435,33 @@ class Task:
       self.target_id,
       self.scanner_id)
 
+  def create_args(self):
+    return {
+      'name': self.name,
+      'target_id': self.target_id,
+      'scanner_id': self.scanner_id,
+      'config_id': self.config_id,
+      'comment': self.comment,
+      'alterable': self.alterable,
+      'alert_ids': self.alert_ids,
+      'hosts_ordering': self.hosts_ordering,
+      'schedule_id': self.schedule_id,
+      'schedule_periods': self.schedule_periods,
+      'observers': self.observers,
+    }
+
+  def apply_defaults(self, defaults:dict):
+    '''
+      Fills hosts_ordering and scanner preferences (max_hosts, max_checks...) not set by the task
+    '''
+    for key, value in defaults.items():
+      if key == 'hosts_ordering':
+        if self.hosts_ordering == None:
+          self.hosts_ordering = value
+      elif key not in self.preferences:
+        self.preferences[key] = str(value)
+    return self
+
   @classmethod
   def new(cls, name:str, config_id:str, scanner_id:str, target_id:str,
     hosts_ordering=None, schedule_id=None, schedule_periods=None, comment=None,
@@ -257,58 +480,64 @@ class Task:
     self.alert_ids = alert_ids
     self.observers = observers
     self.alterable = alterable
+    return self
 
-class Target:
-  # required
-  name = None
-  # optional
-  hosts = []
-  exclude_hosts = []
-  port_range = None
-  port_list_id = None
-  ssh_credential_id = None
-  smb_credential_id = None
-  snmp_credential_id = None
-  esxi_credential_id = None
-  make_unique = True
-  asset_hosts_filter = None
-  ssh_credential_port = None
-  alive_tests = None
-  reverse_lookup_only = None
-  reverse_lookup_unify = None
-  comment = None
-
-  def __init__(self, target_root=None):
-    if target_root != None:
-      root = get_root(target_root, 'target')
-
-      for key, val in objectify(root).items():
-        setattr(self, key, val)
-
-      for field in ['reverse_lookup_only', 'reverse_lookup_unify']:
-        try:
-          setattr(self, field, bool(int(getattr(self,field))))
-        except:
-          pass
-
-      for field in ['hosts', 'exclude_hosts']:
-        try:
-          field_val = getattr(self, field)
-          if field_val != None and field_val != '':
-            setattr(self, field, field_val.split(', '))
-          else:
-            setattr(self, field, [])
-        except:
-          pass
-
-      for field, attr in [('port_list','id'), ('ssh_credential','id'), ('smb_credential','id'),
-        ('snmp_credential','id'), ('esxi_credential','id')]:
-        try:
-          attr_val = getattr(self, field)[attr]
-          if attr_val != '':
-            setattr(self, '{}_{}'.format(field, attr), attr_val)
-        except:
-          pass
+class Task_status(Model):
+  '''
+    Light task view used for polling
+  '''
+  root_tag = 'task'
+  fields = (
+    Field('name'),
+    Field('status'),
+    Field('progress', convert=element_int),
+    Field('last_report_id', 'last_report', child_attr('report', 'id')),
+  )
+  __slots__ = model_slots(fields)
+
+class Target(Model):
+  root_tag = 'target'
+  fields = (
+    # required
+    Field('name'),
+    # optional
+    Field('hosts', convert=element_split),
+    Field('exclude_hosts', convert=element_split),
+    Field('port_range'),
+    Field('port_list_id', 'port_list', element_attr('id')),
+    Field('ssh_credential_id', 'ssh_credential', element_attr('id')),
+    Field('ssh_credential_port', 'ssh_credential', child_text('port')),
+    Field('smb_credential_id', 'smb_credential', element_attr('id')),
+    Field('snmp_credential_id', 'snmp_credential', element_attr('id')),
+    Field('esxi_credential_id', 'esxi_credential', element_attr('id')),
+    Field('asset_hosts_filter'),
+    Field('alive_tests'),
+    Field('reverse_lookup_only', convert=element_bool),
+    Field('reverse_lookup_unify', convert=element_bool),
+    Field('comment'),
+  )
+  __slots__ = model_slots(fields, 'make_unique')
+  defaults = {'hosts': list, 'exclude_hosts': list, 'make_unique': True}
+
+  def create_args(self):
+    return {
+      'name': self.name,
+      'make_unique': self.make_unique,
+      'hosts': self.hosts,
+      'exclude_hosts': self.exclude_hosts,
+      'comment': self.comment,
+      'alive_tests': self.alive_tests,
+      'reverse_lookup_only': self.reverse_lookup_only,
+      'reverse_lookup_unify': self.reverse_lookup_unify,
+      'port_range': self.port_range,
+      'port_list_id': self.port_list_id,
+      'asset_hosts_filter': self.asset_hosts_filter,
+      'ssh_credential_id': self.ssh_credential_id,
+      'ssh_credential_port': self.ssh_credential_port,
+      'smb_credential_id': self.smb_credential_id,
+      'snmp_credential_id': self.snmp_credential_id,
+      'esxi_credential_id': self.esxi_credential_id,
+    }
 
   @classmethod
   def new(cls, name, hosts=None, exclude_hosts=None, port_range=None,
@@ -337,44 +566,1671 @@ class Target:
     self.comment = comment
     return self
 
+def is_connection_error(ex):
+  if isinstance(ex, (OSError, EOFError)):
+    return True
+  message = str(ex).lower()
+  return isinstance(ex, GvmError) and ('connect' in message or 'closed' in message or 'socket' in message)
+
+def is_session_error(ex):
+  message = str(ex).lower()
+  return isinstance(ex, GvmError) and ('authenticat' in message or 'session' in message)
+
+def is_replayable(name:str):
+  '''
+    Read-only commands can be sent again when their response was lost
+  '''
+  return name.startswith('get_')
+
+def command_name(data):
+  '''
+    Returns the root tag of a raw GMP command
+  '''
+  if isinstance(data, bytes):
+    data = data[:256].decode('utf-8', 'ignore')
+  match = re.match(r'\s*<([\w-]+)', data or '')
+  return match.group(1) if match else 'unknown'
+
+def label_string(labels):
+  if not labels:
+    return ''
+  return '{{{}}}'.format(','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+    .replace('"', '\\"').replace('\n', '\\n')) for key, value in labels))
+
+class Metrics:
+  '''
+    Thread-safe counters, gauges and histograms rendered in the Prometheus text format
+  '''
+  def __init__(self, buckets=metric_buckets):
+    self.buckets = buckets
+    self.lock = threading.Lock()
+    self.kinds = {}
+    self.help = {}
+    self.values = {}
+
+  def describe(self, name:str, kind:str, help:str):
+    self.kinds[name] = kind
+    self.help[name] = help
+
+  def _series(self, name:str, labels:dict):
+    return self.values.setdefault(name, {}), tuple(sorted(labels.items()))
+
+  def inc(self, name:str, value=1, **labels):
+    with self.lock:
+      series, key = self._series(name, labels)
+      series[key] = series.get(key, 0) + value
+
+  def set(self, name:str, value, **labels):
+    with self.lock:
+      series, key = self._series(name, labels)
+      series[key] = value
+
+  def remove(self, name:str, **labels):
+    with self.lock:
+      series, key = self._series(name, labels)
+      series.pop(key, None)
+
+  def observe(self, name:str, value, **labels):
+    with self.lock:
+      series, key = self._series(name, labels)
+      histogram = series.get(key)
+      if histogram == None:
+        # bucket counts, sum, count
+        histogram = series[key] = [[0] * len(self.buckets), 0, 0]
+      for n, bound in enumerate(self.buckets):
+        if value <= bound:
+          histogram[0][n] += 1
+      histogram[1] += value
+      histogram[2] += 1
+
+  def record_command(self, name:str, seconds:float, sent:int, received:int, error=False):
+    self.inc('gmp_commands_total', command=name)
+    self.observe('gmp_command_seconds', seconds, command=name)
+    self.inc('gmp_sent_bytes_total', sent, command=name)
+    self.inc('gmp_received_bytes_total', received, command=name)
+    if error:
+      self.inc('gmp_command_errors_total', command=name)
+
+  def render(self):
+    lines = []
+    with self.lock:
+      for name in sorted(self.values):
+        kind = self.kinds.get(name, 'untyped')
+        if name in self.help:
+          lines.append('# HELP {} {}'.format(name, self.help[name]))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for key, value in sorted(self.values[name].items()):
+          if kind == 'histogram':
+            counts, total, count = value
+            for bound, bucket_count in zip(self.buckets, counts):
+              lines.append('{}_bucket{} {}'.format(name, label_string(key + (('le', bound),)), bucket_count))
+            lines.append('{}_bucket{} {}'.format(name, label_string(key + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{} {}'.format(name, label_string(key), total))
+            lines.append('{}_count{} {}'.format(name, label_string(key), count))
+          else:
+            lines.append('{}{} {}'.format(name, label_string(key), value))
+    return '\n'.join(lines) + '\n'
+
+  def write_textfile(self, path:str):
+    '''
+      Writes the metrics atomically, for the node exporter textfile collector
+    '''
+    temp_path = '{}.tmp'.format(path)
+    with io.open(temp_path, 'w', encoding='utf-8') as file:
+      file.write(self.render())
+    os.replace(temp_path, path)
+
+  def serve(self, port:int, address=''):
+    '''
+      Serves the metrics over HTTP from a daemon thread
+    '''
+    server = Metrics_server((address, port), Metrics_handler)
+    server.metrics = self
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class Metrics_handler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    body = self.server.metrics.render().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class Metrics_server(socketserver.ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+metrics = Metrics()
+metrics.describe('gmp_commands_total', 'counter', 'GMP commands sent to gvmd')
+metrics.describe('gmp_command_errors_total', 'counter', 'GMP commands that failed')
+metrics.describe('gmp_command_seconds', 'histogram', 'GMP command latency including the response transfer')
+metrics.describe('gmp_sent_bytes_total', 'counter', 'Bytes of GMP commands')
+metrics.describe('gmp_received_bytes_total', 'counter', 'Bytes of GMP responses')
+metrics.describe('gmp_authentications_total', 'counter', 'GMP authentications')
+metrics.describe('gmp_reconnects_total', 'counter', 'GMP sessions re-established after an error')
+metrics.describe('openvas_tasks_running', 'gauge', 'Tasks currently running')
+metrics.describe('openvas_tasks_queued', 'gauge', 'Tasks waiting for a free slot')
+metrics.describe('openvas_tasks_finished_total', 'counter', 'Finished task runs by result')
+metrics.describe('openvas_task_scan_seconds', 'histogram', 'Scan duration of finished tasks')
+metrics.describe('openvas_task_last_scan_seconds', 'gauge', 'Duration of the last scan of a task')
+metrics.describe('openvas_report_save_seconds', 'histogram', 'Time to download and store a report')
+metrics.describe('openvas_report_bytes', 'gauge', 'Size of the last saved report of a task')
+metrics.describe('openvas_report_results', 'gauge', 'Results in the last saved report of a task')
+metrics.describe('openvas_nvt_count', 'gauge', 'NVTs known to gvmd')
+metrics.describe('openvas_boot_ready_seconds', 'gauge', 'Seconds from container start until a service was ready')
+
+class Metered_connection:
+  '''
+    Connection wrapper counting the bytes of commands and responses
+  '''
+  def __init__(self, connection):
+    self.connection = connection
+    self.sent = 0
+    self.received = 0
+
+  def send(self, data):
+    self.connection.send(data)
+    self.sent += len(data) if isinstance(data, bytes) else len(data.encode('utf-8'))
+
+  def read(self):
+    response = self.connection.read()
+    self.received += len(response) if isinstance(response, bytes) else len(response.encode('utf-8'))
+    return response
+
+  def receive(self, data:bytes):
+    '''
+      Accounts for a chunk read from the socket directly (streamed responses)
+    '''
+    self.received += len(data)
+    receive = getattr(self.connection, 'receive', None)
+    if receive != None:
+      receive(data)
+
+  def __getattr__(self, name):
+    return getattr(self.connection, name)
+
+class Traffic_capture:
+  '''
+    Bounded in-memory ring buffer of sampled GMP exchanges, dumped to a file
+    on error or on demand, so failures can be debugged after the fact.
+    size: number of exchanges kept.
+    sample_rate: share of commands captured, 1 captures all of them.
+    max_bytes: payloads are truncated to this many bytes per direction, 0 keeps them whole.
+  '''
+  def __init__(self, size=200, sample_rate=1.0, max_bytes=4096, directory=None, min_dump_secs=60):
+    self.entries = deque(maxlen=max(1, size))
+    self.min_dump_secs = min_dump_secs
+    self.last_dump = 0
+    self.sample_rate = sample_rate
+    self.max_bytes = max_bytes
+    self.directory = directory or tempfile.gettempdir()
+    self.lock = threading.Lock()
+    self.captured = 0
+    self.dumped = 0
+
+  def begin(self, command:str):
+    '''
+      Returns a new exchange entry, or None when the command is not sampled
+    '''
+    if self.sample_rate < 1 and random.random() >= self.sample_rate:
+      return None
+    entry = {'time': time(), 'command': command, 'sent_bytes': 0, 'received_bytes': 0, 'sent': [], 'received': []}
+    with self.lock:
+      self.entries.append(entry)
+      self.captured += 1
+    return entry
+
+  def add(self, entry:dict, direction:str, data):
+    size = len(data)
+    if entry['command'] == 'authenticate' and direction == 'sent':
+      # credentials are never kept
+      data = data[:0]
+    kept = sum(len(part) for part in entry[direction])
+    if self.max_bytes <= 0 or kept < self.max_bytes:
+      entry[direction].append(data if self.max_bytes <= 0 else data[:self.max_bytes - kept])
+    entry['{}_bytes'.format(direction)] += size
+
+  def dump(self, reason:str='', force=False):
+    '''
+      Writes the captured exchanges as JSON lines, returns the file path.
+      Nothing is written when no exchange was captured since the last dump,
+      or, unless forced, when the last dump is less than min_dump_secs old.
+    '''
+    with self.lock:
+      if self.captured == self.dumped or (not force and time() - self.last_dump < self.min_dump_secs):
+        return None
+      self.dumped = self.captured
+      self.last_dump = time()
+      entries = list(self.entries)
+    file_path = os.path.join(self.directory, 'gmp-capture-{}-{}.jsonl'.format(
+      datetime.datetime.now().strftime(r'%Y%m%d-%H%M%S'), os.getpid()))
+    with io.open(file_path, 'w', encoding='utf-8') as file:
+      file.write(json.dumps({'reason': reason, 'time': time(), 'exchanges': len(entries)}) + '\n')
+      for entry in entries:
+        record = dict(entry)
+        for direction in ['sent', 'received']:
+          payload = ''.join(part.decode('utf-8', 'replace') if isinstance(part, bytes) else part
+            for part in entry[direction])
+          record[direction] = payload
+          record['{}_truncated'.format(direction)] = len(payload.encode('utf-8')) < entry['{}_bytes'.format(direction)]
+        file.write(json.dumps(record) + '\n')
+    logging.warning('GMP traffic capture ({}) saved to {}'.format(reason, file_path))
+    return file_path
+
+class Capture_connection:
+  '''
+    Connection wrapper recording sampled commands and responses into a Traffic_capture
+  '''
+  def __init__(self, connection, capture:Traffic_capture):
+    self.connection = connection
+    self.capture = capture
+    self.entry = None
+    self.sending = False
+
+  def send(self, data):
+    if not self.sending:
+      # the first chunk of a new command decides whether it is sampled
+      self.sending = True
+      self.entry = self.capture.begin(command_name(data))
+    self.connection.send(data)
+    if self.entry != None:
+      self.capture.add(self.entry, 'sent', data)
+
+  def receive(self, data):
+    self.sending = False
+    if self.entry != None:
+      self.capture.add(self.entry, 'received', data)
+
+  def read(self):
+    response = self.connection.read()
+    self.receive(response)
+    return response
+
+  def disconnect(self):
+    self.sending = False
+    self.connection.disconnect()
+
+  def __getattr__(self, name):
+    return getattr(self.connection, name)
+
+class GMP_session:
+  '''
+    Wraps Gmp so that the socket is authenticated once and reused.
+    The session is re-established (with backoff) only when the connection
+    was dropped or gvmd asks to authenticate again. A command is sent again
+    only if gvmd did not get it or it is read-only: a create or start whose
+    response was lost may have been carried out, its error is raised.
+  '''
+  def __init__(self, gmp:Gmp, user:str, password:str, socket_connection=None,
+    retries=3, backoff_secs=1, backoff_max_secs=30, metrics=metrics, capture:Traffic_capture=None):
+    self.gmp = gmp
+    self.capture = capture
+    connection = gmp._connection if capture == None else Capture_connection(gmp._connection, capture)
+    self.meter = Metered_connection(connection)
+    gmp._connection = self.meter
+    self.metrics = metrics
+    self.socket_connection = socket_connection
+    self.user = user
+    self.password = password
+    self.retries = retries
+    self.backoff_secs = backoff_secs
+    self.backoff_max_secs = backoff_max_secs
+    self.authenticated = False
+    self.stats = {'authentications': 0, 'reconnects': 0, 'calls': 0, 'errors': 0}
+
+  def authenticate(self):
+    self.stats['authentications'] += 1
+    self.metrics.inc('gmp_authentications_total')
+    self.gmp.authenticate(self.user, self.password)
+    self.authenticated = True
+
+  def disconnect(self):
+    self.authenticated = False
+    try:
+      self.gmp.disconnect()
+    except Exception:
+      pass
+
+  def ensure(self):
+    if not self.authenticated:
+      self.authenticate()
+
+  @contextmanager
+  def measure(self, name:str):
+    '''
+      Records latency, payload bytes and errors of one command
+    '''
+    started, sent, received = time(), self.meter.sent, self.meter.received
+    error = True
+    try:
+      yield
+      error = False
+    except GeneratorExit:
+      # a stream closed by its consumer after the response ended
+      error = False
+      raise
+    except Exception as ex:
+      if self.capture != None:
+        self.capture.dump('{}: {}'.format(name, ex))
+      raise
+    finally:
+      self.metrics.record_command(name, time() - started,
+        self.meter.sent - sent, self.meter.received - received, error)
+
+  def call(self, method, *args, **kwargs):
+    name = getattr(method, '__name__', 'unknown')
+    name = command_name(args[0]) if name == 'send_command' and args else name
+    attempt = 0
+    while True:
+      sent = False
+      try:
+        self.ensure()
+        self.stats['calls'] += 1
+        sent = True
+        with self.measure(name):
+          return method(*args, **kwargs)
+      except Exception as ex:
+        self.stats['errors'] += 1
+        lost = is_connection_error(ex)
+        if attempt >= self.retries or not (is_session_error(ex) or
+          (lost and (not sent or is_replayable(name)))):
+          if lost:
+            self.disconnect()
+          raise
+        delay = min(self.backoff_secs * 2 ** attempt, self.backoff_max_secs)
+        logging.warning('GMP session lost ({}), reconnecting in {} sec'.format(ex, delay))
+        self.disconnect()
+        self.stats['reconnects'] += 1
+        self.metrics.inc('gmp_reconnects_total')
+        attempt += 1
+        sleep(delay)
+
+  def stream(self, command:bytes, chunk_size=stream_chunk_size):
+    '''
+      Sends a raw GMP command and yields the response in chunks as they arrive,
+      so that large responses are never held in memory as a whole
+    '''
+    self.ensure()
+    self.stats['calls'] += 1
+    try:
+      with self.measure(command_name(command)):
+        self.meter.send(command)
+        sock = self.socket_connection._socket
+        while True:
+          data = sock.recv(chunk_size)
+          if not data:
+            raise GvmError('Remote closed the connection')
+          self.meter.receive(data)
+          yield data
+    except GeneratorExit:
+      raise
+    except Exception:
+      self.stats['errors'] += 1
+      self.disconnect()
+      raise
+
+  def send_chunks(self, chunks):
+    '''
+      Sends a command assembled from chunks (e.g. a memory-mapped file)
+      and returns the parsed response
+    '''
+    self.ensure()
+    self.stats['calls'] += 1
+    chunks = iter(chunks)
+    head = next(chunks, b'')
+    try:
+      with self.measure(command_name(head)):
+        self.meter.send(head)
+        for chunk in chunks:
+          self.meter.send(chunk)
+        return self.gmp._transform(self.meter.read())
+    except Exception as ex:
+      self.stats['errors'] += 1
+      if is_connection_error(ex):
+        self.disconnect()
+      raise
+
+  def __getattr__(self, name):
+    attr = getattr(self.gmp, name)
+    if name.startswith('_') or name in ['authenticate', 'disconnect'] or not callable(attr):
+      return attr
+    def call(*args, **kwargs):
+      return self.call(attr, *args, **kwargs)
+    return call
+
+def xml_start_tag(element):
+  attrs = ''.join(' {}={}'.format(key, quoteattr(val)) for key, val in element.attrib.items())
+  return '<{}{}>'.format(element.tag, attrs).encode('utf-8')
+
+def container_task_command(task_name:str, task_comment=None):
+  # container tasks are tasks with target id 0, python-gvm has no command for them
+  command = ET.Element('create_task')
+  ET.SubElement(command, 'name').text = task_name
+  if task_comment:
+    ET.SubElement(command, 'comment').text = task_comment
+  ET.SubElement(command, 'target', id='0')
+  return ET.tostring(command, encoding='unicode')
+
+def task_command(task:Task):
+  # python-gvm create_task has no scanner preferences
+  command = Command_builder().create_task(**task.create_args())
+  if not task.preferences:
+    return command
+  root = ET.fromstring(command)
+  preferences = ET.SubElement(root, 'preferences')
+  for name, value in sorted(task.preferences.items()):
+    preference = ET.SubElement(preferences, 'preference')
+    ET.SubElement(preference, 'scanner_name').text = name
+    ET.SubElement(preference, 'value').text = value
+  return ET.tostring(root, encoding='unicode')
+
+def create_report_chunks(file_path:str, report:Report, task_id=None):
+  if task_id != None:
+    task = ET.Element('task', id=task_id)
+  else:
+    task = ET.Element('task')
+    ET.SubElement(task, 'name').text = report.task_name
+    ET.SubElement(task, 'comment').text = report.task_comment
+  head = b'<create_report>' + ET.tostring(task)
+  return wrap_chunks(head, iter_xml_body(file_path), b'</create_report>')
+
+def create_config_chunks(file_path:str):
+  return wrap_chunks(b'<create_config>', iter_xml_body(file_path), b'</create_config>')
+
+class Command_builder(Gmp):
+  '''
+    Gmp that returns the XML of a command instead of sending it
+  '''
+  def __init__(self):
+    super().__init__(None)
+
+  def _send_xml_command(self, xmlcmd):
+    return xmlcmd.to_string()
+
+class Response_parser:
+  '''
+    Push parser of a streamed GMP response producing ('start'|'end'|'element', element, path).
+    Elements listed in containers are passed through as start/end events,
+    their direct children are produced whole and freed right after.
+    done is set as soon as the response root is closed.
+  '''
+  def __init__(self, containers, response_tag:str):
+    self.containers = containers
+    self.response_tag = response_tag
+    self.parser = ET.XMLPullParser(events=('start', 'end'), huge_tree=True)
+    self.path = []
+    self.done = False
+
+  def feed(self, chunk:bytes):
+    self.parser.feed(chunk)
+    path = self.path
+    for event, element in self.parser.read_events():
+      if event == 'start':
+        path.append(element.tag)
+        if len(path) == 1:
+          if element.tag != self.response_tag:
+            raise GvmError('Unexpected response: {}'.format(element.tag))
+          if not element.get('status', '').startswith('2'):
+            raise GvmError('Error in response. {}'.format(element.get('status_text')))
+        if tuple(path) in self.containers:
+          yield 'start', element, tuple(path)
+      else:
+        _path = tuple(path)
+        if _path in self.containers:
+          yield 'end', element, _path
+        elif _path[:-1] in self.containers:
+          yield 'element', element, _path
+          element.clear()
+          while element.getprevious() is not None:
+            del element.getparent()[0]
+        path.pop()
+        if len(path) == 0:
+          self.done = True
+          return
+
+def iter_response(chunks, containers, response_tag):
+  '''
+    Parses a streamed GMP response, iteration stops as soon as the response root is closed
+  '''
+  parser = Response_parser(containers, response_tag)
+  for chunk in chunks:
+    for event in parser.feed(chunk):
+      yield event
+    if parser.done:
+      return
+  raise GvmError('Incomplete response')
+
+def open_report_file(file_path:str, compression=None):
+  if compression == 'gzip':
+    return gzip.open(file_path, 'wb')
+  elif compression == 'zstd':
+    if zstandard == None:
+      raise Exception('zstd compression requires zstandard package')
+    return zstandard.open(file_path, 'wb')
+  elif compression:
+    raise Exception('Unknown compression: {}'.format(compression))
+  return io.open(file_path, 'wb')
+
+report_extensions = {'xml': '.xml', 'jsonl': '.jsonl', 'csv': '.csv', 'parquet': '.parquet'}
+# per-task result indexes of the last saved reports, under the reports directory
+result_index_dir = '.results'
+compression_extensions = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+def text_or_none(element, path):
+  value = element.findtext(path)
+  if value != None:
+    value = value.strip()
+  return value or None
+
+def result_to_row(result):
+  '''
+    Flattens a report <result> element into a dict of plain values
+  '''
+  host = result.find('host')
+  nvt = result.find('nvt')
+  return {
+    'id': result.get('id'),
+    'name': text_or_none(result, 'name'),
+    'host': host.text.strip() if host != None and host.text else None,
+    'hostname': text_or_none(result, 'host/hostname'),
+    'port': text_or_none(result, 'port'),
+    'nvt_oid': nvt.get('oid') if nvt != None else None,
+    'nvt_name': text_or_none(result, 'nvt/name'),
+    'nvt_family': text_or_none(result, 'nvt/family'),
+    'cvss_base': text_or_none(result, 'nvt/cvss_base'),
+    'threat': text_or_none(result, 'threat'),
+    'severity': text_or_none(result, 'severity'),
+    'qod': text_or_none(result, 'qod/value'),
+    'creation_time': text_or_none(result, 'creation_time'),
+    'description': text_or_none(result, 'description'),
+  }
+
+# flat export columns, values other than strings are converted by typed_row
+result_columns = [
+  ('task_name', 'string'), ('report_id', 'string'), ('id', 'string'), ('host', 'string'), ('hostname', 'string'),
+  ('port', 'string'), ('nvt_oid', 'string'), ('nvt_name', 'string'), ('nvt_family', 'string'),
+  ('cvss_base', 'float'), ('severity', 'float'), ('threat', 'string'), ('qod', 'int'), ('name', 'string'),
+  ('creation_time', 'string'), ('description', 'string')]
+
+def typed_row(row:dict):
+  '''
+    Returns the export column values of a result row, numbers as int and float
+  '''
+  values = []
+  for column, kind in result_columns:
+    value = row.get(column)
+    if value != None and kind != 'string':
+      try:
+        value = float(value) if kind == 'float' else int(value)
+      except ValueError:
+        value = None
+    values.append(value)
+  return values
+
+# exports only get result rows, the whole report document needs the main writer
+export_outputs = ('jsonl', 'csv', 'parquet')
+
+def resolve_output(output:str, main_output=None):
+  '''
+    'columnar' is Parquet when pyarrow is installed, CSV otherwise.
+    With main_output, output is an export written next to a report of that format.
+  '''
+  if main_output != None and output != main_output and output not in export_outputs + ('columnar',):
+    raise Exception('{} report can not be an export of a {} report'.format(output, main_output))
+  if output == 'columnar':
+    return 'parquet' if pyarrow != None else 'csv'
+  if output == 'parquet' and pyarrow == None:
+    raise Exception('parquet output requires pyarrow package')
+  if output not in report_writers:
+    raise Exception('Unknown report format: {}'.format(output))
+  return output
+
+def result_key(row:dict):
+  return '{}|{}|{}'.format(row['nvt_oid'] or '', row['host'] or '', row['port'] or '')
+
+def description_digest(description):
+  return hashlib.blake2b((description or '').encode('utf-8'), digest_size=8).hexdigest()
+
+class Report_filter:
+  '''
+    Results kept in saved reports. Minimum severity, minimum QoD and overrides are
+    sent to gvmd with get_reports, so dropped results are never transferred.
+    gvmd result filters can not exclude an NVT family, so excluded families are
+    dropped while the report streams in, before they are written.
+  '''
+  keys = ('min_severity', 'min_qod', 'apply_overrides', 'exclude_families')
+
+  def __init__(self, min_severity=None, min_qod=None, apply_overrides=None, exclude_families=()):
+    self.min_severity = None if min_severity == None else float(min_severity)
+    self.min_qod = None if min_qod == None else int(min_qod)
+    self.apply_overrides = None if apply_overrides == None else bool(apply_overrides)
+    self.exclude_families = set(exclude_families or ())
+
+  @classmethod
+  def from_dict(cls, values:dict):
+    unknown = set(values) - set(cls.keys)
+    if unknown:
+      raise Exception('Unknown report filter keys: {}'.format(', '.join(sorted(unknown))))
+    return cls(**values)
+
+  def update(self, other):
+    '''
+      Returns a filter with the values set in other replacing these
+    '''
+    values = {key: getattr(self, key) for key in self.keys}
+    values.update({key: getattr(other, key) for key in self.keys if getattr(other, key) not in (None, set())})
+    return Report_filter(**values)
+
+  def __bool__(self):
+    return any(getattr(self, key) not in (None, set()) for key in self.keys)
+
+  def terms(self):
+    '''
+      get_reports filter terms, severities have one decimal so severity>x-0.1 keeps x
+    '''
+    terms = []
+    if self.apply_overrides != None:
+      terms.append('apply_overrides={}'.format(int(self.apply_overrides)))
+    if self.min_qod != None:
+      terms.append('min_qod={}'.format(self.min_qod))
+    if self.min_severity != None:
+      terms.append('severity>{:.1f}'.format(self.min_severity - 0.1))
+    return terms
+
+  def keep(self, element):
+    return not self.exclude_families or text_or_none(element, 'nvt/family') not in self.exclude_families
+
+  def __str__(self):
+    return ' '.join(self.terms() + ['exclude_family="{}"'.format(family) for family in sorted(self.exclude_families)])
+
+report_filter_suffix = '.filter.json'
+
+def report_filter_path(task_file_path:str):
+  '''
+    <task file without .xml[.gz|.zst]>.filter.json next to the task file
+  '''
+  base = task_file_path
+  for extension in sorted(xml_extensions, key=len, reverse=True):
+    if base.lower().endswith(extension):
+      base = base[:-len(extension)]
+      break
+  return base + report_filter_suffix
+
+def load_report_filters(tasks_path:str, defaults:Report_filter=None):
+  '''
+    Returns {task name: Report_filter} of the task files that have a filter sidecar,
+    sidecar values replace the ones of defaults
+  '''
+  defaults = defaults or Report_filter()
+  filters = {}
+  if tasks_path == None or not os.path.isdir(tasks_path):
+    return filters
+  for file_path in iter_xml_files(tasks_path):
+    filter_path = report_filter_path(file_path)
+    if not os.path.isfile(filter_path):
+      continue
+    try:
+      with io.open(filter_path, encoding='utf-8') as file:
+        task_filter = Report_filter.from_dict(json.load(file))
+      # task files are a bare <task> or a <get_tasks_response> with one
+      name = Task(parse_xml_file(file_path)).name
+    except Exception as ex:
+      logging.error('Reading report filter {} error: {}'.format(filter_path, ex))
+      continue
+    if name == None:
+      logging.error('Report filter {} ignored: no task name in {}'.format(filter_path, file_path))
+      continue
+    filters[name] = defaults.update(task_filter)
+  return filters
+
+class Result_delta:
+  '''
+    Compares the results of a report, while they stream by, with the result index
+    of the previous saved report of the task: new and changed results are written
+    as JSON lines right away, resolved ones when the report is over.
+    The index keeps [severity, threat, qod, description digest, name] per
+    NVT OID, host and port, so old reports are never parsed again.
+  '''
+  def __init__(self, directory:str, temp_path:str):
+    self.directory = directory
+    self.temp_path = temp_path
+    self.file = None
+    self.previous = None
+    self.previous_report_id = None
+    self.results = {}
+    self.counts = {'new': 0, 'changed': 0, 'resolved': 0}
+
+  def index_path(self, task_name:str):
+    return os.path.join(self.directory, '{}.json.gz'.format((task_name or 'unknown').replace(os.sep, '_')))
+
+  def begin(self, task_name:str):
+    if self.file != None:
+      return
+    self.previous = {}
+    try:
+      with gzip.open(self.index_path(task_name), 'rt', encoding='utf-8') as file:
+        index = json.load(file)
+      self.previous = index['results']
+      self.previous_report_id = index.get('report_id')
+    except FileNotFoundError:
+      pass
+    except (OSError, ValueError, KeyError) as ex:
+      logging.warning('Unreadable result index of task {}, every result is new: {}'.format(task_name, ex))
+    self.file = open(self.temp_path, 'w', encoding='utf-8')
+
+  def write(self, change:str, row:dict):
+    self.counts[change] += 1
+    row['change'] = change
+    self.file.write(json.dumps(row, sort_keys=True))
+    self.file.write('\n')
+
+  def add(self, element, task_name:str):
+    self.begin(task_name)
+    row = result_to_row(element)
+    key = result_key(row)
+    # the same NVT can report more than once on a host and port
+    count = 1
+    while key in self.results:
+      count += 1
+      key = '{}#{}'.format(result_key(row), count)
+    entry = [row['severity'], row['threat'], row['qod'], description_digest(row['description']), row['name']]
+    self.results[key] = entry
+    previous = self.previous.pop(key, None)
+    if previous == None:
+      self.write('new', row)
+    elif previous[:4] != entry[:4]:
+      row['previous'] = {'severity': previous[0], 'threat': previous[1], 'qod': previous[2],
+        'description_changed': previous[3] != entry[3]}
+      self.write('changed', row)
+
+  def finish(self, task_name:str):
+    self.begin(task_name)
+    for key, previous in self.previous.items():
+      oid, host, port = key.split('#')[0].split('|', 2)
+      self.write('resolved', {'nvt_oid': oid or None, 'host': host or None, 'port': port or None,
+        'severity': previous[0], 'threat': previous[1], 'qod': previous[2], 'name': previous[4]})
+    self.previous = {}
+    self.file.close()
+
+  def store(self, file_path:str, task_name:str, report_id:str, report_name:str):
+    '''
+      Moves the delta next to the report as <report file>.delta.jsonl and makes
+      the index of this report the one the next report of the task is compared with
+    '''
+    self.finish(task_name)
+    delta_path = '{}.delta.jsonl'.format(file_path)
+    os.rename(self.temp_path, delta_path)
+    os.makedirs(self.directory, exist_ok=True)
+    index_path = self.index_path(task_name)
+    with gzip.open('{}.part'.format(index_path), 'wt', encoding='utf-8') as file:
+      json.dump({'task_name': task_name, 'report_id': report_id, 'report_name': report_name,
+        'results': self.results}, file, separators=(',', ':'))
+    os.replace('{}.part'.format(index_path), index_path)
+    logging.info('Report delta against {}: {} new, {} changed, {} resolved'.format(
+      self.previous_report_id or 'no previous report', self.counts['new'], self.counts['changed'],
+      self.counts['resolved']))
+    return dict(self.counts, previous_report_id=self.previous_report_id, file_name=os.path.basename(delta_path))
+
+  def discard(self):
+    if self.file != None:
+      self.file.close()
+    if os.path.isfile(self.temp_path):
+      os.remove(self.temp_path)
+
+class Report_writer:
+  '''
+    Writes a streamed get_reports response to disk one top-level element at a time.
+    A report can be consumed in pages: the first page is written whole,
+    following pages only contribute their results.
+  '''
+  response_tag = 'get_reports_response'
+  containers = (
+    ('get_reports_response',),
+    ('get_reports_response', 'report'),
+    ('get_reports_response', 'report', 'report'),
+    ('get_reports_response', 'report', 'report', 'results'))
+  results_path = containers[-1] + ('result',)
+  result_count_path = containers[2] + ('result_count',)
+
+  def __init__(self, file, report_id:str, task_name=None, delta:Result_delta=None):
+    self.file = file
+    self.report_id = report_id
+    self.delta = delta
+    self.report_ids = []
+    self.name = None
+    # a given task name replaces the one in the report (merged shard reports)
+    self.task_name_override = task_name
+    self.task_name = task_name
+    self.result_count = 0
+    # results got from gvmd, result_count of them are kept by result_filter
+    self.received_count = 0
+    self.result_filter = None
+    self.filtered_count = None
+    self.report_offset = 0
+    self.page_size = None
+    self.report_pages = 0
+    self.page_result_count = 0
+    self.pages = 0
+    self.bytes = 0
+    # writers of other formats fed with the same results
+    self.exports = []
+
+  def write(self, data:bytes):
+    self.file.write(data)
+    self.bytes += len(data)
+
+  def result_row(self, element):
+    row = result_to_row(element)
+    row['report_id'] = self.report_id
+    row['task_name'] = self.task_name
+    return row
+
+  def add_row(self, row:dict):
+    pass
+
+  def start(self, element, path):
+    pass
+
+  def end(self, element, path):
+    pass
+
+  def element(self, element, path):
+    pass
+
+  def result(self, element):
+    pass
+
+  def begin_merge(self):
+    '''
+      Called before the first report when the results of several reports are merged
+    '''
+    pass
+
+  def begin_recount(self):
+    '''
+      Called before the first report when result_filter drops results that gvmd counted
+    '''
+    pass
+
+  def merge(self, element, path):
+    '''
+      A report element of a merged report after the first one
+    '''
+    pass
+
+  def finish(self):
+    pass
+
+  def _element(self, element, path):
+    if path == self.results_path:
+      self.received_count += 1
+      self.page_result_count += 1
+      if self.result_filter != None and not self.result_filter.keep(element):
+        return
+      self.result_count += 1
+      if self.delta != None:
+        self.delta.add(element, self.task_name)
+      if self.exports:
+        row = self.result_row(element)
+        for export in self.exports:
+          export.add_row(row)
+      self.result(element)
+      self.element(element, path)
+      return
+    if path == self.result_count_path and self.report_pages == 1:
+      try:
+        self.filtered_count = int(element.findtext('filtered'))
+      except (TypeError, ValueError):
+        pass
+    if self.pages > 1:
+      if self.report_pages == 1 and path[:-1] == self.containers[2]:
+        self.merge(element, path)
+      return
+    if path == self.containers[1] + ('name',):
+      self.name = element.text
+    elif path in [self.containers[1] + ('task',), self.containers[2] + ('task',)]:
+      if self.task_name_override != None and element.find('name') is not None:
+        element.find('name').text = self.task_name_override
+      self.task_name = element.findtext('name')
+    self.element(element, path)
+
+  def begin_report(self, report_id:str, page_size=None):
+    '''
+      Starts the next report, results of all reports after the first one are appended
+    '''
+    self.page_size = page_size
+    self.report_ids.append(report_id)
+    self.report_offset = self.received_count
+    self.report_pages = 0
+    self.filtered_count = None
+
+  def report_result_count(self):
+    return self.received_count - self.report_offset
+
+  def begin_page(self):
+    self.pages += 1
+    self.report_pages += 1
+    self.page_result_count = 0
+    return Response_parser(self.containers, self.response_tag)
+
+  def handle(self, event:str, element, path):
+    if event == 'element':
+      self._element(element, path)
+    elif self.pages == 1:
+      getattr(self, event)(element, path)
+
+  def end_page(self):
+    return self.page_result_count
+
+  def consume(self, chunks):
+    '''
+      Consumes one page, returns the number of results it had
+    '''
+    self.begin_page()
+    try:
+      for event, element, path in iter_response(chunks, self.containers, self.response_tag):
+        self.handle(event, element, path)
+    finally:
+      self.end_page()
+    return self.page_result_count
+
+  def metadata(self):
+    return {
+      'report_id': self.report_id,
+      'merged_report_ids': self.report_ids if len(self.report_ids) > 1 else None,
+      'report_name': self.name,
+      'task_name': self.task_name,
+      'result_count': self.result_count,
+      'skipped_count': self.received_count - self.result_count,
+      'filter': str(self.result_filter) if self.result_filter else None,
+      'pages': self.pages,
+      'bytes': self.bytes,
+    }
+
+def is_count(text):
+  return text != None and text.strip().isdigit()
+
+def add_counts(total, element):
+  '''
+    Adds the counts of element to the ones of total, other children are appended to total
+  '''
+  if is_count(total.text) and is_count(element.text):
+    total.text = str(int(total.text) + int(element.text))
+  for child in element:
+    match = total.find(child.tag)
+    if match is not None and (is_count(child.text) or not (child.text or '').strip()):
+      add_counts(match, child)
+    else:
+      total.append(copy.deepcopy(child))
+
+class XML_report_writer(Report_writer):
+  '''
+    Writes report XML. Everything that follows <results> on the first page
+    is kept in a temporary file until all pages are written.
+    When reports are merged, the document around the results is kept in memory
+    and results go to a temporary file: <host> elements of every report are
+    listed and result_count, hosts and ports are added up, other report
+    elements (scan times, filters) are the ones of the first report.
+    When result_filter drops results, the document is kept the same way and the
+    filtered counts of result_count are the ones of the written results.
+  '''
+  count_tags = ('result_count', 'hosts', 'ports')
+  threat_tags = {'High': 'hole', 'Medium': 'warning', 'Low': 'info', 'Log': 'log', 'Debug': 'debug',
+    'False Positive': 'false_positive'}
+
+  def __init__(self, file, report_id:str, task_name=None, delta:Result_delta=None):
+    super().__init__(file, report_id, task_name, delta)
+    self.out = file
+    self.tail = None
+    # with begin_merge: bytes and elements around the results, None where they go
+    self.parts = None
+    self.body = None
+    self.counts = {}
+    self.host_index = None
+    # with begin_recount: {threat: written results}
+    self.threat_counts = None
+
+  def write(self, data:bytes):
+    if self.parts != None:
+      self.parts.append(data)
+      return
+    self.out.write(data)
+    self.bytes += len(data)
+
+  def begin_merge(self):
+    if self.parts == None:
+      self.parts = []
+      self.body = tempfile.TemporaryFile()
+
+  def begin_recount(self):
+    self.begin_merge()
+    self.threat_counts = {}
+
+  def start(self, element, path):
+    if path == self.containers[-1] and (self.page_size or self.parts != None):
+      # the file has the results of all pages and reports, not the ones of the first page
+      element.set('start', '1')
+      element.set('max', '-1')
+    if len(path) > 1:
+      self.write(xml_start_tag(element))
+      self.write(b'\n')
+
+  def end(self, element, path):
+    if len(path) == len(self.containers):
+      if self.parts != None:
+        self.parts.append(None)
+        return
+      self.tail = tempfile.TemporaryFile()
+      self.out = self.tail
+    elif len(path) > 1:
+      self.write('</{}>\n'.format(element.tag).encode('utf-8'))
+
+  def element(self, element, path):
+    if self.parts != None:
+      if path == self.results_path:
+        data = ET.tostring(element, encoding='utf-8', with_tail=False)
+        self.body.write(data)
+        self.body.write(b'\n')
+        self.bytes += len(data) + 1
+      elif path[:-1] == self.containers[2] and element.tag in self.count_tags + ('host',):
+        self.parts.append(copy.deepcopy(element))
+        if element.tag == 'host':
+          self.host_index = len(self.parts)
+        else:
+          self.counts[element.tag] = self.parts[-1]
+      else:
+        self.write(ET.tostring(element, encoding='utf-8', with_tail=False) + b'\n')
+      return
+    self.write(ET.tostring(element, encoding='utf-8', with_tail=False))
+    self.write(b'\n')
+
+  def result(self, element):
+    if self.threat_counts != None:
+      threat = element.findtext('threat')
+      self.threat_counts[threat] = self.threat_counts.get(threat, 0) + 1
+
+  def recount(self, result_count):
+    '''
+      Sets the filtered counts of result_count to the ones of the written results
+    '''
+    counts = [('filtered', self.result_count)] + [('{}/filtered'.format(tag), self.threat_counts.get(threat, 0))
+      for threat, tag in self.threat_tags.items()]
+    for path, count in counts:
+      element = result_count.find(path)
+      if element is not None:
+        element.text = str(count)
+
+  def merge(self, element, path):
+    if self.parts == None:
+      return
+    if element.tag in self.counts:
+      add_counts(self.counts[element.tag], element)
+    elif element.tag == 'host':
+      index = self.host_index if self.host_index != None else self.parts.index(None) + 1
+      self.parts.insert(index, copy.deepcopy(element))
+      self.host_index = index + 1
+
+  def end_page(self):
+    # results of the following pages go right after the ones already written
+    self.out = self.file
+    return super().end_page()
+
+  def finish(self):
+    if self.parts != None:
+      if self.threat_counts != None and 'result_count' in self.counts:
+        self.recount(self.counts['result_count'])
+      parts, self.parts = self.parts, None
+      for part in parts:
+        if part is None:
+          self.body.seek(0)
+          shutil.copyfileobj(self.body, self.file)
+          self.body.close()
+          self.write('</{}>\n'.format(self.containers[-1][-1]).encode('utf-8'))
+        elif isinstance(part, bytes):
+          self.write(part)
+        else:
+          self.write(ET.tostring(part, encoding='utf-8', with_tail=False) + b'\n')
+      return
+    if self.tail != None:
+      self.write('</{}>\n'.format(self.containers[-1][-1]).encode('utf-8'))
+      self.tail.seek(0)
+      shutil.copyfileobj(self.tail, self.file)
+      self.tail.close()
+      self.tail = None
+
+class JSONL_report_writer(Report_writer):
+  '''
+    Writes one JSON object per result
+  '''
+  def result(self, element):
+    self.add_row(self.result_row(element))
+
+  def add_row(self, row:dict):
+    self.write(json.dumps(row, sort_keys=True).encode('utf-8'))
+    self.write(b'\n')
+
+class CSV_report_writer(JSONL_report_writer):
+  '''
+    Writes one CSV line per result with the flat result_columns
+  '''
+  def __init__(self, file, report_id:str, task_name=None, delta:Result_delta=None):
+    super().__init__(file, report_id, task_name, delta)
+    self.line = io.StringIO()
+    self.csv = csv.writer(self.line, lineterminator='\n')
+    self.add_values([column for column, kind in result_columns])
+
+  def add_values(self, values:list):
+    self.csv.writerow(values)
+    self.write(self.line.getvalue().encode('utf-8'))
+    self.line.seek(0)
+    self.line.truncate()
+
+  def add_row(self, row:dict):
+    self.add_values(typed_row(row))
+
+class Parquet_report_writer(JSONL_report_writer):
+  '''
+    Writes results as Parquet with the flat result_columns, one row group per batch_size results
+  '''
+  batch_size = 10000
+  column_types = {'string': 'string', 'float': 'float64', 'int': 'int32'}
+  codecs = {None: 'snappy', 'gzip': 'gzip', 'zstd': 'zstd'}
+
+  def __init__(self, file, report_id:str, task_name=None, delta:Result_delta=None, compression=None):
+    super().__init__(file, report_id, task_name, delta)
+    self.schema = pyarrow.schema([(column, getattr(pyarrow, self.column_types[kind])())
+      for column, kind in result_columns])
+    self.parquet = pyarrow.parquet.ParquetWriter(file, self.schema, compression=self.codecs[compression])
+    self.rows = []
+
+  def add_row(self, row:dict):
+    self.rows.append(typed_row(row))
+    if len(self.rows) >= self.batch_size:
+      self.flush()
+
+  def flush(self):
+    if self.rows:
+      columns = list(zip(*self.rows))
+      self.parquet.write_table(pyarrow.Table.from_arrays(
+        [pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)], schema=self.schema))
+      self.rows = []
+
+  def finish(self):
+    if self.parquet != None:
+      self.flush()
+      self.parquet.close()
+      self.parquet = None
+      self.bytes = self.file.tell()
+
+report_writers = {'xml': XML_report_writer, 'jsonl': JSONL_report_writer, 'csv': CSV_report_writer,
+  'parquet': Parquet_report_writer}
+
+def get_report_command(writer:Report_writer, report_id:str, page_size=None):
+  attrs = {'report_id': report_id, 'details': '1'}
+  terms = writer.result_filter.terms() if writer.result_filter else []
+  if page_size:
+    terms.append('first={} rows={}'.format(writer.report_result_count() + 1, page_size))
+  elif terms:
+    terms.append('first=1 rows=-1')
+  if terms:
+    attrs['filter'] = ' '.join(terms)
+  return ET.tostring(ET.Element('get_reports', **attrs))
+
+def last_report_page(writer:Report_writer, count:int, page_size=None):
+  return not page_size or count < page_size or \
+    (writer.filtered_count != None and writer.report_result_count() >= writer.filtered_count)
+
+class Report_file:
+  '''
+    Report written to a temporary file and renamed once its task and report names are known,
+    with a <report file>.meta.json sidecar and, with delta, a <report file>.delta.jsonl of
+    the changes since the previous saved report of the task.
+    exports are other formats written from the same download, named like the report file.
+  '''
+  def __init__(self, directory:str, report_id:str, compression=None, output='xml', task_name=None, delta=False,
+    exports=(), result_filter:Report_filter=None, merge=False):
+    self.directory = directory
+    self.merge = merge
+    self.report_id = report_id
+    self.task_name = task_name
+    self.compression = compression
+    self.output = resolve_output(output)
+    self.exports = []
+    for export in exports:
+      export = resolve_output(export, self.output)
+      if export != self.output and export not in self.exports:
+        self.exports.append(export)
+    self.temp_path = self.part_path(self.output)
+    self.delta = Result_delta(os.path.join(directory, result_index_dir),
+      os.path.join(directory, '.{}.delta.part'.format(report_id))) if delta else None
+    self.result_filter = result_filter or None
+    self.file_path = None
+    self.writer = None
+    self.files = []
+    self.started = time()
+
+  def part_path(self, output:str):
+    if output == self.output:
+      return os.path.join(self.directory, '.{}.part'.format(self.report_id))
+    return os.path.join(self.directory, '.{}.{}.part'.format(self.report_id, output))
+
+  def file_name(self, name:str, output:str):
+    if output == 'parquet':
+      # compressed inside the file
+      return '{}{}'.format(name, report_extensions[output])
+    return '{}{}{}'.format(name, report_extensions[output], compression_extensions[self.compression])
+
+  def open_writer(self, output:str, delta=None):
+    file = open_report_file(self.part_path(output), None if output == 'parquet' else self.compression)
+    self.files.append(file)
+    if output == 'parquet':
+      return Parquet_report_writer(file, self.report_id, self.task_name, delta, self.compression)
+    return report_writers[output](file, self.report_id, self.task_name, delta)
+
+  def open(self):
+    self.writer = self.open_writer(self.output, self.delta)
+    self.writer.result_filter = self.result_filter
+    if self.merge:
+      self.writer.begin_merge()
+    if self.result_filter != None and self.result_filter.exclude_families:
+      self.writer.begin_recount()
+    for export in self.exports:
+      self.writer.exports.append(self.open_writer(export))
+    return self
+
+  def __enter__(self):
+    return self.writer
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    try:
+      if exc_type == None:
+        for export in self.writer.exports:
+          export.finish()
+    finally:
+      for file in self.files:
+        file.close()
+
+  def store(self):
+    writer = self.writer
+    logging.info('Got report: {}'.format(writer.name))
+
+    name = '{}-{}'.format(writer.task_name, writer.name)
+    file_name = self.file_name(name, self.output)
+    file_path = os.path.join(self.directory, file_name)
+    logging.info('Saving report to file {}'.format(file_path))
+
+    export_names = [self.file_name(name, export) for export in self.exports]
+    for path in [file_path] + [os.path.join(self.directory, export_name) for export_name in export_names]:
+      if os.path.isfile(path):
+        raise Exception('File exists: {}'.format(path))
+    os.rename(self.temp_path, file_path)
+    self.file_path = file_path
+    for export, export_name in zip(self.exports, export_names):
+      os.rename(self.part_path(export), os.path.join(self.directory, export_name))
+
+    metadata = writer.metadata()
+    metadata.update({
+      'file_name': file_name,
+      'file_bytes': os.path.getsize(file_path),
+      'compression': self.compression,
+      'exports': export_names or None,
+      'seconds': round(time() - self.started, 3),
+      'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+    if self.delta != None:
+      metadata['delta'] = self.delta.store(file_path, writer.task_name, writer.report_id, writer.name)
+    with io.open('{}.meta.json'.format(file_path), 'w', encoding='utf-8') as file:
+      json.dump(metadata, file, indent=2)
+    logging.info('Report saved: {} results, {} bytes, peak RSS {} KB'.format(
+      metadata['result_count'], metadata['file_bytes'], metadata['peak_rss_kb']))
+    metrics.observe('openvas_report_save_seconds', metadata['seconds'])
+    metrics.set('openvas_report_bytes', metadata['file_bytes'], task=writer.task_name)
+    metrics.set('openvas_report_results', metadata['result_count'], task=writer.task_name)
+    return file_path
+
+  def discard(self):
+    for output in [self.output] + self.exports:
+      if os.path.isfile(self.part_path(output)):
+        os.remove(self.part_path(output))
+    if self.delta != None:
+      self.delta.discard()
+
+class Name_index:
+  '''
+    Client-side name -> id lookup of gvmd objects.
+    Built once per import phase and updated when the client creates objects.
+  '''
+  def __init__(self):
+    self.built = False
+    self.targets = {}
+    self.configs = {}
+    self.tasks = {}
+    self.container_tasks = {}
+    self.ids = set()
+
+  def build(self, targets, configs, tasks, others=()):
+    self.ids = set(el.attrib['id'] for el in others)
+    self.ids.update(el.attrib['id'] for el in targets)
+    self.ids.update(el.attrib['id'] for el in configs)
+    self.ids.update(el.attrib['id'] for el in tasks)
+    self.targets = {el.findtext('name'): el.attrib['id'] for el in targets}
+    self.configs = {el.findtext('name'): el.attrib['id'] for el in configs}
+    self.tasks = {}
+    self.container_tasks = {}
+    for el in tasks:
+      if el.find('target').attrib['id'] == '':
+        self.container_tasks[el.findtext('name')] = el.attrib['id']
+      else:
+        self.tasks[el.findtext('name')] = el.attrib['id']
+    self.built = True
+
+  def add(self, kind:str, name:str, object_id:str):
+    if object_id:
+      self.ids.add(object_id)
+    if name != None and object_id:
+      getattr(self, kind).setdefault(name, object_id)
+
+  def shards(self, kind:str, name:str):
+    '''
+      Returns [(shard name, id)] of the shards of an object, ordered by shard
+    '''
+    shards = []
+    for shard, object_id in getattr(self, kind).items():
+      parsed = parse_shard_name(shard)
+      if parsed != None and parsed[0] == name:
+        shards.append((parsed[1], shard, object_id))
+    return [(shard, object_id) for _, shard, object_id in sorted(shards)]
+
+def shard_name(name:str, index:int, count:int):
+  return '{} [shard {}/{}]'.format(name, index, count)
+
+def parse_shard_name(name:str):
+  '''
+    Returns (original name, index, count) of a shard name, None for other names
+  '''
+  match = re.match(r'^(.*) \[shard (\d+)/(\d+)\]$', name or '')
+  return (match.group(1), int(match.group(2)), int(match.group(3))) if match else None
+
+def host_interval(host:str):
+  '''
+    Returns the (first, last) addresses of a host entry as integers with the IP version,
+    None for host names. Like gvmd, IPv4 networks exclude network and broadcast addresses.
+  '''
+  try:
+    if '/' in host:
+      network = ipaddress.ip_network(host, strict=False)
+      first, last = int(network.network_address), int(network.broadcast_address)
+      if network.version == 4 and network.prefixlen < 31:
+        first, last = first + 1, last - 1
+      return first, last, network.version
+    if '-' in host:
+      start, end = host.split('-', 1)
+      start = ipaddress.ip_address(start)
+      if start.version == 4 and end.isdigit():
+        end = ipaddress.ip_address(int(start) // 256 * 256 + int(end))
+      else:
+        end = ipaddress.ip_address(end)
+      return int(start), int(end), start.version
+    address = ipaddress.ip_address(host)
+    return int(address), int(address), address.version
+  except ValueError:
+    return None
+
+def split_hosts(hosts:list, count:int):
+  '''
+    Splits host entries into count lists with about the same number of addresses,
+    ranges are cut into first-last ranges, host names are dealt out in turn
+  '''
+  intervals, names = [], []
+  for host in hosts:
+    interval = host_interval(host.strip())
+    if interval == None:
+      names.append(host.strip())
+    elif interval[1] >= interval[0]:
+      intervals.append(interval)
+  total = sum(last - first + 1 for first, last, _ in intervals) + len(names)
+  size = -(-total // count)
+  shards = [[] for _ in range(count)]
+  shard, room = 0, size
+  for first, last, version in intervals:
+    while first <= last:
+      end = min(last, first + room - 1)
+      start_address, end_address = ipaddress.ip_address(first), ipaddress.ip_address(end)
+      if version == 6:
+        start_address, end_address = ipaddress.IPv6Address(first), ipaddress.IPv6Address(end)
+      shards[shard].append(str(start_address) if first == end else '{}-{}'.format(start_address, end_address))
+      room -= end - first + 1
+      first = end + 1
+      if room == 0 and shard < count - 1:
+        shard, room = shard + 1, size
+  for name in names:
+    while room == 0 and shard < count - 1:
+      shard, room = shard + 1, size
+    shards[shard].append(name)
+    room -= 1
+  return [hosts for hosts in shards if hosts]
+
+def split_target(target:Target, count:int):
+  '''
+    Returns shard targets splitting the hosts of the target, or the target itself
+    when it has less than shard_min_hosts addresses per shard
+  '''
+  if count <= 1 or not target.hosts:
+    return [target]
+  addresses = sum(interval[1] - interval[0] + 1 if interval else 1
+    for interval in (host_interval(host.strip()) for host in target.hosts))
+  count = min(count, addresses // shard_min_hosts)
+  if count <= 1:
+    return [target]
+  shards = []
+  host_lists = split_hosts(target.hosts, count)
+  for index, hosts in enumerate(host_lists, 1):
+    shard = Target.new(**dict(target.create_args(), name=shard_name(target.name, index, len(host_lists)), hosts=hosts))
+    shards.append(shard)
+  return shards
+
+def shard_tasks(root, index:Name_index):
+  '''
+    Returns a task for the target of the same name or, for a sharded target,
+    one task per shard target, with target ids set
+  '''
+  task = Task(root)
+  target_id = index.targets.get(task.name)
+  if target_id != None:
+    task.target_id = target_id
+    return [task]
+  tasks = []
+  for name, target_id in index.shards('targets', task.name):
+    task = Task(root)
+    task.name = name
+    task.target_id = target_id
+    tasks.append(task)
+  return tasks
+
+def file_digest(file_path:str):
+  digest = hashlib.sha256()
+  with io.open(file_path, 'rb') as file:
+    for chunk in iter(lambda: file.read(stream_chunk_size), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+class Import_manifest:
+  '''
+    Persistent record of imported files: path -> content hash and the id of the
+    object gvmd created from it. Unchanged files whose object still exists are skipped.
+  '''
+  def __init__(self, path:str):
+    self.path = path
+    self.entries = {}
+    self.lock = threading.Lock()
+    self.skipped = 0
+    try:
+      with io.open(path, 'r', encoding='utf-8') as file:
+        self.entries = json.load(file)
+      logging.info('Import manifest loaded: {} files'.format(len(self.entries)))
+    except FileNotFoundError:
+      pass
+    except Exception as ex:
+      logging.error('Reading import manifest error: {}'.format(ex))
+
+  def lookup(self, file_path:str, digest:str):
+    entry = self.entries.get(file_path)
+    if entry != None and entry.get('sha256') == digest:
+      return entry.get('id')
+    return None
+
+  def skip(self):
+    with self.lock:
+      self.skipped += 1
+
+  def record(self, kind:str, file_path:str, digest:str, object_id:str):
+    with self.lock:
+      self.entries[file_path] = {
+        'kind': kind,
+        'sha256': digest,
+        'id': object_id,
+        'imported': datetime.datetime.utcnow().strftime(r'%Y-%m-%dT%H:%M:%SZ'),
+      }
+
+  def recorded_ids(self, kind:str):
+    with self.lock:
+      return sorted(set(entry['id'] for entry in self.entries.values() if entry.get('kind') == kind and entry.get('id')))
+
+  def save(self):
+    with self.lock:
+      try:
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+          os.makedirs(directory)
+        temp_path = '{}.part'.format(self.path)
+        with io.open(temp_path, 'w', encoding='utf-8') as file:
+          json.dump(self.entries, file, indent=2, sort_keys=True)
+        os.rename(temp_path, self.path)
+      except Exception as ex:
+        logging.error('Saving import manifest error: {}'.format(ex))
+
+manifest_check_batch = 100
+
+def manifest_check_commands(manifest:Import_manifest, batch=manifest_check_batch):
+  '''
+    Yields (command, element tag) listing only the reports and overrides recorded in the manifest,
+    in batches of uuid= terms. Reports are listed without details, so the cost does not grow with their results.
+  '''
+  for tag, kind, attrs in (('report', 'reports', {'details': '0', 'ignore_pagination': '1'}), ('override', 'overrides', {})):
+    ids = manifest.recorded_ids(kind)
+    for start in range(0, len(ids), batch):
+      term = 'rows=-1 {}'.format(' or '.join('uuid={}'.format(object_id) for object_id in ids[start:start + batch]))
+      yield ET.tostring(ET.Element('get_{}'.format(kind), filter=term, **attrs)), tag
+
 class GVM_client:
-  def __init__(self, password, socket_path='/var/run/gvmd.sock', user='admin', timeout=10, loglevel=logging.ERROR):
+  def __init__(self, password, socket_path='/var/run/gvmd.sock', user='admin', timeout=10, loglevel=logging.ERROR,
+    capture:Traffic_capture=None, task_defaults=None, target_shards=1):
+    '''
+      capture: records sampled GMP traffic for debugging, nothing is recorded by default
+      task_defaults: hosts_ordering and scanner preferences for imported tasks that do not set them
+      target_shards: imported targets are split into this many shard targets, each with its own task
+    '''
     logging.basicConfig(level=loglevel)
     self.connection_errors = 0
-    self.container_tasks = {}
+    self.index = Name_index()
+    self.manifest = None
+    self.task_defaults = task_defaults or {}
+    self.target_shards = target_shards
     self.password = password
     self.user = user
     self.socketconnection = UnixSocketConnection(path=socket_path, timeout=timeout)
-    self.connection = DebugConnection(self.socketconnection)
+    self.connection = self.socketconnection
     self.transform = EtreeCheckCommandTransform()
-    self.gmp = Gmp(connection=self.connection, transform=self.transform)
+    self.gmp = GMP_session(Gmp(connection=self.connection, transform=self.transform), user, password,
+      socket_connection=self.socketconnection, capture=capture)
     self.connect()
 
   def authenticate(self):
     try:
-      self.gmp.authenticate(self.user, self.password)
+      self.gmp.authenticate()
     except Exception as ex:
+      self.gmp.disconnect()
       logging.error('Unable to authenticate: {}'.format(ex))
 
   def connect(self):
+    '''
+      Authenticates only if there is no live session yet
+    '''
     try:
-      self.authenticate()
-      return self.gmp._connected
+      if not self.gmp.authenticated:
+        self.authenticate()
+      if self.gmp.authenticated:
+        return True
+      self.connection_errors += 1
+      return False
     except Exception as ex:
       self.connection_errors += 1
       logging.error('Can\'t connect to service: {}'.format(ex))
       return False
 
-  def get_xmls(self, directory):
-    results = []
-    for file_name in os.listdir(directory):
-      if file_name.lower().endswith(".xml"):
-        file_path = os.path.join(directory, file_name)
-        logging.info('Reading file {}'.format(file_path))
+  def get_stats(self):
+    return dict(self.gmp.stats)
+
+  def log_stats(self):
+    logging.info('GMP session stats: {}'.format(', '.join(
+      '{}={}'.format(key, val) for key, val in sorted(self.gmp.stats.items()))))
+
+  def build_index(self):
+    '''
+      Fetches targets, configs and tasks once to resolve names without extra round-trips
+    '''
+    if self.connect():
+      try:
+        others = []
+        if self.manifest != None:
+          # ids of imported reports and overrides are only needed to validate the manifest
+          for command, tag in manifest_check_commands(self.manifest):
+            others += self.gmp.send_command(command).xpath(tag)
+        self.index.build(
+          self.gmp.get_targets(filter='rows=-1').xpath('target'),
+          self.gmp.get_configs(filter='rows=-1').xpath('config'),
+          self.gmp.get_tasks(filter='rows=-1').xpath('task'),
+          others)
+        logging.info('Name index built: {} targets, {} configs, {} tasks, {} container tasks'.format(
+          len(self.index.targets), len(self.index.configs), len(self.index.tasks), len(self.index.container_tasks)))
+      except Exception as ex:
+        logging.error('Building name index error: {}'.format(ex))
+    return self.index.built
 
-        with io.open(file_path, 'r', encoding='utf-8') as file:
-          results.append(''.join(file.readlines()))
-    return results
+  def ensure_index(self):
+    return self.index.built or self.build_index()
+
+  def import_once(self, kind:str, file_path:str, import_file):
+    '''
+      Imports the file unless the manifest says it is unchanged and its object still exists
+    '''
+    if self.manifest == None:
+      return import_file(file_path)
+    digest = file_digest(file_path)
+    object_id = self.manifest.lookup(file_path, digest)
+    if object_id != None and object_id in self.index.ids:
+      logging.info('Skipping unchanged file {}'.format(file_path))
+      self.manifest.skip()
+      return object_id
+    object_id = import_file(file_path)
+    if object_id != None:
+      self.manifest.record(kind, file_path, digest, object_id)
+    return object_id
+
+  def save_manifest(self):
+    if self.manifest != None:
+      self.manifest.save()
+
+  def get_xmls(self, directory):
+    '''
+      Lazily parses XML files of the directory, one at a time
+    '''
+    for file_path in iter_xml_files(directory):
+      yield parse_xml_file(file_path)
 
   def wait_connection(self, connection_tries=10, secs_before_attempt=5):
     while not self.connect():
@@ -383,87 +2239,138 @@ class GVM_client:
       else:
         raise Exception('Can\'t connect to gvmd in {} sec'.format(connection_tries*secs_before_attempt))
 
-  def wait_sync(self, interval=15):
+  def get_sync_state(self, scanner_id=default_scanner_id):
+    '''
+      Returns the number of NVTs known to gvmd, feeds currently syncing
+      and whether the scanner has finished loading
+    '''
+    families = self.gmp.get_nvt_families().xpath('families/family')
+    syncing = [feed.findtext('type') or feed.findtext('name') for feed in self.gmp.get_feeds().xpath('feed')
+      if feed.find('currently_syncing') is not None]
+    try:
+      self.gmp.verify_scanner(scanner_id)
+      scanner_ready = True
+    except GvmError:
+      scanner_ready = False
+    return {
+      'families': len(families),
+      'nvts': sum(int(family.findtext('max_nvt_count') or 0) for family in families),
+      'syncing': syncing,
+      'scanner_ready': scanner_ready,
+    }
+
+  def wait_sync(self, timeout=3600, interval=2, max_interval=20, expected_nvts=None, scanner_id=default_scanner_id):
+    '''
+      Returns the NVT count as soon as the scanner answers, no feed is syncing
+      and the NVT count stopped growing. Progress is logged with an ETA when
+      expected_nvts is known, raises if the sync is not over in timeout seconds.
+    '''
     logging.info('Waiting for NVTs/Feeds sync to complete')
+    started = time()
+    previous = None
+    rate = None
+    delay = interval
     while True:
-      if self.connect():
-        families = self.gmp.get_nvt_families().xpath('families/family')
-        feeds = self.gmp.get_feeds().xpath('feed/currently_syncing')
-        if len(families) != 0 and len(feeds) == 0:
-          break
-        else:
-          sleep(interval)
-
-  def import_configs(self, directory):
-    for config in self.get_xmls(directory):
+      state = None
       if self.connect():
         try:
-          response = self.gmp.import_config(config)
-          if response.attrib['status'] == '201':
-            config_root = ET.fromstring(config)
-            config_name = config_root.findtext('config/name')
-            logging.info('Importing config OK: {}'.format(config_name))
-
+          state = self.get_sync_state(scanner_id)
         except Exception as ex:
-          logging.error('Importing config error: {}'.format(ex))
+          logging.info('Sync state is not available yet: {}'.format(ex))
+      now = time()
+
+      if state != None:
+        count = state['nvts']
+        metrics.set('openvas_nvt_count', count)
+        if previous != None and now > previous[0]:
+          growth = max(0, count - previous[1]) / (now - previous[0])
+          rate = growth if rate == None else (rate + growth) / 2
+        loaded = count > 0 and state['scanner_ready'] and not state['syncing']
+        if loaded and previous != None and count == previous[1]:
+          logging.info('NVTs/Feeds are ready: {} NVTs in {} families after {:.0f} sec'.format(
+            count, state['families'], now - started))
+          return count
+
+        eta = ''
+        if expected_nvts and rate and count < expected_nvts:
+          eta = ', ETA {:.0f} sec'.format((expected_nvts - count) / rate)
+        logging.info('Sync: {} NVTs{}{}, scanner {}, feeds syncing: {}'.format(
+          count, ' of {}'.format(expected_nvts) if expected_nvts else '', eta,
+          'ready' if state['scanner_ready'] else 'loading', ', '.join(state['syncing']) or 'none'))
+        # once everything looks loaded one more poll confirms the count is stable
+        delay = interval if loaded or previous == None or count != previous[1] else min(delay * 1.5, max_interval)
+        previous = (now, count)
+      else:
+        delay = min(delay * 1.5, max_interval)
+
+      if now - started >= timeout:
+        raise Exception('NVTs/Feeds sync is not complete after {} sec'.format(timeout))
+      sleep(min(delay, max(0, started + timeout - now)))
+
+  def import_config_file(self, file_path:str):
+    return self.import_once('configs', file_path, self._import_config_file)
+
+  def _import_config_file(self, file_path:str):
+    if self.connect():
+      try:
+        logging.info('Reading file {}'.format(file_path))
+        config_name = read_xml_fields(file_path, {'name': ('config', 'name')}).get('name')
+        response = self.gmp.send_chunks(create_config_chunks(file_path))
+        if response.attrib['status'] == '201':
+          self.index.add('configs', config_name, response.attrib.get('id'))
+          logging.info('Importing config OK: {}'.format(config_name))
+          return response.attrib.get('id')
+
+      except Exception as ex:
+        logging.error('Importing config error: {}'.format(ex))
+
+  def import_configs(self, directory):
+    for file_path in iter_xml_files(directory):
+      self.import_config_file(file_path)
+    self.save_manifest()
 
   def create_target(self, target:Target):
     if self.connect():
       try:
-        response = self.gmp.create_target(
-          name=target.name,
-          make_unique=target.make_unique,
-          hosts=target.hosts,
-          exclude_hosts=target.exclude_hosts,
-          comment=target.comment,
-          alive_tests=target.alive_tests,
-          reverse_lookup_only=target.reverse_lookup_only,
-          reverse_lookup_unify=target.reverse_lookup_unify,
-          port_range=target.port_range,
-          port_list_id=target.port_list_id,
-          asset_hosts_filter=target.asset_hosts_filter,
-          ssh_credential_id=target.ssh_credential_id,
-          ssh_credential_port=target.ssh_credential_port,
-          smb_credential_id=target.smb_credential_id,
-          snmp_credential_id=target.snmp_credential_id,
-          esxi_credential_id=target.esxi_credential_id)
+        response = self.gmp.create_target(**target.create_args())
 
         if response.attrib['status'] == '201':
+          self.index.add('targets', target.name, response.attrib.get('id'))
           logging.info('Importing target OK: {}'.format(target.name))
+          return response.attrib.get('id')
 
       except Exception as ex:
         logging.error('Importing target error: {}'.format(ex))
 
+  def import_target_file(self, file_path:str):
+    return self.import_once('targets', file_path, self._import_target_file)
+
+  def _import_target_file(self, file_path:str):
+    if self.connect():
+      try:
+        target = Target(parse_xml_file(file_path))
+        ids = [self.create_target(shard) for shard in split_target(target, self.target_shards)]
+        return ids[0] if all(ids) else None
+      except Exception as ex:
+        logging.error('Importing target error: {}'.format(ex))
+
   def import_targets(self, directory:str):
     '''
       directory: path to exported targets in XML
     '''
-    for target_config in self.get_xmls(directory):
-      if self.connect():
-        try:
-          target = Target(target_config)
-          self.create_target(target)
-        except Exception as ex:
-          logging.error('Importing target error: {}'.format(ex))
+    for file_path in iter_xml_files(directory):
+      self.import_target_file(file_path)
+    self.save_manifest()
 
   def create_task(self, task:Task):
     if self.connect():
       try:
-        response = self.gmp.create_task(
-          name=task.name,
-          target_id=task.target_id,
-          scanner_id=task.scanner_id,
-          config_id=task.config_id,
-          comment=task.comment,
-          alterable=task.alterable,
-          alert_ids=task.alert_ids,
-          hosts_ordering=task.hosts_ordering,
-          schedule_id=task.schedule_id,
-          schedule_periods=task.schedule_periods,
-          observers=task.observers)
+        response = self.gmp.send_command(task_command(task))
 
         if response.attrib['status'] == '201':
+          self.index.add('tasks', task.name, response.attrib.get('id'))
           logging.info('Importing task OK: {}'.format(task.name))
+          return response.attrib.get('id')
 
       except Exception as ex:
         logging.error('Importing task error: {}'.format(ex))
@@ -471,88 +2378,96 @@ class GVM_client:
   def create_override(self, override:Override):
     if self.connect():
       try:
-        response = self.gmp.create_override(
-          text=override.text,
-          nvt_oid=override.nvt_oid,
-          seconds_active=override.seconds_active,
-          comment=override.comment,
-          hosts=override.hosts,
-          port=override.port,
-          result_id=override.result_id,
-          severity=override.severity,
-          new_severity=override.new_severity,
-          task_id=override.task_id,
-          threat=override.threat,
-          new_threat=override.new_threat)
+        response = self.gmp.create_override(**override.create_args())
 
         if response.attrib['status'] == '201':
           logging.info('Creating override OK: {}'.format(override.text))
+          return response.attrib.get('id')
 
       except Exception as ex:
         logging.error('Creating override error: {}'.format(ex))
 
+  def import_override_file(self, file_path:str):
+    return self.import_once('overrides', file_path, self._import_override_file)
+
+  def _import_override_file(self, file_path:str):
+    if self.connect():
+      try:
+        override = Override(parse_xml_file(file_path))
+        return self.create_override(override)
+
+      except Exception as ex:
+        logging.error('Importing override error: {}'.format(ex))
+
   def import_overrides(self, directory:str):
-    for override_xml in self.get_xmls(directory):
-      if self.connect():
-        try:
-          override = Override(override_xml)
-          self.create_override(override)
+    for file_path in iter_xml_files(directory):
+      self.import_override_file(file_path)
+    self.save_manifest()
 
-        except Exception as ex:
-          logging.error('Importing override error: {}'.format(ex))
+  def import_task_file(self, file_path:str):
+    return self.import_once('tasks', file_path, self._import_task_file)
 
-  def import_tasks(self, directory:str):
-    for task_config in self.get_xmls(directory):
-      if self.connect():
-        try:
-          task = Task(task_config)
+  def _import_task_file(self, file_path:str):
+    if self.connect():
+      try:
+        root = parse_xml_file(file_path)
+        tasks = shard_tasks(root, self.index)
+        if not tasks:
+          logging.log(logging.DEBUG, 'Importing task - {}. No target_id found'.format(Task(root).name))
+          return None
 
-          task.target_id = None
-          for target in self.gmp.get_targets().xpath('target'):
-            target_name = target.find('name').text
-            if target_name == task.name:
-              task.target_id = target.attrib['id']
-              logging.log(logging.DEBUG, 'Importing task - target_id: {}'.format(task.target_id))
+        ids = []
+        for task in tasks:
+          logging.log(logging.DEBUG, 'Importing task - target_id: {}'.format(task.target_id))
+          task.config_id = self.index.configs.get(task.config_name)
+          logging.log(logging.DEBUG, 'Importing task - config_id: {}'.format(task.config_id))
+          ids.append(self.create_task(task.apply_defaults(self.task_defaults)))
+        return ids[0] if all(ids) else None
 
-          if task.target_id == None:
-            logging.log(logging.DEBUG, 'Importing task - {}. No target_id found'.format(task.name))
-            continue
+      except Exception as ex:
+        logging.error('Importing task error: {}'.format(ex))
+
+  def import_tasks(self, directory:str):
+    self.ensure_index()
+    for file_path in iter_xml_files(directory):
+      self.import_task_file(file_path)
+    self.save_manifest()
 
-          task.config_id = None
-          for config in self.gmp.get_configs().xpath('config'):
-            if config.find('name').text == task.config['name']:
-              task.config_id = config.attrib['id']
-              logging.log(logging.DEBUG, 'Importing task - config_id: {}'.format(task.config_id))
-              break
+  def get_container_task(self, task_name:str, task_comment=None):
+    '''
+      Returns id of the container task for imported reports, creating it if needed
+    '''
+    if task_name not in self.index.container_tasks:
+      response = self.gmp.send_command(container_task_command(task_name, task_comment))
+      if response.attrib['status'] == '201':
+        logging.log(logging.DEBUG, 'Created container task: {}[{}]'.format(task_name, response.attrib['id']))
+        self.index.add('container_tasks', task_name, response.attrib['id'])
+    return self.index.container_tasks.get(task_name)
 
-          self.create_task(task)
+  def import_report_file(self, file_path:str):
+    return self.import_once('reports', file_path, self._import_report_file)
 
-        except Exception as ex:
-          logging.error('Importing task error: {}'.format(ex))
+  def _import_report_file(self, file_path:str):
+    '''
+      Streams the report file to gvmd without loading it in memory
+    '''
+    if self.connect():
+      try:
+        logging.info('Reading file {}'.format(file_path))
+        report = Report.from_file(file_path)
+        task_id = self.get_container_task(report.task_name, report.task_comment)
+        response = self.gmp.send_chunks(create_report_chunks(file_path, report, task_id))
+        if response.attrib['status'] == '201':
+          logging.info('Importing report OK: {}'.format(report.task_name))
+          return response.attrib.get('id')
+      except Exception as ex:
+        logging.error('Importing report error: {}'.format(ex))
 
   def import_reports(self, directory):
-    for report_xml in self.get_xmls(directory):
-      if self.connect():
-        try:
-          report = Report(report_xml)
-
-          if report.task_name not in self.container_tasks.keys():
-            response = self.gmp.import_report(report_xml, task_name=report.task_name, task_comment=report.task_comment)
-
-            if response.attrib['status'] == '201':
-              logging.info('Importing report OK: {}'.format(report.task_name))
-              tasks = self.gmp.get_tasks().xpath('task')
-              for task in tasks:
-                if task.find('name').text == report.task_name and self._is_container_task(task):
-                  logging.log(logging.DEBUG, 'Found container task: {}[{}]'.format(report.task_name, task.attrib['id']))
-                  self.container_tasks[report.task_name] = task.attrib['id']
-                  break
-          else:
-            response = self.gmp.import_report(report_xml, task_id=self.container_tasks[report.task_name])
-            if response.attrib['status'] == '201':
-              logging.info('Importing report OK: {}'.format(report.task_name))
-        except Exception as ex:
-          logging.error('Importing report error: {}'.format(ex))
+    self.ensure_index()
+    for file_path in iter_xml_files(directory):
+      self.import_report_file(file_path)
+    self.save_manifest()
 
   def get_task(self, task_id):
     if self.connect():
@@ -580,6 +2495,22 @@ class GVM_client:
       except Exception as ex:
         logging.error('Getting task status error: {}'.format(ex))
 
+  def get_task_statuses(self, task_ids:list):
+    '''
+      Returns {task id: Task_status} of the given tasks with one get_tasks call
+    '''
+    if len(task_ids) == 0:
+      return {}
+    if self.connect():
+      try:
+        task_filter = 'rows=-1 {}'.format(' or '.join('uuid={}'.format(task_id) for task_id in task_ids))
+        response = self.gmp.get_tasks(filter=task_filter, details=False)
+        statuses = [Task_status(task) for task in response.xpath('task')]
+        return {status.id: status for status in statuses if status.id in task_ids}
+      except Exception as ex:
+        logging.error('Getting task statuses error: {}'.format(ex))
+    return {}
+
   def run_task(self, task_id:str):
     if self.connect():
       try:
@@ -619,24 +2550,265 @@ class GVM_client:
         logging.error('Getting tasks error: {}'.format(ex))
         return False
 
-  def save_report(self, report_id:str, directory:str):
+  def fetch_report(self, writer:Report_writer, report_id:str, page_size=None):
+    '''
+      Streams the report into the writer, page by page when page_size is set
+    '''
+    writer.begin_report(report_id, page_size)
+    while True:
+      count = writer.consume(self.gmp.stream(get_report_command(writer, report_id, page_size)))
+      if last_report_page(writer, count, page_size):
+        break
+      logging.debug('Getting report {} page {}: {} results so far'.format(report_id, writer.pages + 1, writer.result_count))
+
+  def save_report(self, report_id:str, directory:str, compression=None, page_size=None, output='xml',
+    merge_report_ids=(), task_name=None, delta=False, exports=(), result_filter:Report_filter=None):
+    '''
+      Streams the report to disk without building it in memory.
+      compression: None, 'gzip' or 'zstd'.
+      page_size: fetch results in pages of this size instead of one response.
+      output: 'xml', 'jsonl' (one result per line), 'csv', 'parquet' (requires pyarrow)
+        or 'columnar' (parquet when pyarrow is installed, csv otherwise).
+      merge_report_ids: reports whose results are appended, e.g. of the other shards of a scan.
+      task_name: task name written instead of the one in the report.
+      delta: also write the new, changed and resolved results since the previous saved report of the task.
+      exports: other outputs written next to the report file from the same download.
+      result_filter: Report_filter of the results to keep, applied by gvmd where it can.
+      A <report file>.meta.json sidecar with report metadata is written next to it.
+    '''
     if self.connect():
+      report_file = Report_file(directory, report_id, compression, output, task_name, delta, exports, result_filter,
+        merge=bool(merge_report_ids))
       try:
-        raw_report = self.gmp.get_report(report_id).find('report')
-        report = Report(raw_report)
-        logging.info('Got report: {}'.format(report.name))
+        with report_file.open() as writer:
+          for _report_id in [report_id] + list(merge_report_ids):
+            self.fetch_report(writer, _report_id, page_size)
+          writer.finish()
+        report_file.store()
+        return True
+      except Exception as ex:
+        logging.error('Saving report error: {}'.format(ex))
+        report_file.discard()
+        return False
 
-        file_name = '{}-{}.xml'.format(report.task_name, report.name)
-        file_path = os.path.join(directory, file_name)
-        logging.info('Saving report to file {}'.format(file_path))
+class Import_phase:
+  def __init__(self, name:str, jobs:list):
+    self.name = name
+    self.jobs = jobs
+    self.files = sum(len(job) for job in jobs)
+    self.imported = 0
+    self.started = None
+    self.finished = None
+    self.lock = threading.Lock()
+
+  def done(self, imported:bool):
+    with self.lock:
+      self.imported += int(imported)
+      self.finished = time()
+
+  def seconds(self):
+    return (self.finished or time()) - (self.started or time())
+
+def plan_imports(configs_path=None, targets_path=None, tasks_path=None, reports_path=None, overrides_path=None):
+  '''
+    Returns phases grouped in levels, each level only depends on the previous ones
+  '''
+  def files(directory):
+    if directory == None or not os.path.isdir(directory):
+      return []
+    return list(iter_xml_files(directory))
+
+  def single_jobs(method, directory):
+    return [[(method, file_path)] for file_path in files(directory)]
+
+  reports = {}
+  for file_path in files(reports_path):
+    try:
+      task_name = Report.from_file(file_path).task_name
+    except Exception as ex:
+      logging.error('Reading report error: {}'.format(ex))
+      continue
+    # reports of one task share a container task, so they are imported by one worker
+    reports.setdefault(task_name, []).append((GVM_client.import_report_file, file_path))
 
-        if os.path.isfile(file_path):
-          raise Exception('File exists: {}'.format(file_path))
+  overrides, bound_overrides = [], []
+  for file_path in files(overrides_path):
+    try:
+      override = Override(parse_xml_file(file_path))
+    except Exception as ex:
+      logging.error('Reading override error: {}'.format(ex))
+      continue
+    job = [(GVM_client.import_override_file, file_path)]
+    if override.result_id != None or override.task_id != None:
+      bound_overrides.append(job)
+    else:
+      overrides.append(job)
+
+  return [
+    [
+      Import_phase('configs', single_jobs(GVM_client.import_config_file, configs_path)),
+      Import_phase('targets', single_jobs(GVM_client.import_target_file, targets_path)),
+      Import_phase('reports', list(reports.values())),
+      Import_phase('overrides', overrides),
+    ],
+    [
+      Import_phase('tasks', single_jobs(GVM_client.import_task_file, tasks_path)),
+      Import_phase('report overrides', bound_overrides),
+    ],
+  ]
+
+class Import_pipeline:
+  '''
+    Imports configs, targets, tasks, reports and overrides in parallel
+    over a pool of GMP connections, keeping the ordering constraints:
+    configs and targets before tasks, reports before report-bound overrides.
+  '''
+  def __init__(self, client_factory, parallelism=4, manifest:Import_manifest=None):
+    self.parallelism = max(1, parallelism)
+    self.index = Name_index()
+    self.manifest = manifest
+    self.clients = queue.Queue()
+    for _ in range(self.parallelism):
+      client = client_factory()
+      client.index = self.index
+      client.manifest = manifest
+      self.clients.put(client)
+
+  def _run_job(self, phase:Import_phase, job:list):
+    client = self.clients.get()
+    try:
+      for import_file, file_path in job:
+        phase.done(import_file(client, file_path) != None)
+    finally:
+      self.clients.put(client)
+
+  def _run_level(self, executor, phases:list):
+    futures = []
+    for phase in phases:
+      phase.started = time()
+      phase.finished = phase.started
+      futures += [executor.submit(self._run_job, phase, job) for job in phase.jobs]
+    for future in futures:
+      try:
+        future.result()
+      except Exception as ex:
+        logging.error('Import pipeline error: {}'.format(ex))
 
-        with io.open(file_path, 'wb') as file:
-          file.write(ET.tostring(raw_report, encoding='utf-8', method='xml', pretty_print=True))
+  def run(self, **paths):
+    started = time()
+    client = self.clients.get()
+    try:
+      client.build_index()
+    finally:
+      self.clients.put(client)
+
+    levels = plan_imports(**paths)
+    with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+      for phases in levels:
+        self._run_level(executor, phases)
+
+    if self.manifest != None:
+      self.manifest.save()
+      logging.info('Unchanged files skipped: {}'.format(self.manifest.skipped))
+    logging.info('Import finished in {:.1f} sec with {} connections'.format(time() - started, self.parallelism))
+    for phases in levels:
+      for phase in phases:
+        logging.info('  {}: {}/{} files imported in {:.1f} sec'.format(
+          phase.name, phase.imported, phase.files, phase.seconds()))
+    return levels
+
+  def close(self):
+    while not self.clients.empty():
+      client = self.clients.get()
+      client.log_stats()
+      client.gmp.disconnect()
+
+class Task_watch:
+  '''
+    Status and progress history of a watched task, decides when it is polled next
+  '''
+  __slots__ = ('callback', 'status', 'progress', 'since', 'start_progress', 'interval', 'due')
+
+  def __init__(self, callback):
+    self.callback = callback
+    self.status = None
+    self.progress = None
+    self.since = None
+    self.start_progress = None
+    self.interval = 0
+    self.due = 0
+
+  def eta(self, now:float):
+    '''
+      Seconds until the task is done at its average progress rate, None without progress yet
+    '''
+    if self.since == None or self.progress == None or self.progress <= self.start_progress or now <= self.since:
+      return None
+    rate = (self.progress - self.start_progress) / (now - self.since)
+    return (100 - self.progress) / rate
 
-        return True
-      except Exception as ex:
-        logging.error('Getting targets error: {}'.format(ex))
-        return False
+  def update(self, status, now:float, min_secs:float, max_secs:float):
+    '''
+      Records a polled status and schedules the next poll: soon after a status change,
+      at half the ETA once progress moves and backing off until then
+    '''
+    changed = status.status != self.status
+    progress = status.progress if status.progress != None and status.progress >= 0 else None
+    if changed or progress == None or (self.progress != None and progress < self.progress):
+      self.since, self.start_progress = now, progress
+    self.status, self.progress = status.status, progress
+    eta = self.eta(now)
+    if changed:
+      interval = min_secs
+    elif eta != None:
+      interval = eta / 2
+    else:
+      interval = self.interval * 2
+    self.interval = max(min_secs, min(interval, max_secs))
+    self.due = now + self.interval
+    return changed
+
+class Task_poller:
+  '''
+    Polls status, progress and last report of the watched tasks that are due
+    with one get_tasks call and passes status changes to the task callbacks:
+    callback(status:Task_status, previous_status:str).
+    Each task is polled again after min_secs to max_secs depending on its ETA.
+  '''
+  def __init__(self, client:GVM_client, min_secs=poll_min_secs, max_secs=poll_max_secs):
+    self.client = client
+    self.min_secs = min_secs
+    self.max_secs = max_secs
+    self.watched = {}
+    self.polled = []
+
+  def watch(self, task_id:str, callback):
+    self.watched[task_id] = Task_watch(callback)
+
+  def unwatch(self, task_id:str):
+    self.watched.pop(task_id, None)
+
+  def next_poll(self):
+    '''
+      Seconds until the next task is due, None when nothing is watched
+    '''
+    if not self.watched:
+      return None
+    return max(0, min(watch.due for watch in self.watched.values()) - time())
+
+  def poll(self, force=False):
+    '''
+      Polls the tasks that are due, or all watched tasks with force
+    '''
+    now = time()
+    self.polled = [task_id for task_id, watch in self.watched.items() if force or watch.due <= now]
+    statuses = self.client.get_task_statuses(self.polled)
+    now = time()
+    for task_id, status in statuses.items():
+      watch = self.watched.get(task_id)
+      if watch == None:
+        continue
+      previous = watch.status
+      if watch.update(status, now, self.min_secs, self.max_secs):
+        watch.callback(status, previous)
+    return statuses
@@ -0,0 +1,371 @@
+'''
+  Reconciles the targets, tasks and overrides of gvmd with the XML files of the
+  import directories. Existing objects are listed once and matched by name,
+  overrides by NVT, hosts, port, severity, task and result. Only what differs is
+  created, modified or deleted, as one plan that can be logged without applying it.
+'''
+
+import os
+import re
+import logging
+import lxml.etree as ET
+from gvm_client import (Command_builder, Override, Target, Task, iter_xml_files, parse_shard_name, parse_xml_file,
+  split_target)
+
+# only what modify_target and modify_override can change, other differences would be planned on every run
+target_keys = ('hosts', 'exclude_hosts', 'comment', 'port_list_id', 'alive_tests',
+  'reverse_lookup_only', 'reverse_lookup_unify', 'ssh_credential_id', 'smb_credential_id',
+  'snmp_credential_id', 'esxi_credential_id')
+# gvmd only changes the name and comment of a target used by tasks
+target_in_use_keys = tuple(key for key in target_keys if key != 'comment')
+# modify_target can set these empty, credentials are removed with id 0; other empty values are left as they are
+target_clearable_keys = ('comment', 'exclude_hosts', 'ssh_credential_id', 'smb_credential_id', 'snmp_credential_id',
+  'esxi_credential_id')
+task_keys = ('comment', 'target', 'config', 'scanner_id', 'hosts_ordering', 'schedule_id', 'schedule_periods',
+  'alert_ids', 'observers')
+override_keys = ('text', 'new_severity', 'new_threat')
+list_keys = ('hosts', 'exclude_hosts', 'alert_ids', 'observers')
+
+def xml_files(directory):
+  if directory == None or not os.path.isdir(directory):
+    return []
+  return iter_xml_files(directory)
+
+def compared(model, keys):
+  '''
+    Returns the values of keys set by the model, lists sorted for comparison
+  '''
+  values = {}
+  for key in keys:
+    value = getattr(model, key, None)
+    if key in list_keys and value != None:
+      value = sorted(host.strip() for host in value)
+    if value != None:
+      values[key] = value
+  return values
+
+def diff(current:dict, desired:dict):
+  '''
+    Returns {key: (current value, desired value)} of the keys set in desired that differ
+  '''
+  return {key: (current.get(key), value) for key, value in desired.items() if current.get(key) != value}
+
+empty_values = ('', [])
+
+def target_values(target:Target):
+  '''
+    Compared values of a desired target without the empty ones gvmd can not set
+  '''
+  return {key: value for key, value in compared(target, target_keys).items()
+    if key in target_clearable_keys or value not in empty_values}
+
+def target_diff(current:Target, desired:Target):
+  '''
+    Same as diff, a missing and an empty value are the same
+  '''
+  return {key: (current_value, value) for key, (current_value, value)
+    in diff(compared(current, target_keys), target_values(desired)).items()
+    if current_value not in (None,) + empty_values or value not in empty_values}
+
+def override_key(override:Override):
+  return (override.nvt_oid, tuple(sorted(override.hosts or [])), override.port or None,
+    override.severity or None, override.task_id, override.result_id)
+
+def task_values(task:Task):
+  values = compared(task, task_keys)
+  values.update((key, value) for key, value in [('target', task.target_name), ('config', task.config_name)]
+    if value != None)
+  for name, value in sorted((task.preferences or {}).items()):
+    values['preference:{}'.format(name)] = value
+  return values
+
+class Change:
+  '''
+    One planned create, modify or delete of a target, task or override.
+    A skip is a difference gvmd does not allow to apply, it is only logged.
+    Tasks are deleted to the trashcan unless ultimate is set.
+  '''
+  __slots__ = ('action', 'kind', 'name', 'object_id', 'fields', 'desired', 'reason', 'ultimate')
+
+  def __init__(self, action:str, kind:str, name:str, object_id=None, fields=None, desired=None, reason=None):
+    self.action = action
+    self.kind = kind
+    self.name = name
+    self.object_id = object_id
+    self.fields = fields or {}
+    self.desired = desired
+    self.reason = reason
+    self.ultimate = kind != 'task'
+
+  def __str__(self):
+    details = ', '.join('{}: {!r} -> {!r}'.format(key, current, value)
+      for key, (current, value) in sorted(self.fields.items()))
+    return '{} {} {}{}{}'.format(self.action, self.kind, self.name,
+      ' ({})'.format(self.reason) if self.reason else '', ': {}'.format(details) if details else '')
+
+class Reconciler:
+  '''
+    Plans and applies the changes that make gvmd match the import directories.
+    Renamed copies left by make_unique, tasks of the same name without reports
+    and repeated overrides are deleted; with prune, every target, task and
+    override that is not in the files is deleted too.
+  '''
+  def __init__(self, client, prune=False):
+    self.client = client
+    self.prune = prune
+
+  def desired(self, targets_path=None, tasks_path=None, overrides_path=None):
+    '''
+      Reads the files, targets split into shards as on import
+    '''
+    targets, tasks, overrides = [], [], []
+    for file_path in xml_files(targets_path):
+      target = Target(parse_xml_file(file_path))
+      for shard in split_target(target, self.client.target_shards):
+        shard.make_unique = False
+        targets.append(shard)
+    target_names = set(target.name for target in targets)
+    for file_path in xml_files(tasks_path):
+      root = parse_xml_file(file_path)
+      name = Task(root).name
+      names = [name] if name in target_names else sorted(
+        (shard for shard in target_names if (parse_shard_name(shard) or [None])[0] == name),
+        key=lambda shard: parse_shard_name(shard)[1])
+      if not names:
+        logging.error('Reconciling task {}: no target found'.format(name))
+      for target_name in names:
+        task = Task(root).apply_defaults(self.client.task_defaults)
+        task.name = target_name
+        task.target_name = target_name
+        tasks.append(task)
+    for file_path in xml_files(overrides_path):
+      overrides.append(Override(parse_xml_file(file_path)))
+    return targets, tasks, overrides
+
+  def existing(self):
+    '''
+      Lists targets, configs, tasks and overrides once and rebuilds the client name index from them.
+      Returns targets, [(task, report count)] without container tasks and overrides.
+    '''
+    gmp = self.client.gmp
+    targets = gmp.get_targets(filter='rows=-1').xpath('target')
+    tasks = gmp.get_tasks(filter='rows=-1', details=True).xpath('task')
+    self.client.index.build(targets, gmp.get_configs(filter='rows=-1').xpath('config'), tasks)
+    overrides = gmp.get_overrides(filter='rows=-1', details=True).xpath('override')
+    return ([Target(element) for element in targets],
+      [(Task(element), int(element.findtext('report_count') or 0)) for element in tasks
+        if element.find('target').get('id')],
+      [Override(element) for element in overrides])
+
+  def plan_targets(self, desired:list, existing:list, used:set, in_use:set):
+    '''
+      used: targets still used once the planned task changes are applied,
+      in_use: targets used by tasks now, while targets are modified
+    '''
+    changes = []
+    by_name = {}
+    for target in existing:
+      by_name.setdefault(target.name, target)
+    for target in desired:
+      current = by_name.get(target.name)
+      if current == None:
+        changes.append(Change('create', 'target', target.name, desired=target))
+        continue
+      fields = target_diff(current, target)
+      locked = {key: value for key, value in fields.items() if key in target_in_use_keys} \
+        if current.id in in_use else {}
+      fields = {key: value for key, value in fields.items() if key not in locked}
+      if fields:
+        changes.append(Change('modify', 'target', target.name, current.id, fields, target))
+      if locked:
+        changes.append(Change('skip', 'target', target.name, current.id, locked, target,
+          reason='in use by tasks, gvmd can not change it'))
+      values = compared(target, target_keys)
+      copies = re.compile(r'^{} \d+$'.format(re.escape(target.name)))
+      for copy in existing:
+        if copies.match(copy.name) and copy.id not in used and not diff(compared(copy, target_keys), values):
+          changes.append(Change('delete', 'target', copy.name, copy.id, reason='copy of {}'.format(target.name)))
+    if self.prune:
+      kept = set(target.name for target in desired)
+      deleted = set(change.object_id for change in changes)
+      for target in existing:
+        if target.name not in kept and target.id not in deleted and target.id not in used:
+          changes.append(Change('delete', 'target', target.name, target.id, reason='not in files'))
+    return changes
+
+  def plan_tasks(self, desired:list, existing:list):
+    changes = []
+    by_name = {}
+    for task, reports in existing:
+      by_name.setdefault(task.name, []).append((task, reports))
+    for task in desired:
+      current = by_name.get(task.name)
+      if not current:
+        changes.append(Change('create', 'task', task.name, desired=task))
+        continue
+      # the task with most reports is kept, copies without reports are deleted
+      current.sort(key=lambda item: -item[1])
+      kept = current[0][0]
+      fields = diff(task_values(kept), task_values(task))
+      if fields:
+        changes.append(Change('modify', 'task', task.name, kept.id, fields, task))
+      for copy, reports in current[1:]:
+        if reports == 0:
+          changes.append(Change('delete', 'task', copy.name, copy.id, reason='copy without reports'))
+    if self.prune:
+      kept = set(task.name for task in desired)
+      for name, current in by_name.items():
+        if name not in kept:
+          changes.extend(Change('delete', 'task', task.name, task.id, reason='not in files') for task, _ in current)
+    return changes
+
+  def plan_overrides(self, desired:list, existing:list):
+    changes = []
+    by_key = {}
+    for override in existing:
+      by_key.setdefault(override_key(override), []).append(override)
+    for override in desired:
+      name = '{} on {}'.format(override.nvt_oid, ', '.join(override.hosts or []) or 'any host')
+      current = by_key.pop(override_key(override), None)
+      if not current:
+        changes.append(Change('create', 'override', name, desired=override))
+        continue
+      fields = diff(compared(current[0], override_keys), compared(override, override_keys))
+      if fields:
+        changes.append(Change('modify', 'override', name, current[0].id, fields, override))
+      changes.extend(Change('delete', 'override', name, copy.id, reason='duplicate') for copy in current[1:])
+    for current in by_key.values():
+      for copy in current[1:] if not self.prune else current:
+        name = '{} on {}'.format(copy.nvt_oid, ', '.join(copy.hosts or []) or 'any host')
+        changes.append(Change('delete', 'override', name, copy.id, reason='not in files' if self.prune else 'duplicate'))
+    return changes
+
+  def plan(self, targets_path=None, tasks_path=None, overrides_path=None):
+    '''
+      Returns the changes in the order they are applied: targets and tasks are created
+      and modified first, tasks are deleted before the targets they use
+    '''
+    targets_path, tasks_path, overrides_path = [path if path != None and os.path.isdir(path) else None
+      for path in [targets_path, tasks_path, overrides_path]]
+    targets, tasks, overrides = self.desired(targets_path, tasks_path, overrides_path)
+    current_targets, current_tasks, current_overrides = self.existing()
+    task_changes = self.plan_tasks(tasks, current_tasks) if tasks_path != None else []
+    # targets stay in use unless their tasks are deleted or moved to another target first
+    released = set(change.object_id for change in task_changes
+      if change.action == 'delete' or (change.action == 'modify' and 'target' in change.fields))
+    used = set(task.target_id for task, _ in current_tasks if task.id not in released)
+    in_use = set(task.target_id for task, _ in current_tasks)
+    target_changes = self.plan_targets(targets, current_targets, used, in_use) if targets_path != None else []
+    override_changes = self.plan_overrides(overrides, current_overrides) if overrides_path != None else []
+    # gvmd does not delete a target used by a task in the trashcan
+    deleted_targets = set(change.object_id for change in target_changes if change.action == 'delete')
+    task_targets = {task.id: task.target_id for task, _ in current_tasks}
+    for change in task_changes:
+      if change.action == 'delete' and task_targets.get(change.object_id) in deleted_targets:
+        change.ultimate = True
+    changes = [change for change in target_changes + task_changes if change.action != 'delete'] + \
+      [change for change in task_changes + target_changes if change.action == 'delete'] + override_changes
+    return changes
+
+  def log_plan(self, changes:list):
+    for change in changes:
+      logging.info('Reconcile plan: {}'.format(change))
+    counts = {}
+    for change in changes:
+      key = '{} {}'.format(change.action, change.kind)
+      counts[key] = counts.get(key, 0) + 1
+    logging.info('Reconcile plan: {}'.format(', '.join('{} {}'.format(count, key)
+      for key, count in sorted(counts.items())) or 'nothing to change'))
+
+  def modify_task_command(self, change:Change):
+    task = change.desired
+    index = self.client.index
+    fields = change.fields
+    command = ET.fromstring(Command_builder().modify_task(change.object_id,
+      comment=task.comment if 'comment' in fields else None,
+      observers=task.observers if 'observers' in fields else None,
+      schedule=task.schedule_id if 'schedule_id' in fields else None,
+      schedule_periods=task.schedule_periods if 'schedule_periods' in fields else None,
+      scanner=task.scanner_id if 'scanner_id' in fields else None,
+      preferences={key.split(':', 1)[1]: value for key, (_, value) in fields.items() if key.startswith('preference:')}))
+    # python-gvm modify_task has no target, config, hosts ordering or several alerts
+    if 'target' in fields:
+      ET.SubElement(command, 'target', id=index.targets.get(task.target_name) or '')
+    if 'config' in fields:
+      ET.SubElement(command, 'config', id=index.configs.get(task.config_name) or '')
+    if 'hosts_ordering' in fields:
+      ET.SubElement(command, 'hosts_ordering').text = task.hosts_ordering
+    if 'alert_ids' in fields:
+      for alert_id in task.alert_ids:
+        ET.SubElement(command, 'alert', id=alert_id)
+    return ET.tostring(command, encoding='unicode')
+
+  def modify_target_command(self, change:Change):
+    target = change.desired
+    command = ET.fromstring(Command_builder().modify_target(change.object_id,
+      **{key: getattr(target, key) for key in change.fields}))
+    # python-gvm modify_target drops empty values, they are sent as empty elements
+    for key in target_clearable_keys:
+      if key in change.fields and not getattr(target, key):
+        if key.endswith('_credential_id'):
+          ET.SubElement(command, key[:-len('_id')], id='0')
+        else:
+          ET.SubElement(command, key)
+    return ET.tostring(command, encoding='unicode')
+
+  def apply_change(self, change:Change):
+    client, gmp = self.client, self.client.gmp
+    if change.action == 'create':
+      if change.kind == 'target':
+        return client.create_target(change.desired) != None
+      if change.kind == 'task':
+        task = change.desired
+        task.target_id = client.index.targets.get(task.target_name)
+        task.config_id = client.index.configs.get(task.config_name)
+        return task.target_id != None and client.create_task(task) != None
+      return client.create_override(change.desired) != None
+    if change.action == 'modify':
+      if change.kind == 'target':
+        response = gmp.send_command(self.modify_target_command(change))
+      elif change.kind == 'task':
+        response = gmp.send_command(self.modify_task_command(change))
+      else:
+        args = change.desired.create_args()
+        args.pop('nvt_oid')
+        args.pop('comment')
+        response = gmp.modify_override(change.object_id, **args)
+    else:
+      response = getattr(gmp, 'delete_{}'.format(change.kind))(change.object_id, ultimate=change.ultimate)
+    return response.get('status', '')[:1] == '2'
+
+  def apply(self, changes:list):
+    '''
+      Applies the changes in order, returns the number of failed ones
+    '''
+    failed = skipped = 0
+    for change in changes:
+      if change.action == 'skip':
+        skipped += 1
+        logging.warning('Reconcile skipped: {}'.format(change))
+        continue
+      try:
+        done = self.client.connect() and self.apply_change(change)
+      except Exception as ex:
+        logging.error('Reconcile {}: {}'.format(change, ex))
+        done = False
+      if done:
+        logging.info('Reconciled: {}'.format(change))
+      else:
+        failed += 1
+        logging.error('Reconcile failed: {}'.format(change))
+    logging.info('Reconcile applied {} of {} changes{}'.format(len(changes) - skipped - failed, len(changes) - skipped,
+      ', skipped {}'.format(skipped) if skipped else ''))
+    return failed
+
+  def run(self, targets_path=None, tasks_path=None, overrides_path=None, dry_run=False):
+    changes = self.plan(targets_path, tasks_path, overrides_path)
+    self.log_plan(changes)
+    if dry_run:
+      return changes
+    self.apply(changes)
+    return changes
@@ -0,0 +1,316 @@
+'''
+  Runs one shared list of tasks on several gvmd instances. Every task is placed
+  on the least loaded endpoint, created there on first use, moved to another
+  endpoint when its endpoint fails, and its report is saved into one directory.
+'''
+
+import os
+import logging
+from time import sleep, time
+from gvm_client import (GVM_client, Target, Task, Task_poller, iter_xml_files, metrics, parse_xml_file,
+  poll_min_secs, read_xml_fields)
+
+running_statuses = ['Requested', 'Queued', 'Running']
+
+metrics.describe('openvas_endpoint_up', 'gauge', 'Whether a gvmd endpoint of the scheduler accepts tasks')
+metrics.describe('openvas_endpoint_tasks_running', 'gauge', 'Tasks the scheduler runs on a gvmd endpoint')
+metrics.describe('openvas_endpoint_failures_total', 'counter', 'Failed commands and polls of a gvmd endpoint')
+
+class Fanout_job:
+  '''
+    One task of the shared list with its target, and where it currently runs
+  '''
+  def __init__(self, task_root, target:Target):
+    self.task_root = task_root
+    self.name = Task(task_root).name
+    self.target = target
+    self.endpoint = None
+    self.task_id = None
+    self.progress = 0
+    self.tries = 0
+    self.not_before = 0
+    self.avoid = None
+    self.started = None
+    self.finished = None
+    self.result = None
+
+  def duration(self):
+    if self.started == None:
+      return None
+    return (self.finished or time()) - self.started
+
+class Endpoint:
+  '''
+    One gvmd instance. Its load is the remaining work of the jobs it runs:
+    a job counts 1 when it starts and goes down to 0 with its progress.
+    After failure_limit failures in a row the endpoint is taken out of
+    placement for retry_secs and its jobs are moved to other endpoints.
+  '''
+  def __init__(self, socket_path:str, client_factory, max_concurrent=1, failure_limit=3, retry_secs=60,
+    poller_factory=Task_poller):
+    self.socket_path = socket_path
+    self.client_factory = client_factory
+    self.poller_factory = poller_factory
+    self.max_concurrent = max_concurrent
+    self.failure_limit = failure_limit
+    self.retry_secs = retry_secs
+    self.client = None
+    self.poller = None
+    self.jobs = []
+    self.failures = 0
+    self.down_until = 0
+
+  @property
+  def up(self):
+    return self.client != None and self.down_until <= time()
+
+  def load(self):
+    return sum(1 - max(0, min(job.progress, 100)) / 100 for job in self.jobs)
+
+  def free(self):
+    return self.max_concurrent - len(self.jobs)
+
+  def connect(self, configs_path=None):
+    '''
+      Connects once the endpoint is out of its retry pause. A new connection
+      is only used after gvmd has loaded its feed, configs are imported first.
+    '''
+    if self.client != None or self.down_until > time():
+      return self.client != None
+    client = self.client_factory(self.socket_path)
+    try:
+      state = client.get_sync_state() if client.connect() else None
+    except Exception as ex:
+      logging.info('Endpoint {} is not available yet: {}'.format(self.socket_path, ex))
+      state = None
+    if state == None or not state['nvts'] or not state['scanner_ready'] or state['syncing']:
+      logging.info('Endpoint {} is not ready, next try in {} sec'.format(self.socket_path, self.retry_secs))
+      client.gmp.disconnect()
+      self.down_until = time() + self.retry_secs
+      return False
+    if not client.build_index():
+      client.gmp.disconnect()
+      self.fail('building name index')
+      return False
+    if configs_path != None:
+      for file_path in iter_xml_files(configs_path):
+        if read_xml_fields(file_path, {'name': ('config', 'name')}).get('name') not in client.index.configs:
+          client.import_config_file(file_path)
+    logging.info('Endpoint {} is ready: {} tasks, {} targets'.format(
+      self.socket_path, len(client.index.tasks), len(client.index.targets)))
+    self.client = client
+    self.poller = self.poller_factory(client)
+    self.failures = 0
+    return True
+
+  def fail(self, reason:str):
+    '''
+      Counts a failure, returns the jobs to move when the endpoint is taken out
+    '''
+    self.failures += 1
+    metrics.inc('openvas_endpoint_failures_total', endpoint=self.socket_path)
+    logging.warning('Endpoint {} failed ({}), {} of {} failures'.format(
+      self.socket_path, reason, self.failures, self.failure_limit))
+    if self.failures < self.failure_limit:
+      return []
+    logging.error('Endpoint {} is down, retrying in {} sec, moving {} tasks'.format(
+      self.socket_path, self.retry_secs, len(self.jobs)))
+    jobs, self.jobs = self.jobs, []
+    if self.client != None:
+      self.client.gmp.disconnect()
+    self.client = None
+    self.poller = None
+    self.failures = 0
+    self.down_until = time() + self.retry_secs
+    return jobs
+
+  def ensure_task(self, job:Fanout_job):
+    '''
+      Returns the id of the job task on this endpoint, creating its target and task when missing
+    '''
+    index = self.client.index
+    task_id = index.tasks.get(job.name)
+    if task_id != None:
+      return task_id
+    target_id = index.targets.get(job.target.name) or self.client.create_target(job.target)
+    if target_id == None:
+      return None
+    task = Task(job.task_root)
+    task.target_id = target_id
+    task.config_id = index.configs.get(task.config_name)
+    return self.client.create_task(task.apply_defaults(self.client.task_defaults))
+
+  def start(self, job:Fanout_job):
+    task_id = self.ensure_task(job)
+    if task_id == None:
+      return False
+    # the task may still run here from before the endpoint was taken out
+    status = self.client.get_task_statuses([task_id]).get(task_id)
+    if status == None or (status.status not in running_statuses and not self.client.run_task(task_id)):
+      return False
+    job.endpoint = self
+    job.task_id = task_id
+    job.progress = 0
+    self.jobs.append(job)
+    return True
+
+class Fanout_scheduler:
+  '''
+    Places jobs on the least loaded endpoint with a free slot and follows them until they are over.
+    save_report(client, report_id, task_name=name) is called with the endpoint client when a task is done.
+  '''
+  def __init__(self, endpoints:list, jobs:list, save_report=None, configs_path=None, task_tries=3, retry_secs=5):
+    self.endpoints = endpoints
+    self.jobs = jobs
+    self.save_report = save_report
+    self.configs_path = configs_path
+    self.task_tries = task_tries
+    self.retry_secs = retry_secs
+    self.pending = list(jobs)
+
+  def requeue(self, job:Fanout_job, reason:str):
+    job.endpoint = None
+    if job.tries >= self.task_tries:
+      logging.error('Giving up task {} after {} tries: {}'.format(job.name, job.tries, reason))
+      job.result = reason
+      job.finished = time()
+      metrics.inc('openvas_tasks_finished_total', result=job.result)
+      return
+    logging.warning('Moving task {}: {}'.format(job.name, reason))
+    job.not_before = time() + self.retry_secs
+    self.pending.append(job)
+
+  def move(self, endpoint:Endpoint, reason:str):
+    for job in endpoint.fail(reason):
+      job.avoid = endpoint
+      self.requeue(job, 'endpoint {} is down'.format(endpoint.socket_path))
+
+  def pick(self, job:Fanout_job):
+    '''
+      Returns the least loaded endpoint with a free slot, one the job failed on only when there is no other
+    '''
+    candidates = [endpoint for endpoint in self.endpoints if endpoint.up and endpoint.free() > 0]
+    if not candidates:
+      return None
+    return min(candidates, key=lambda endpoint: (endpoint is job.avoid, endpoint.load(), len(endpoint.jobs),
+      self.endpoints.index(endpoint)))
+
+  def place(self):
+    for job in list(self.pending):
+      if job.not_before > time():
+        continue
+      endpoint = self.pick(job)
+      if endpoint == None:
+        break
+      self.pending.remove(job)
+      job.tries += 1
+      if endpoint.start(job):
+        logging.info('Task {} started on {} (#{} try)'.format(job.name, endpoint.socket_path, job.tries))
+        if job.started == None:
+          job.started = time()
+        endpoint.poller.watch(job.task_id, lambda status, previous, _job=job: self.on_status(_job, status))
+      else:
+        job.avoid = endpoint
+        self.requeue(job, 'could not start on {}'.format(endpoint.socket_path))
+        self.move(endpoint, 'starting task {}'.format(job.name))
+
+  def on_status(self, job:Fanout_job, status):
+    endpoint = job.endpoint
+    if status.status == 'Done':
+      endpoint.jobs.remove(job)
+      endpoint.poller.unwatch(job.task_id)
+      job.endpoint = None
+      job.result = 'Done'
+      job.finished = time()
+      logging.info('Task {} finished on {} in {:.0f} sec'.format(job.name, endpoint.socket_path, job.duration()))
+      metrics.inc('openvas_tasks_finished_total', result=job.result)
+      metrics.observe('openvas_task_scan_seconds', job.duration())
+      if self.save_report != None and status.last_report_id != None:
+        self.save_report(endpoint.client, status.last_report_id, task_name=job.name)
+    elif status.status not in running_statuses:
+      endpoint.jobs.remove(job)
+      endpoint.poller.unwatch(job.task_id)
+      job.avoid = endpoint
+      self.requeue(job, 'task {} on {}'.format(status.status, endpoint.socket_path))
+
+  def poll(self):
+    for endpoint in self.endpoints:
+      if not endpoint.up or not endpoint.jobs:
+        continue
+      statuses = endpoint.poller.poll()
+      for job in endpoint.jobs:
+        if job.task_id in statuses:
+          job.progress = statuses[job.task_id].progress or 0
+      missing = [task_id for task_id in endpoint.poller.polled if task_id not in statuses]
+      if missing:
+        self.move(endpoint, 'no status of {} tasks'.format(len(missing)))
+      elif endpoint.poller.polled:
+        endpoint.failures = 0
+
+  def step(self):
+    '''
+      Connects endpoints, places pending jobs and polls running ones.
+      Returns False once every job is over.
+    '''
+    for endpoint in self.endpoints:
+      endpoint.connect(self.configs_path)
+    self.place()
+    self.poll()
+    running = sum(len(endpoint.jobs) for endpoint in self.endpoints)
+    for endpoint in self.endpoints:
+      metrics.set('openvas_endpoint_up', int(endpoint.up), endpoint=endpoint.socket_path)
+      metrics.set('openvas_endpoint_tasks_running', len(endpoint.jobs), endpoint=endpoint.socket_path)
+    metrics.set('openvas_tasks_running', running)
+    metrics.set('openvas_tasks_queued', len(self.pending))
+    return running > 0 or len(self.pending) > 0
+
+  def next_step(self, poll_secs:float):
+    '''
+      Seconds until a running task is due for polling, at most poll_secs while tasks wait for an endpoint
+    '''
+    waits = [endpoint.poller.next_poll() for endpoint in self.endpoints if endpoint.up and endpoint.jobs]
+    if self.pending or not waits:
+      waits.append(poll_secs)
+    return min(waits)
+
+  def run(self, poll_secs=poll_min_secs, on_step=None):
+    started = time()
+    while self.step():
+      if on_step != None:
+        on_step()
+      sleep(self.next_step(poll_secs))
+    logging.info('Scheduled {} tasks on {} endpoints in {:.0f} sec'.format(
+      len(self.jobs), len(self.endpoints), time() - started))
+    for job in self.jobs:
+      duration = job.duration()
+      logging.info('  {}: {}, {}'.format(job.name, job.result,
+        'not started' if duration == None else '{:.0f} sec'.format(duration)))
+    return self.jobs
+
+def load_jobs(targets_path:str, tasks_path:str):
+  '''
+    Reads the shared task list, every task runs on the target of the same name
+  '''
+  jobs = []
+  if not all(path != None and os.path.isdir(path) for path in [targets_path, tasks_path]):
+    logging.warning('No tasks to schedule: {} or {} is not a directory'.format(targets_path, tasks_path))
+    return jobs
+  targets = {}
+  for file_path in iter_xml_files(targets_path):
+    target = Target(parse_xml_file(file_path))
+    targets[target.name] = target
+  for file_path in iter_xml_files(tasks_path):
+    root = parse_xml_file(file_path)
+    job = Fanout_job(root, targets.get(Task(root).name))
+    if job.target == None:
+      logging.error('Skipping task {}: no target found'.format(job.name))
+      continue
+    jobs.append(job)
+  return jobs
+
+def create_endpoints(socket_paths:list, password:str, user='admin', max_concurrent=1, client_options=None,
+  poller_factory=Task_poller):
+  client_options = client_options or {}
+  return [Endpoint(socket_path,
+    lambda _socket_path: GVM_client(password, socket_path=_socket_path, user=user, **client_options),
+    max_concurrent=max_concurrent, poller_factory=poller_factory) for socket_path in socket_paths]